@@ -1,7 +1,8 @@
 # Importing libraries and files
-from crewai import LLM
-from tools import *
-from crewai import Agent
+from types import MappingProxyType
+from typing import Tuple
+from pydantic import BaseModel, ConfigDict, Field
+from registry import LazyRegistry
 import os
 from dotenv import load_dotenv
 load_dotenv()
@@ -10,89 +11,134 @@ load_dotenv()
 # Set the API key for Google Generative AI
 GOOGLE_API_KEY = os.environ.get("gemini_api_key")
 
-llm = LLM(
-    model="gemini/gemini-2.5-flash",
-    temperature=0.7,
-    api_key=GOOGLE_API_KEY,
-)
-
-# Creating an Experienced Doctor agent
-doctor = Agent(
-    role="Senior Experienced Doctor",
-    goal=(
-        """Thoroughly analyze the patient's query and attached blood test report. \
-        Use advanced medical expertise to provide clear, actionable, and evidence-based medical advice. \
-        Tailor all recommendations to the patient's unique clinical context, referencing recent clinical guidelines or studies where appropriate. \
-        Prioritize patient safety, clarity, and evidence-based guidance."""
-    ),
-    verbose=True,
-    memory=True,
-    backstory=(
-        """You are a board-certified physician with decades of experience in interpreting complex blood test results and managing diverse patient cases. \
-        Your approach is thorough, up-to-date, and always focused on delivering trustworthy, patient-centered care. \
-        You excel at translating lab data into practical medical recommendations that patients can understand and act on."""
-    ),
-    tools=[BloodTestReportTool(), search_tool],
-    llm=llm,
-    max_iter=1,
-    max_rpm=1,
-    allow_delegation=True  # Allow delegation to other specialists
-)
-
-# Creating a verifier agent
-verifier = Agent(
-    role="Blood Report Verifier",
-    goal=(
-        """Carefully inspect the uploaded blood test report to confirm it is a legitimate, complete, and authentic medical document. \
-        Ensure all essential blood markers are present (at least 10 key parameters), and flag any missing, suspicious, or inconsistent data. \
-        Only approve reports that are suitable for clinical analysis and patient care."""
-    ),
-    verbose=True,
-    memory=True,
-    backstory=(
-        """You are a medical documentation specialist with deep expertise in verifying the integrity and completeness of blood test reports. \
-        Your job is to protect patient safety by ensuring only accurate, reliable, and comprehensive lab data is used for further analysis. \
-        You are meticulous, detail-oriented, and uncompromising in your standards for medical documentation."""
-    ),
-    tools=[BloodTestReportTool()],
-    llm=llm,
-    max_iter=1,
-    max_rpm=1,
-    allow_delegation=True
-)
-
-nutritionist = Agent(
-    role="Clinical Nutrition Specialist",
-    goal=(
-        """Review the patient's blood test results and provide at least 3 personalized, evidence-based nutrition and supplement recommendations. \
-        Address any deficiencies or health risks identified in the report, and support the patient's recovery and long-term health with clear, practical advice."""
+# Stream tokens so /status/{job_id}/stream can forward agent output as it is written
+LLM_STREAM = os.environ.get("LLM_STREAM", "false").lower() == "true"
+
+# The LLM is built on first use (`from agents import llm`) and shared by every
+# job in the process; importing this module does not load crewai
+registry = LazyRegistry("agent")
+
+
+@registry.register("llm")
+def build_llm():
+    from crewai import LLM
+    from llm_cache import install_llm_cache
+    from rate_limiter import install_rate_limiter
+    from telemetry import install_llm_telemetry
+
+    # Responses are cached by model, temperature, prompt and tool outputs (see llm_cache.py);
+    # only cache misses reach the shared rate limiter (see rate_limiter.py). The llm.call
+    # span (see telemetry.py) covers both
+    return install_llm_telemetry(install_llm_cache(install_rate_limiter(LLM(
+        model="gemini/gemini-2.5-flash",
+        temperature=0.7,
+        api_key=GOOGLE_API_KEY,
+        stream=LLM_STREAM,
+    ))))
+
+
+class AgentSpec(BaseModel):
+    """Immutable agent configuration; every job builds its own Agent from it."""
+    model_config = ConfigDict(frozen=True)
+
+    role: str = Field(description="Agent role shown to the LLM.")
+    goal: str = Field(description="What the agent is trying to achieve.")
+    backstory: str = Field(description="Persona the agent speaks as.")
+    tools: Tuple[str, ...] = Field(default=(), description="Names from tools.TOOL_FACTORIES.")
+    # crewai's default memory is one store on disk shared by every job,
+    # thread and worker process, so an agent with it could recall another
+    # patient's report. Job state reaches agents through task context instead
+    memory: bool = Field(default=False, description="Let the agent keep crew memory; must stay off.")
+    allow_delegation: bool = Field(default=False, description="Allow delegating to other agents.")
+    max_iter: int = Field(default=1, description="Most reasoning iterations per task.")
+    verbose: bool = Field(default=True, description="Log the agent's reasoning.")
+
+
+AGENT_SPECS = MappingProxyType({
+    # Creating an Experienced Doctor agent
+    "doctor": AgentSpec(
+        role="Senior Experienced Doctor",
+        goal=(
+            """Thoroughly analyze the patient's query and attached blood test report. \
+            Use advanced medical expertise to provide clear, actionable, and evidence-based medical advice. \
+            Tailor all recommendations to the patient's unique clinical context, referencing recent clinical guidelines or studies where appropriate. \
+            Prioritize patient safety, clarity, and evidence-based guidance."""
+        ),
+        backstory=(
+            """You are a board-certified physician with decades of experience in interpreting complex blood test results and managing diverse patient cases. \
+            Your approach is thorough, up-to-date, and always focused on delivering trustworthy, patient-centered care. \
+            You excel at translating lab data into practical medical recommendations that patients can understand and act on."""
+        ),
+        tools=("report_reader", "search"),
+        allow_delegation=True  # Allow delegation to other specialists
     ),
-    verbose=True,
-    backstory=(
-        """You are a clinical nutritionist with extensive experience in translating blood test data into actionable dietary guidance. \
-        Your recommendations are always rooted in the latest research and tailored to each patient's unique needs, helping them achieve measurable improvements in health and well-being."""
+
+    # Creating a verifier agent
+    "verifier": AgentSpec(
+        role="Blood Report Verifier",
+        goal=(
+            """Carefully inspect the uploaded blood test report to confirm it is a legitimate, complete, and authentic medical document. \
+            Ensure all essential blood markers are present (at least 10 key parameters), and flag any missing, suspicious, or inconsistent data. \
+            Only approve reports that are suitable for clinical analysis and patient care."""
+        ),
+        backstory=(
+            """You are a medical documentation specialist with deep expertise in verifying the integrity and completeness of blood test reports. \
+            Your job is to protect patient safety by ensuring only accurate, reliable, and comprehensive lab data is used for further analysis. \
+            You are meticulous, detail-oriented, and uncompromising in your standards for medical documentation."""
+        ),
+        tools=("report_reader",),
+        allow_delegation=True
     ),
-    tools=[NutritionTool()],
-    llm=llm,
-    max_iter=1,
-    max_rpm=1,
-    allow_delegation=False
-)
-
-exercise_specialist = Agent(
-    role="Certified Fitness Coach",
-    goal=(
-        """Design a safe, effective exercise plan based on the patient's blood test results and current health status. \
-        Provide at least 3 specific exercise recommendations, ensuring all advice is medically appropriate and supports the patient's long-term wellness goals."""
+
+    "nutritionist": AgentSpec(
+        role="Clinical Nutrition Specialist",
+        goal=(
+            """Review the patient's blood test results and provide at least 3 personalized, evidence-based nutrition and supplement recommendations. \
+            Address any deficiencies or health risks identified in the report, and support the patient's recovery and long-term health with clear, practical advice."""
+        ),
+        backstory=(
+            """You are a clinical nutritionist with extensive experience in translating blood test data into actionable dietary guidance. \
+            Your recommendations are always rooted in the latest research and tailored to each patient's unique needs, helping them achieve measurable improvements in health and well-being."""
+        ),
+        tools=("nutrition",),
     ),
-    verbose=True,
-    backstory=(
-        """You are a certified fitness coach with a strong background in exercise physiology and rehabilitation. \
-        You specialize in creating evidence-based, individualized fitness routines that accommodate medical needs and drive sustainable progress, always prioritizing safety and measurable results."""
+
+    "exercise_specialist": AgentSpec(
+        role="Certified Fitness Coach",
+        goal=(
+            """Design a safe, effective exercise plan based on the patient's blood test results and current health status. \
+            Provide at least 3 specific exercise recommendations, ensuring all advice is medically appropriate and supports the patient's long-term wellness goals."""
+        ),
+        backstory=(
+            """You are a certified fitness coach with a strong background in exercise physiology and rehabilitation. \
+            You specialize in creating evidence-based, individualized fitness routines that accommodate medical needs and drive sustainable progress, always prioritizing safety and measurable results."""
+        ),
+        tools=("exercise",),
     ),
-    tools=[ExerciseTool()],
-    llm=llm,
-    max_iter=1,
-    max_rpm=1,
-    allow_delegation=False
-)
\ No newline at end of file
+})
+
+
+def build_agent(name: str):
+    """
+    A new Agent for one job. Agents hold per-run state (executor and
+    task outputs), so they are never shared between concurrent jobs; only
+    the LLM client is.
+    """
+    from crewai import Agent
+    from tools import build_tool
+
+    spec = AGENT_SPECS[name]
+    return Agent(
+        role=spec.role,
+        goal=spec.goal,
+        backstory=spec.backstory,
+        verbose=spec.verbose,
+        memory=spec.memory,
+        tools=[build_tool(tool) for tool in spec.tools],
+        llm=registry.get("llm"),
+        max_iter=spec.max_iter,
+        allow_delegation=spec.allow_delegation
+    )
+
+
+__getattr__ = registry.module_getattr(__name__)
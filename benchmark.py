@@ -0,0 +1,362 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+
+# Configure logging for the benchmark
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+BENCHMARK_RESULTS_DIR = os.environ.get("BENCHMARK_RESULTS_DIR", os.path.join("data", "benchmarks"))
+
+
+def configure_environment(workdir: str, workers: int, rate_limit: bool, llm_cache: bool):
+    """
+    Point every store at in-memory or throwaway backends. Must run before
+    main (or anything importing job_store) is imported, since they read
+    their configuration at import time.
+    """
+    os.environ.update({
+        "JOB_STORE_BACKEND": "memory",
+        "RUN_EMBEDDED_WORKERS": "true",
+        "WORKER_MODE": "thread",
+        "WORKER_COUNT": str(workers),
+        "WORKER_POLL_INTERVAL": "0.05",
+        "UPLOAD_DIR": os.path.join(workdir, "uploads"),
+        "RESULT_BLOB_DIR": os.path.join(workdir, "results"),
+        "PARSED_REPORTS_DIR": os.path.join(workdir, "parsed"),
+        "SEARCH_MODE": "offline",
+        "SEARCH_CACHE_SQLITE_PATH": os.path.join(workdir, "search_cache.sqlite3"),
+        "LLM_CACHE_BACKEND": "memory",
+        "LLM_CACHE_ENABLED": "true" if llm_cache else "false",
+        "LLM_RATE_LIMIT_ENABLED": "true" if rate_limit else "false",
+        "LLM_RATE_LIMIT_BACKEND": "memory",
+        "JOB_STATS_CACHE_SECONDS": "0",
+    })
+    os.environ.setdefault("gemini_api_key", "benchmark")
+    os.environ.setdefault("SERPER_API_KEY", "benchmark")
+
+
+# Generated lab reports
+
+def _pdf_escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def _pdf_document(pages: list) -> bytes:
+    """A minimal text-only PDF; each page is a list of lines in Helvetica."""
+    objects = {
+        1: "<< /Type /Catalog /Pages 2 0 R >>",
+        3: "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    }
+    kids = []
+    next_id = 4
+    for lines in pages:
+        page_id, content_id = next_id, next_id + 1
+        next_id += 2
+        stream = "BT /F1 10 Tf 50 790 Td 14 TL\n" + "".join(
+            f"({_pdf_escape(line)}) Tj T*\n" for line in lines) + "ET"
+        objects[page_id] = (
+            "<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {content_id} 0 R >>")
+        objects[content_id] = f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream"
+        kids.append(page_id)
+    objects[2] = f"<< /Type /Pages /Kids [{' '.join(f'{kid} 0 R' for kid in kids)}] /Count {len(kids)} >>"
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = {}
+    for object_id in sorted(objects):
+        offsets[object_id] = len(out)
+        out += f"{object_id} 0 obj\n{objects[object_id]}\nendobj\n".encode("latin-1")
+    xref_offset = len(out)
+    size = max(objects) + 1
+    out += f"xref\n0 {size}\n0000000000 65535 f \n".encode("latin-1")
+    for object_id in range(1, size):
+        out += f"{offsets[object_id]:010d} 00000 n \n".encode("latin-1")
+    out += f"trailer\n<< /Size {size} /Root 1 0 R >>\nstartxref\n{xref_offset}\n%%EOF\n".encode("latin-1")
+    return bytes(out)
+
+
+def make_lab_pdf(seed: int, pages: int = 2) -> bytes:
+    """A deterministic multi-page lab report with every marker in markers.MARKERS."""
+    from markers import MARKERS
+
+    rng = random.Random(seed)
+    rows = []
+    for spec in MARKERS.values():
+        low, high = spec["range"]
+        value = round(rng.uniform(low * 0.7, high * 1.3), 1)
+        rows.append(f"{spec['label']}    {value}    {spec['unit']}    {low:g} - {high:g}")
+
+    per_page = -(-len(rows) // pages)
+    documents = []
+    for page in range(pages):
+        lines = [
+            "City Diagnostics Laboratory",
+            f"Patient: Benchmark Patient {seed}    Sample ID: BM-{seed:05d}",
+            f"Page {page + 1} of {pages}",
+            "",
+            "Test    Result    Unit    Reference Range",
+        ]
+        lines += rows[page * per_page:(page + 1) * per_page]
+        lines += ["", "Interpretation: correlate clinically."] + [
+            f"Note {n}: results generated for load testing." for n in range(rng.randint(5, 20))]
+        documents.append(lines)
+    return _pdf_document(documents)
+
+
+# Deterministic fake LLM
+
+def install_fake_llm(latency: float, jitter: float = 0.0) -> dict:
+    """
+    Replace the LLM factory in agents.py with a fake that sleeps for
+    `latency` (+/- jitter) seconds and answers deterministically from the
+    prompt. It is wrapped exactly like the real one (rate limiter,
+    response cache, telemetry). Returns a dict whose "calls" entry counts LLM calls.
+    """
+    import agents
+    from crewai.llms.base_llm import BaseLLM
+
+    counter = {"calls": 0}
+
+    class FakeLLM(BaseLLM):
+        latency: float = 0.0
+        jitter: float = 0.0
+
+        def call(self, messages, tools=None, callbacks=None, available_functions=None,
+                 from_task=None, from_agent=None, response_model=None):
+            counter["calls"] += 1
+            prompt = messages if isinstance(messages, str) else json.dumps(messages, default=str)
+            digest = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+            delay = self.latency + random.Random(digest).uniform(-self.jitter, self.jitter)
+            time.sleep(max(0.0, delay))
+            return f"Final Answer: benchmark analysis {digest[:12]}"
+
+    @agents.registry.register("llm")
+    def build_fake_llm():
+        from llm_cache import install_llm_cache
+        from rate_limiter import install_rate_limiter
+        from telemetry import install_llm_telemetry
+
+        return install_llm_telemetry(install_llm_cache(install_rate_limiter(
+            FakeLLM(model="fake/benchmark", latency=latency, jitter=jitter))))
+
+    return counter
+
+
+def add_mongo_latency(seconds: float):
+    """Delay every awaited call to the in-memory job store by `seconds`, like a network round trip."""
+    import job_store
+
+    if seconds <= 0:
+        return
+    get_attribute = job_store._AsyncCollection.__getattr__
+
+    def delayed(self, name):
+        attr = get_attribute(self, name)
+        if name in job_store._AsyncCollection._CURSOR_METHODS:
+            return attr
+
+        async def call(*args, **kwargs):
+            await asyncio.sleep(seconds)
+            return await attr(*args, **kwargs)
+        return call
+
+    job_store._AsyncCollection.__getattr__ = delayed
+
+
+def count_analyses() -> dict:
+    """
+    Count process_blood_report runs per job in the embedded workers. Returns
+    the dict the counts are kept in, keyed by job_id.
+    """
+    import worker
+
+    runs = {}
+    process = worker.process_blood_report
+
+    def counted(query, file_path, job_id, *args, **kwargs):
+        runs[job_id] = runs.get(job_id, 0) + 1
+        return process(query, file_path, job_id, *args, **kwargs)
+
+    worker.process_blood_report = counted
+    return runs
+
+
+# Runner
+
+def _summary(values: list) -> dict:
+    from job_store import _percentile
+
+    values = sorted(values)
+    return {
+        "p50": _percentile(values, 0.50),
+        "p95": _percentile(values, 0.95),
+        "p99": _percentile(values, 0.99),
+        "mean": round(sum(values) / len(values), 4) if values else None,
+        "count": len(values),
+    }
+
+
+async def run_benchmark(jobs: int, concurrency: int, unique: int, pages: int, query: str,
+                        execution_mode: str = None, poll_interval: float = 0.05,
+                        arrival_interval: float = 0.0) -> dict:
+    import main
+    from httpx import ASGITransport, AsyncClient
+    from llm_cache import llm_cache
+
+    corpus = [make_lab_pdf(seed, pages) for seed in range(unique)]
+    semaphore = asyncio.Semaphore(concurrency)
+    form = {"query": query}
+    if execution_mode:
+        form["execution_mode"] = execution_mode
+
+    async def upload_and_wait(client, i):
+        # Spread arrivals out instead of sending every upload at once
+        await asyncio.sleep(i * arrival_interval)
+        async with semaphore:
+            started = time.perf_counter()
+            response = await client.post(
+                "/upload", files={"file": (f"report-{i}.pdf", corpus[i % unique], "application/pdf")}, data=form)
+            body = response.json()
+            uploaded = time.perf_counter()
+            status = body.get("status")
+            while status in ("pending", "queued", "processing"):
+                await asyncio.sleep(poll_interval)
+                status = (await client.get(f"/status/{body['job_id']}", params={"view": "summary"})).json()["status"]
+            return {
+                "job_id": body.get("job_id"),
+                "status": "finished" if status == "success" else status,
+                "upload_seconds": uploaded - started,
+                "latency_seconds": time.perf_counter() - started,
+            }
+
+    async with main.app.router.lifespan_context(main.app):
+        transport = ASGITransport(app=main.app)
+        async with AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as client:
+            wall_started = time.perf_counter()
+            runs = await asyncio.gather(*(upload_and_wait(client, i) for i in range(jobs)))
+            wall_seconds = time.perf_counter() - wall_started
+
+        # Per-stage timings come from each job's stages timeline
+        stages = {}
+        for job_id in {run["job_id"] for run in runs}:
+            job = await main.job_store.get(job_id, {"stages": 1})
+            for entry in (job or {}).get("stages", []):
+                stage = stages.setdefault(entry["stage"], {"durations": [], "max_rss_kb": 0})
+                stage["durations"].append(entry["duration_seconds"])
+                stage["max_rss_kb"] = max(stage["max_rss_kb"], entry.get("max_rss_kb", 0))
+
+    finished = [run for run in runs if run["status"] == "finished"]
+    return {
+        "jobs": jobs,
+        "finished": len(finished),
+        "failed": len(runs) - len(finished),
+        "wall_seconds": round(wall_seconds, 3),
+        "jobs_per_second": round(len(finished) / wall_seconds, 3) if wall_seconds else None,
+        "latency_seconds": _summary([run["latency_seconds"] for run in finished]),
+        "upload_seconds": _summary([run["upload_seconds"] for run in runs]),
+        "stages": {
+            name: {**_summary(stage["durations"]), "max_rss_kb": stage["max_rss_kb"]}
+            for name, stage in stages.items()
+        },
+        "llm_cache": llm_cache.snapshot(),
+    }
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except Exception:
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the upload -> result pipeline with a fake LLM.")
+    parser.add_argument("--jobs", type=int, default=20, help="Uploads to send.")
+    parser.add_argument("--concurrency", type=int, default=4, help="Uploads in flight at once.")
+    parser.add_argument("--workers", type=int, default=4, help="Embedded worker threads.")
+    parser.add_argument("--unique", type=int, default=None,
+                        help="Distinct reports in the corpus (default: one per job); fewer means repeated uploads.")
+    parser.add_argument("--pages", type=int, default=2, help="Pages per generated report.")
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="Seconds per fake LLM call.")
+    parser.add_argument("--llm-jitter", type=float, default=0.0, help="Random +/- seconds per fake LLM call.")
+    parser.add_argument("--execution-mode", choices=("sequential", "parallel", "rules"), default=None)
+    parser.add_argument("--query", default="Summarise my Blood Test Report")
+    parser.add_argument("--arrival-interval", type=float, default=0.0,
+                        help="Seconds between the start of consecutive uploads.")
+    parser.add_argument("--mongo-latency", type=float, default=0.0,
+                        help="Seconds added to every job store call the API makes, like a remote MongoDB.")
+    parser.add_argument("--rate-limit", action="store_true", help="Keep the LLM rate limiter on.")
+    parser.add_argument("--no-llm-cache", action="store_true", help="Turn the LLM response cache off.")
+    parser.add_argument("--trace-memory", action="store_true", help="Also record the tracemalloc peak (slower).")
+    parser.add_argument("--output", default=None, help="Where to write the JSON results.")
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix="blood-benchmark-")
+    configure_environment(workdir, args.workers, args.rate_limit, not args.no_llm_cache)
+    llm_counter = install_fake_llm(args.llm_latency, args.llm_jitter)
+    analyses = count_analyses()
+    add_mongo_latency(args.mongo_latency)
+
+    if args.trace_memory:
+        tracemalloc.start()
+    results = asyncio.run(run_benchmark(
+        jobs=args.jobs,
+        concurrency=args.concurrency,
+        unique=args.unique or args.jobs,
+        pages=args.pages,
+        query=args.query,
+        execution_mode=args.execution_mode,
+        arrival_interval=args.arrival_interval,
+    ))
+    results["llm_calls"] = llm_counter["calls"]
+    # Concurrent uploads of one report must share a single analysis
+    results["analyses"] = sum(analyses.values())
+    results["duplicate_analyses"] = sum(count - 1 for count in analyses.values())
+    results["memory"] = {"max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss if resource else None}
+    if args.trace_memory:
+        results["memory"]["tracemalloc_peak_kb"] = tracemalloc.get_traced_memory()[1] // 1024
+        tracemalloc.stop()
+
+    report = {
+        "started_at": datetime.now().isoformat(),
+        "git_commit": _git_commit(),
+        "config": {key: value for key, value in vars(args).items() if key != "output"},
+        "results": results,
+    }
+    output = args.output or os.path.join(
+        BENCHMARK_RESULTS_DIR, f"benchmark-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+
+    latency = results["latency_seconds"]
+    logger.info(
+        f"🏁 {results['finished']}/{results['jobs']} jobs, {results['jobs_per_second']} jobs/s, "
+        f"p50 {latency['p50']}s, p95 {latency['p95']}s, p99 {latency['p99']}s, "
+        f"{results['analyses']} analyses ({results['duplicate_analyses']} duplicate)")
+    logger.info(f"💾 Results written to {output}")
+    return report
+
+
+if __name__ == "__main__":
+    report = main()
+    sys.exit(0 if report["results"]["failed"] == 0 and report["results"]["duplicate_analyses"] == 0 else 1)
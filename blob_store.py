@@ -0,0 +1,297 @@
+import gzip
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+from datetime import datetime, timedelta
+
+
+# Configure logging for the blob store
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Uploaded PDFs live at UPLOAD_DIR/ab/cd/<sha256>.pdf and job results and
+# tracebacks, gzipped, at RESULT_BLOB_DIR/ab/cd/<sha256>.txt.gz, so no directory
+# grows past a few hundred entries. Jobs reference text blobs by digest.
+UPLOAD_DIR = os.environ.get("UPLOAD_DIR", os.path.join("data", "uploads"))
+RESULT_BLOB_DIR = os.environ.get("RESULT_BLOB_DIR", os.path.join("data", "results"))
+BLOB_COMPRESSION_LEVEL = int(os.environ.get("BLOB_COMPRESSION_LEVEL", "6"))
+
+# Retention. PDFs not uploaded again for this long are deleted unless a job
+# still waiting to run needs them; 0 keeps them forever
+PDF_RETENTION_DAYS = float(os.environ.get("PDF_RETENTION_DAYS", "30"))
+# Finished and failed jobs older than this are deleted with their results; 0 keeps them
+JOB_RETENTION_DAYS = float(os.environ.get("JOB_RETENTION_DAYS", "0"))
+# Least recently uploaded PDFs are deleted while uploads take more than this
+UPLOAD_DIR_MAX_BYTES = int(os.environ.get("UPLOAD_DIR_MAX_BYTES", str(10 * 1024 ** 3)))
+# Blobs and partial uploads younger than this are never collected: a worker
+# writes the blob just before the job document that references it
+BLOB_GC_GRACE_SECONDS = float(os.environ.get("BLOB_GC_GRACE_SECONDS", "3600"))
+BLOB_GC_INTERVAL_SECONDS = float(os.environ.get("BLOB_GC_INTERVAL_SECONDS", "3600"))
+
+ACTIVE_STATUSES = ("pending", "queued", "processing")
+# Job fields holding a text blob reference, and the field it is resolved into
+BLOB_FIELDS = {"result_blob": "result", "error_blob": "error_details"}
+
+_DIGEST = re.compile(r"^[0-9a-f]{64}$")
+
+
+def _shard(root: str, digest: str, suffix: str) -> str:
+    return os.path.join(root, digest[:2], digest[2:4], f"{digest}{suffix}")
+
+
+def pdf_path(file_hash: str, root: str = UPLOAD_DIR) -> str:
+    return _shard(root, file_hash, ".pdf")
+
+
+def store_pdf(tmp_path: str, file_hash: str, root: str = UPLOAD_DIR) -> str:
+    """Move a fully written upload into its shard; returns the final path."""
+    path = pdf_path(file_hash, root)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Same name means same content, so replacing an existing copy is harmless,
+    # and it restarts the retention clock
+    os.replace(tmp_path, path)
+    return path
+
+
+def _blob_path(digest: str, root: str = RESULT_BLOB_DIR) -> str:
+    return _shard(root, digest, ".txt.gz")
+
+
+def put_text(text: str, root: str = RESULT_BLOB_DIR) -> dict:
+    """Store text as a gzipped blob named by its SHA-256; returns the reference to keep on the job."""
+    data = text.encode("utf-8")
+    digest = hashlib.sha256(data).hexdigest()
+    path = _blob_path(digest, root)
+    if os.path.exists(path):
+        # Identical text is stored once; touching it keeps it out of the next sweep
+        os.utime(path, None)
+    else:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(gzip.compress(data, compresslevel=BLOB_COMPRESSION_LEVEL, mtime=0))
+        os.replace(tmp_path, path)
+    return {"digest": digest, "bytes": len(data), "stored_bytes": os.path.getsize(path)}
+
+
+def get_text(ref: dict, root: str = RESULT_BLOB_DIR):
+    """The text a reference points to, or None if its blob is gone."""
+    try:
+        with open(_blob_path(ref["digest"], root), "rb") as f:
+            return gzip.decompress(f.read()).decode("utf-8")
+    except FileNotFoundError:
+        logger.warning(f"⚠️ Blob {ref['digest']} is missing")
+        return None
+
+
+def resolve_blobs(job: dict) -> dict:
+    """Fill result and error_details from their blobs, for API responses; jobs stored inline pass through."""
+    for ref_field, field in BLOB_FIELDS.items():
+        if job.get(ref_field):
+            job[field] = get_text(job[ref_field])
+    return job
+
+
+def load_result(job: dict):
+    """A job's result text, wherever it is stored."""
+    return resolve_blobs(dict(job)).get("result")
+
+
+# Garbage collection
+
+def _walk(root: str):
+    """(path, size, mtime) of every file under root."""
+    for directory, _, names in os.walk(root):
+        for name in names:
+            path = os.path.join(directory, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            yield path, stat.st_size, stat.st_mtime
+
+
+def _remove(path: str) -> bool:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        return False
+    # Drop shard directories left empty
+    for directory in (os.path.dirname(path), os.path.dirname(os.path.dirname(path))):
+        try:
+            os.rmdir(directory)
+        except OSError:
+            break
+    return True
+
+
+def expire_jobs(job_store, retention_days: float = JOB_RETENTION_DAYS) -> int:
+    """Delete finished and failed jobs started more than retention_days ago."""
+    if retention_days <= 0:
+        return 0
+    cutoff = (datetime.now() - timedelta(days=retention_days)).isoformat()
+    result = job_store.jobs.delete_many({"status": {"$in": ["finished", "failed"]}, "started_at": {"$lt": cutoff}})
+    return result.deleted_count
+
+
+def _referenced(job_store, digest: str) -> bool:
+    """Whether any job points at the blob; each lookup is served by the blob digest indexes."""
+    return any(
+        job_store.jobs.find_one({f"{ref_field}.digest": digest}, {"_id": 1}) is not None
+        for ref_field in BLOB_FIELDS
+    )
+
+
+def sweep_blobs(job_store, root: str = RESULT_BLOB_DIR, grace_seconds: float = BLOB_GC_GRACE_SECONDS) -> dict:
+    """
+    Delete text blobs no job references. Each blob past the grace period
+    is looked up on its own rather than collecting every referenced digest
+    first, which with jobs kept forever outgrows a 16 MB distinct result.
+    """
+    cutoff = time.time() - grace_seconds
+    deleted, freed = 0, 0
+    for path, size, mtime in _walk(root):
+        if mtime >= cutoff:
+            continue
+        digest = os.path.basename(path).split(".", 1)[0]
+        if not _referenced(job_store, digest) and _remove(path):
+            deleted += 1
+            freed += size
+    return {"deleted": deleted, "freed_bytes": freed}
+
+
+def sweep_uploads(job_store, root: str = UPLOAD_DIR, retention_days: float = PDF_RETENTION_DAYS,
+                  max_bytes: int = UPLOAD_DIR_MAX_BYTES, grace_seconds: float = BLOB_GC_GRACE_SECONDS) -> dict:
+    """
+    Delete PDFs older than retention_days, then the least recently uploaded
+    ones while the directory is over max_bytes. PDFs of jobs that have not
+    finished are kept, as are partial uploads younger than grace_seconds.
+    """
+    needed = {os.path.abspath(job["file_path"]) for job in job_store.jobs.find(
+        {"status": {"$in": list(ACTIVE_STATUSES)}, "file_path": {"$exists": True}}, {"_id": 0, "file_path": 1})}
+    now = time.time()
+    files = sorted(_walk(root), key=lambda entry: entry[2])
+    total = sum(size for _, size, _ in files)
+    deleted, freed = {"age": 0, "size": 0, "partial": 0}, 0
+    for path, size, mtime in files:
+        if os.path.abspath(path) in needed:
+            continue
+        if not path.endswith(".pdf"):
+            reason = "partial" if now - mtime > grace_seconds else None
+        elif retention_days > 0 and now - mtime > retention_days * 86400:
+            reason = "age"
+        elif total > max_bytes:
+            reason = "size"
+        else:
+            reason = None
+        if reason and _remove(path):
+            deleted[reason] += 1
+            freed += size
+            total -= size
+    return {"deleted": deleted, "freed_bytes": freed}
+
+
+def collect_garbage(job_store) -> dict:
+    """One retention pass: expire old jobs, then sweep unreferenced blobs and expired uploads."""
+    from telemetry import BLOB_GC_DELETED
+
+    started = time.perf_counter()
+    report = {"expired_jobs": expire_jobs(job_store)}
+    report["results"] = sweep_blobs(job_store)
+    report["uploads"] = sweep_uploads(job_store)
+    report["seconds"] = round(time.perf_counter() - started, 3)
+    BLOB_GC_DELETED.inc(report["expired_jobs"], kind="job")
+    BLOB_GC_DELETED.inc(report["results"]["deleted"], kind="result")
+    BLOB_GC_DELETED.inc(sum(report["uploads"]["deleted"].values()), kind="upload")
+    logger.info(f"🧹 Blob GC: {report}")
+    return report
+
+
+class BlobCollector:
+    """Runs collect_garbage every BLOB_GC_INTERVAL_SECONDS in a background thread."""
+
+    def __init__(self, job_store, interval: float = BLOB_GC_INTERVAL_SECONDS):
+        self.job_store = job_store
+        self.interval = interval
+        self.last_report = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.last_report = collect_garbage(self.job_store)
+            except Exception as e:
+                logger.error(f"❌ Blob GC failed: {e}")
+
+    def start(self):
+        if self.interval > 0:
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+
+
+def storage_stats() -> dict:
+    """File counts and sizes of the upload and result stores."""
+    from telemetry import BLOB_STORE_BYTES
+
+    stats = {}
+    for kind, root in (("uploads", UPLOAD_DIR), ("results", RESULT_BLOB_DIR)):
+        files = list(_walk(root))
+        stats[kind] = {
+            "root": root,
+            "files": len(files),
+            "bytes": sum(size for _, size, _ in files),
+            "oldest": datetime.fromtimestamp(min(mtime for _, _, mtime in files)).isoformat() if files else None,
+        }
+        BLOB_STORE_BYTES.set(stats[kind]["bytes"], kind=kind)
+    return stats
+
+
+def migrate(job_store, legacy_dir: str = "data") -> dict:
+    """
+    Move PDFs stored flat as legacy_dir/<sha256>.pdf into shards and results
+    and tracebacks stored inline on jobs into blobs, updating the jobs.
+    """
+    moved = {}
+    for name in os.listdir(legacy_dir):
+        stem, ext = os.path.splitext(name)
+        if ext == ".pdf" and _DIGEST.match(stem):
+            old_path = os.path.join(legacy_dir, name)
+            moved[old_path] = store_pdf(old_path, stem)
+    for old_path, new_path in moved.items():
+        job_store.jobs.update_many({"file_path": old_path}, {"$set": {"file_path": new_path}})
+
+    externalized = 0
+    for ref_field, field in BLOB_FIELDS.items():
+        for job in job_store.jobs.find({field: {"$exists": True}}, {"job_id": 1, field: 1}):
+            update = {"$unset": {field: ""}}
+            if job[field]:
+                update["$set"] = {ref_field: put_text(job[field])}
+            job_store.jobs.update_one({"_id": job["_id"]}, update)
+            externalized += 1
+    report = {"moved_pdfs": len(moved), "externalized_fields": externalized}
+    logger.info(f"📦 Migrated blob storage: {report}")
+    return report
+
+
+if __name__ == "__main__":
+    import json
+    import sys
+    from job_store import JobStore
+
+    # python blob_store.py [stats|gc|migrate]
+    command = sys.argv[1] if len(sys.argv) > 1 else "stats"
+    if command == "gc":
+        output = collect_garbage(JobStore())
+    elif command == "migrate":
+        output = migrate(JobStore(), *sys.argv[2:3])
+    else:
+        output = storage_stats()
+    print(json.dumps(output, indent=2))
@@ -0,0 +1,133 @@
+import logging
+import re
+from types import MappingProxyType
+from typing import Tuple
+from pydantic import BaseModel, ConfigDict, Field
+
+
+# Configure logging for crew templates
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class CrewTemplate(BaseModel):
+    """
+    An immutable recipe for a crew. instantiate() builds fresh agents and
+    tasks from the specs in agents.py and task.py, so concurrent jobs never
+    share executors or task outputs. Agent and crew memory stay off, since
+    crewai keeps it in one store shared by every job (see AgentSpec.memory).
+    """
+    model_config = ConfigDict(frozen=True)
+
+    name: str = Field(description="Template name.")
+    tasks: Tuple[str, ...] = Field(description="Names from task.TASK_SPECS, run in order.")
+
+    def instantiate(self):
+        from crewai import Crew, Process
+        from agents import build_agent
+        from task import TASK_SPECS, build_task
+        from telemetry import instrument_task
+
+        agents = {}
+        tasks = []
+        for task_name in self.tasks:
+            agent_name = TASK_SPECS[task_name].agent
+            if agent_name not in agents:
+                agents[agent_name] = build_agent(agent_name)
+            task = build_task(task_name, agents[agent_name])
+            tasks.append(instrument_task(task, task_name, agents[agent_name].role))
+        return Crew(agents=list(agents.values()), tasks=tasks, process=Process.sequential)
+
+
+CREW_TEMPLATES = MappingProxyType({
+    "full": CrewTemplate(name="full", tasks=("help_patients", "nutrition_analysis", "exercise_planning")),
+    "doctor": CrewTemplate(name="doctor", tasks=("help_patients",)),
+    "nutrition": CrewTemplate(name="nutrition", tasks=("nutrition_analysis",)),
+    "exercise": CrewTemplate(name="exercise", tasks=("exercise_planning",)),
+})
+
+
+def build_crew(name: str):
+    """A new crew for one job from the named template."""
+    return CREW_TEMPLATES[name].instantiate()
+
+
+def run_isolation_check(jobs: int = 8) -> list:
+    """
+    Run `jobs` full crews in threads against an echoing fake LLM, in two
+    waves so the second runs after the first has finished, and return a
+    list of problems: outputs that mention another job, prompts carrying
+    another job's content (as recalled memory would), agents or crews with
+    memory enabled, or agent instances shared between jobs. An empty list
+    means the jobs were isolated.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    from agents import registry
+
+    leaks = []
+
+    def echo_call(messages, *args, **kwargs):
+        text = messages if isinstance(messages, str) else " ".join(str(m.get("content")) for m in messages)
+        tags = sorted(set(re.findall(r"isolation-job-\d+", text)))
+        if len(tags) > 1:
+            leaks.append(f"a prompt mixes {tags}")
+        return f"Final Answer: findings for {' '.join(tags)}"
+
+    llm = registry.get("llm")
+    original_call = llm.call
+    object.__setattr__(llm, "call", echo_call)
+
+    def run_job(i):
+        crew = build_crew("full")
+        # Recorded before kickoff, which may replace the crew's agent list
+        agent_ids = {id(agent): agent.role for agent in crew.agents}
+        # crewai memory is one store shared by every crew, so any is a leak
+        with_memory = [agent.role for agent in crew.agents if agent.memory] + (["crew"] if crew.memory else [])
+        if with_memory:
+            return agent_ids, [], f"job {i} has memory enabled for {with_memory}"
+        try:
+            result = crew.kickoff(inputs={
+                "query": f"isolation-job-{i}",
+                "file_path": f"isolation-job-{i}.pdf",
+                "markers": "",
+                "doctor_findings": "See the doctor's analysis provided as context."
+            })
+        except Exception as e:
+            return agent_ids, [], f"job {i} failed: {e}"
+        return agent_ids, [str(output) for output in result.tasks_output], None
+
+    try:
+        # Memory saved by the first wave would surface in the second wave's prompts
+        first_wave = max(jobs // 2, 1)
+        with ThreadPoolExecutor(max_workers=jobs) as pool:
+            runs = list(pool.map(run_job, range(first_wave)))
+            runs += list(pool.map(run_job, range(first_wave, jobs)))
+    finally:
+        object.__setattr__(llm, "call", original_call)
+
+    problems = list(dict.fromkeys(leaks))
+    seen_agents = {}
+    for i, (agent_ids, outputs, error) in enumerate(runs):
+        if error:
+            problems.append(error)
+        for output in outputs:
+            others = set(re.findall(r"isolation-job-\d+", output)) - {f"isolation-job-{i}"}
+            if others:
+                problems.append(f"job {i} output mentions {sorted(others)}")
+        for agent_id, role in agent_ids.items():
+            if agent_id in seen_agents:
+                problems.append(f"job {i} shares agent {role} with job {seen_agents[agent_id]}")
+            seen_agents[agent_id] = i
+    return problems
+
+
+if __name__ == "__main__":
+    import sys
+
+    jobs = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    problems = run_isolation_check(jobs)
+    for problem in problems:
+        logger.error(f"❌ {problem}")
+    if not problems:
+        logger.info(f"✅ {jobs} crews kept their outputs, prompts and memory isolated")
+    sys.exit(1 if problems else 0)
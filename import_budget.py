@@ -0,0 +1,62 @@
+import json
+import logging
+import os
+import subprocess
+import sys
+
+
+# Configure logging for the import budget check
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# A cold import of the API or a worker must stay under this many seconds
+IMPORT_BUDGET_SECONDS = float(os.environ.get("IMPORT_BUDGET_SECONDS", "1.0"))
+
+# Modules that belong to the LLM stack and must only load when a job runs
+LLM_STACK_MODULES = (
+    "crewai", "crewai_tools", "litellm", "langchain_community", "pypdf",
+    "agents", "task", "tools",
+)
+
+_PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - started
+print(json.dumps({{"seconds": elapsed, "modules": sorted(sys.modules)}}))
+"""
+
+
+def measure_import(module: str) -> dict:
+    """Import module in a fresh interpreter and report the time taken and the LLM-stack modules it loaded."""
+    output = subprocess.run(
+        [sys.executable, "-c", _PROBE.format(module=module)],
+        capture_output=True, text=True, check=True,
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+    ).stdout
+    probe = json.loads(output.strip().splitlines()[-1])
+    return {
+        "module": module,
+        "seconds": round(probe["seconds"], 3),
+        "llm_stack": [name for name in LLM_STACK_MODULES if name != module and name in probe["modules"]],
+    }
+
+
+def check_import_budget(modules=("main", "worker"), budget: float = IMPORT_BUDGET_SECONDS) -> list:
+    """Returns a list of human-readable failures; empty when every module is within budget."""
+    failures = []
+    for module in modules:
+        result = measure_import(module)
+        logger.info(f"⏱️ import {module}: {result['seconds']}s, LLM stack loaded: {result['llm_stack'] or 'none'}")
+        if result["seconds"] > budget:
+            failures.append(f"import {module} took {result['seconds']}s (budget {budget}s)")
+        if result["llm_stack"]:
+            failures.append(f"import {module} loaded {', '.join(result['llm_stack'])}")
+    return failures
+
+
+if __name__ == "__main__":
+    failures = check_import_budget(sys.argv[1:] or ("main", "worker"))
+    for failure in failures:
+        logger.error(f"❌ {failure}")
+    sys.exit(1 if failures else 0)
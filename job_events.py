@@ -0,0 +1,169 @@
+import asyncio
+import contextvars
+import json
+import logging
+import os
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+
+
+# Configure logging for job events
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# How often a stream re-reads the job when no in-process event arrived, which
+# is how it follows workers running in other processes or machines
+JOB_STREAM_POLL_SECONDS = float(os.environ.get("JOB_STREAM_POLL_SECONDS", "2"))
+# Token events are dropped for a subscriber that falls this far behind
+JOB_STREAM_MAX_BACKLOG = int(os.environ.get("JOB_STREAM_MAX_BACKLOG", "1000"))
+
+TERMINAL_STATUSES = ("finished", "failed")
+
+_current_job = contextvars.ContextVar("current_job_id", default=None)
+
+
+@contextmanager
+def job_context(job_id: str):
+    """Attribute LLM output produced inside this block (and threads started with its context) to job_id."""
+    token = _current_job.set(job_id)
+    try:
+        yield
+    finally:
+        _current_job.reset(token)
+
+
+def current_job_id() -> str:
+    """The job set by the enclosing job_context, or None."""
+    return _current_job.get()
+
+
+class JobEventBus:
+    """
+    Fans job events out from worker threads to the asyncio queues of the
+    SSE streams watching that job. Events are per process; streams fall
+    back to polling the job store for workers running elsewhere.
+    """
+
+    def __init__(self):
+        self._subscribers = defaultdict(list)  # job_id -> [(loop, queue)]
+        self._lock = threading.Lock()
+
+    def subscribe(self, job_id: str) -> asyncio.Queue:
+        """Register a queue on the running event loop for job_id's events."""
+        queue = asyncio.Queue()
+        with self._lock:
+            self._subscribers[job_id].append((asyncio.get_running_loop(), queue))
+        return queue
+
+    def unsubscribe(self, job_id: str, queue: asyncio.Queue):
+        with self._lock:
+            subscribers = [entry for entry in self._subscribers.get(job_id, []) if entry[1] is not queue]
+            if subscribers:
+                self._subscribers[job_id] = subscribers
+            else:
+                self._subscribers.pop(job_id, None)
+
+    def has_subscribers(self, job_id: str) -> bool:
+        return bool(self._subscribers.get(job_id))
+
+    def publish(self, job_id: str, event: str, data: dict):
+        """Safe to call from any thread; a no-op when nobody is watching the job."""
+        with self._lock:
+            subscribers = list(self._subscribers.get(job_id, []))
+        for loop, queue in subscribers:
+            if event == "token" and queue.qsize() >= JOB_STREAM_MAX_BACKLOG:
+                continue
+            try:
+                loop.call_soon_threadsafe(queue.put_nowait, (event, data))
+            except RuntimeError:
+                # The subscriber's loop has already closed
+                pass
+
+
+job_events = JobEventBus()
+
+_token_stream_installed = False
+_token_stream_lock = threading.Lock()
+
+
+def install_token_stream():
+    """
+    Forward crewai's LLM stream chunks to the job that produced them. Chunks
+    only exist when the LLM is created with stream=True (LLM_STREAM=true).
+    """
+    global _token_stream_installed
+    with _token_stream_lock:
+        if _token_stream_installed:
+            return
+        try:
+            from crewai.events import crewai_event_bus
+            from crewai.events.types.llm_events import LLMStreamChunkEvent
+        except ImportError:
+            logger.warning("⚠️ This crewai version has no stream events; SSE streams will not carry tokens")
+            _token_stream_installed = True
+            return
+
+        # crewai calls stream chunk handlers synchronously in the emitting
+        # thread, so the job context is the one of the running analysis
+        @crewai_event_bus.on(LLMStreamChunkEvent)
+        def forward_chunk(source, event):
+            job_id = _current_job.get()
+            if job_id and job_events.has_subscribers(job_id):
+                job_events.publish(job_id, "token", {"agent": event.agent_role, "chunk": event.chunk})
+
+        _token_stream_installed = True
+
+
+def format_sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+def _status_key(job: dict) -> tuple:
+    return job.get("status"), job.get("current_stage"), job.get("message")
+
+
+async def stream_job_events(job_store, job_id: str, is_disconnected, status_projection: dict,
+                            poll_interval: float = JOB_STREAM_POLL_SECONDS):
+    """
+    Async generator of SSE messages for one job: a status event on every
+    stage transition, token events while agents stream output, and a final
+    complete event carrying the result or error.
+    """
+    queue = job_events.subscribe(job_id)
+    try:
+        job = await job_store.get(job_id, status_projection) or {"job_id": job_id}
+        last_key = _status_key(job)
+        yield format_sse("status", job)
+
+        while job.get("status") not in TERMINAL_STATUSES:
+            if await is_disconnected():
+                return
+            try:
+                event, data = await asyncio.wait_for(queue.get(), timeout=poll_interval)
+            except asyncio.TimeoutError:
+                job = await job_store.get(job_id, status_projection) or job
+                if _status_key(job) != last_key:
+                    last_key = _status_key(job)
+                    yield format_sse("status", job)
+                else:
+                    yield ": keepalive\n\n"
+                continue
+
+            if event == "token":
+                yield format_sse("token", data)
+                continue
+            job.update(data)
+            if _status_key(job) != last_key:
+                last_key = _status_key(job)
+                yield format_sse("status", job)
+
+        final = await job_store.get(job_id, {
+            "_id": 0, "job_id": 1, "status": 1, "message": 1, "result": 1, "result_blob": 1, "duration_seconds": 1})
+        if final:
+            from blob_store import load_result
+            final["result"] = await asyncio.to_thread(load_result, final)
+            final.pop("result_blob", None)
+        yield format_sse("complete", final or job)
+    finally:
+        job_events.unsubscribe(job_id, queue)
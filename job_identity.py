@@ -0,0 +1,83 @@
+import hashlib
+import os
+import re
+import threading
+import unicodedata
+
+
+# A job is one question about one report: job_id = hash(report fingerprint, normalized query).
+# The fingerprint is taken from the extracted text, not the PDF bytes, so a
+# report re-exported by the lab (new metadata, same content) maps to the same jobs.
+
+_TRAILING_PUNCTUATION = re.compile(r"[\s?!.]+$")
+
+# Reports with less text than this (scans OCR could not read, image-only
+# PDFs) are identified by their bytes instead; otherwise every such report
+# would share the fingerprint of the empty string, and one patient's upload
+# would attach to another patient's job
+FINGERPRINT_MIN_CHARS = int(os.environ.get("FINGERPRINT_MIN_CHARS", "100"))
+
+# How uploads were answered: "exact" (same report and question), "report"
+# (same report, new question, re-answered from the earlier analysis) or "miss"
+LOOKUP_OUTCOMES = ("exact", "report", "miss")
+
+_lookups = dict.fromkeys(LOOKUP_OUTCOMES, 0)
+_lookups_lock = threading.Lock()
+
+
+def normalize_query(query: str) -> str:
+    """Questions differing only in case, spacing or trailing punctuation are the same question."""
+    query = unicodedata.normalize("NFKC", query or "").casefold()
+    return _TRAILING_PUNCTUATION.sub("", " ".join(query.split()))
+
+
+def report_fingerprint(pages: list, file_hash: str) -> str:
+    """
+    SHA-256 of the report's text with case, unicode forms, whitespace and
+    page breaks normalized away. Reports with almost no text fall back to
+    file_hash, the SHA-256 of the PDF bytes.
+    """
+    from text_normalizer import normalize_text
+
+    text = " ".join(normalize_text(page) for page in pages)
+    text = " ".join(unicodedata.normalize("NFKC", text).casefold().split())
+    if len(text) < FINGERPRINT_MIN_CHARS:
+        return hashlib.sha256(f"file:{file_hash}".encode("utf-8")).hexdigest()
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def fingerprint_file(file_path: str, file_hash: str = None) -> str:
+    """
+    Fingerprint of a stored PDF, from its text layer only: OCR is left to
+    the worker, so a scan never holds an upload open. Scans therefore fall
+    back to the file-hash fingerprint, whether or not OCR is installed.
+    """
+    from report_cache import file_hash_for_path, get_text_layer_pages
+
+    file_hash = file_hash or file_hash_for_path(file_path)
+    return report_fingerprint(get_text_layer_pages(file_path, file_hash), file_hash)
+
+
+def make_job_id(fingerprint: str, query: str) -> str:
+    return hashlib.sha256(f"{fingerprint}\n{normalize_query(query)}".encode("utf-8")).hexdigest()
+
+
+def record_lookup(outcome: str):
+    from telemetry import JOB_LOOKUPS
+
+    with _lookups_lock:
+        _lookups[outcome] += 1
+    JOB_LOOKUPS.inc(outcome=outcome)
+
+
+def lookup_stats() -> dict:
+    """Counts per outcome in this process, and the share of uploads that skipped a full crew run."""
+    with _lookups_lock:
+        counts = dict(_lookups)
+    total = sum(counts.values())
+    return {
+        **counts,
+        "total": total,
+        "exact_hit_rate": round(counts["exact"] / total, 4) if total else 0.0,
+        "hit_rate": round((counts["exact"] + counts["report"]) / total, 4) if total else 0.0,
+    }
@@ -0,0 +1,116 @@
+import os
+import threading
+import time
+from datetime import datetime
+from job_events import job_events
+from job_store import LeaseLost
+from telemetry import record_stage
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+
+# A stage transition only forces a write if this long has passed since the last one
+JOB_PROGRESS_FLUSH_SECONDS = float(os.environ.get("JOB_PROGRESS_FLUSH_SECONDS", "5"))
+
+
+class JobProgressRecorder:
+    """
+    Buffers a job's stage transitions in memory and writes them to the job
+    store in as few updates as possible. Every finished stage is appended to
+    the job's stages[] timeline with its start, end and duration. Transitions
+    are published to SSE streams straight away, flushed or not.
+    """
+
+    def __init__(self, job_store, job_id: str, flush_interval: float = JOB_PROGRESS_FLUSH_SECONDS,
+                 upsert: bool = True, worker_id: str = None, lease_lost: threading.Event = None):
+        self.job_store = job_store
+        self.job_id = job_id
+        self.upsert = upsert
+        # When run by a worker, writes only land while it holds the job's
+        # lease, and the next stage aborts the run once the lease is lost
+        self.worker_id = worker_id
+        self.lease_lost = lease_lost
+        self.flush_interval = flush_interval
+        self.stages = []
+        self.writes = 0
+        self._pending_fields = {}
+        self._pending_stages = []
+        self._current = None  # (name, started_at, monotonic start)
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _close_current(self):
+        if self._current is None:
+            return
+        name, started_at, started = self._current
+        entry = {
+            "stage": name,
+            "started_at": started_at.isoformat(),
+            "ended_at": datetime.now().isoformat(),
+            "duration_seconds": round(time.monotonic() - started, 4),
+        }
+        if resource is not None:
+            # Peak resident memory of the worker process when the stage ended
+            entry["max_rss_kb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        self.stages.append(entry)
+        self._pending_stages.append(entry)
+        record_stage(name, started_at.timestamp(), entry["duration_seconds"])
+        self._current = None
+
+    def stage(self, name: str, message: str = None, status: str = None, flush: bool = False, **fields):
+        """Start a new stage, closing the current one. Extra fields are set on the job."""
+        if self.lease_lost is not None and self.lease_lost.is_set():
+            raise LeaseLost(f"Lost the lease of job {self.job_id} before stage {name}")
+        with self._lock:
+            self._close_current()
+            self._current = (name, datetime.now(), time.monotonic())
+            self._pending_fields["current_stage"] = name
+            if message is not None:
+                self._pending_fields["message"] = message
+            if status is not None:
+                self._pending_fields["status"] = status
+            self._pending_fields.update(fields)
+            due = time.monotonic() - self._last_flush >= self.flush_interval
+        self._publish(status, name, message)
+        if flush or due:
+            self.flush()
+
+    def set(self, **fields):
+        """Buffer extra fields for the next write."""
+        with self._lock:
+            self._pending_fields.update(fields)
+
+    def finish(self, status: str, stage: str, message: str, **fields):
+        """Close the timeline, record the terminal state and write everything out."""
+        with self._lock:
+            self._close_current()
+            self._pending_fields.update(status=status, current_stage=stage, message=message, **fields)
+        self.flush()
+        # Published after the write so a stream reading the result sees it
+        self._publish(status, stage, message)
+
+    def _publish(self, status: str, stage: str, message: str):
+        data = {"current_stage": stage}
+        if status is not None:
+            data["status"] = status
+        if message is not None:
+            data["message"] = message
+        job_events.publish(self.job_id, "status", data)
+
+    def flush(self):
+        """Write buffered fields and finished stages in a single update."""
+        with self._lock:
+            fields, stages = self._pending_fields, self._pending_stages
+            self._pending_fields, self._pending_stages = {}, []
+            self._last_flush = time.monotonic()
+        if not fields and not stages:
+            return
+        self.job_store.record_progress(self.job_id, fields, stages, upsert=self.upsert, worker_id=self.worker_id)
+        self.writes += 1
+
+    def durations(self) -> dict:
+        """Seconds spent in each finished stage, for logs and benchmarks."""
+        return {entry["stage"]: entry["duration_seconds"] for entry in self.stages}
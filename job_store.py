@@ -0,0 +1,523 @@
+import logging
+import math
+import os
+import threading
+from datetime import datetime, timedelta
+from typing import Optional, Tuple
+from pymongo import ASCENDING, DESCENDING, ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+
+# Configure logging for the job store
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# "mongo" talks to a real server; "memory" uses mongomock so tests and
+# benchmarks run without one (state is then per process)
+JOB_STORE_BACKEND = os.environ.get("JOB_STORE_BACKEND", "mongo")
+MONGO_URI = os.environ.get("MONGO_URI", "mongodb://localhost:27017/")
+MONGO_DB = os.environ.get("MONGO_DB", "blood_analysis")
+MONGO_MAX_POOL_SIZE = int(os.environ.get("MONGO_MAX_POOL_SIZE", "50"))
+MONGO_MIN_POOL_SIZE = int(os.environ.get("MONGO_MIN_POOL_SIZE", "0"))
+MONGO_TIMEOUT_MS = int(os.environ.get("MONGO_TIMEOUT_MS", "5000"))
+
+_lock = threading.Lock()
+_sync_client = None
+_async_client = None
+_memory_client = None
+
+
+def _client_options() -> dict:
+    from telemetry import mongo_event_listeners
+
+    return {
+        # Times every command and traces those issued inside a span
+        "event_listeners": mongo_event_listeners(),
+        "maxPoolSize": MONGO_MAX_POOL_SIZE,
+        "minPoolSize": MONGO_MIN_POOL_SIZE,
+        "serverSelectionTimeoutMS": MONGO_TIMEOUT_MS,
+        "connectTimeoutMS": MONGO_TIMEOUT_MS,
+        "socketTimeoutMS": MONGO_TIMEOUT_MS * 6,
+    }
+
+
+def _get_memory_client():
+    global _memory_client
+    with _lock:
+        if _memory_client is None:
+            import mongomock
+            _memory_client = mongomock.MongoClient()
+        return _memory_client
+
+
+def get_database():
+    """The process-wide synchronous database handle (one pooled client per process)."""
+    global _sync_client
+    if JOB_STORE_BACKEND == "memory":
+        return _get_memory_client()[MONGO_DB]
+    with _lock:
+        if _sync_client is None:
+            from pymongo import MongoClient
+            _sync_client = MongoClient(MONGO_URI, **_client_options())
+        return _sync_client[MONGO_DB]
+
+
+def get_async_database():
+    """The process-wide asyncio database handle, for use inside FastAPI handlers."""
+    global _async_client
+    if JOB_STORE_BACKEND == "memory":
+        return _AsyncDatabase(_get_memory_client()[MONGO_DB])
+    with _lock:
+        if _async_client is None:
+            from motor.motor_asyncio import AsyncIOMotorClient
+            _async_client = AsyncIOMotorClient(MONGO_URI, **_client_options())
+        return _async_client[MONGO_DB]
+
+
+class _AsyncCursor:
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    async def to_list(self, length=None):
+        docs = list(self._cursor)
+        return docs if length is None else docs[:length]
+
+
+class _AsyncCollection:
+    """Gives a mongomock collection the awaitable surface of a motor collection."""
+
+    _CURSOR_METHODS = ("find", "aggregate")
+
+    def __init__(self, collection):
+        self._collection = collection
+
+    def __getattr__(self, name):
+        attr = getattr(self._collection, name)
+        if name in self._CURSOR_METHODS:
+            return lambda *args, **kwargs: _AsyncCursor(attr(*args, **kwargs))
+
+        async def call(*args, **kwargs):
+            return attr(*args, **kwargs)
+        return call
+
+
+class _AsyncDatabase:
+    def __init__(self, database):
+        self._database = database
+
+    def __getitem__(self, name):
+        return _AsyncCollection(self._database[name])
+
+    async def command(self, *args, **kwargs):
+        return self._database.client.admin.command(*args, **kwargs)
+
+
+# Indexes every deployment needs: job_id lookups, the claim query and stats
+class LeaseLost(Exception):
+    """The worker no longer holds the job's lease: it expired and another worker claimed the job."""
+
+
+JOB_INDEXES = [
+    ([("job_id", ASCENDING)], {"unique": True}),
+    ([("status", ASCENDING), ("priority", ASCENDING), ("queued_at", ASCENDING)], {}),
+    ([("status", ASCENDING), ("started_at", DESCENDING)], {}),
+    ([("started_at", DESCENDING)], {}),
+    ([("batch_id", ASCENDING), ("status", ASCENDING), ("queued_at", ASCENDING)], {"sparse": True}),
+    ([("report_fingerprint", ASCENDING), ("status", ASCENDING)], {"sparse": True}),
+    # Uploads of bytes seen before reuse their fingerprint instead of parsing again
+    ([("file_hash", ASCENDING)], {"sparse": True}),
+    # Blob garbage collection lists every referenced digest
+    ([("result_blob.digest", ASCENDING)], {"sparse": True}),
+    ([("error_blob.digest", ASCENDING)], {"sparse": True}),
+]
+
+# The fields status polls and streams need; leaves out the result and error blobs
+STATUS_PROJECTION = {
+    "_id": 0, "job_id": 1, "status": 1, "current_stage": 1, "message": 1, "attempts": 1,
+    "batch_id": 1, "queued_at": 1, "processing_started": 1, "completed_at": 1, "failed_at": 1,
+    "duration_seconds": 1, "stages": 1, "heartbeat_at": 1,
+}
+
+# What an upload needs to attach to an existing job
+ATTACH_PROJECTION = {
+    "_id": 0, "job_id": 1, "status": 1, "message": 1, "result": 1, "result_blob": 1, "lease_expires_at": 1,
+}
+
+BATCH_INDEXES = [
+    ([("batch_id", ASCENDING)], {"unique": True}),
+]
+
+
+def _stats_pipeline(sample_size: int) -> list:
+    """One round trip: counts per status and per stage, plus recent durations."""
+    return [{"$facet": {
+        "by_status": [{"$group": {"_id": "$status", "count": {"$sum": 1}}}],
+        "by_stage": [{"$group": {"_id": "$current_stage", "count": {"$sum": 1}}}],
+        "durations": [
+            {"$match": {"status": "finished", "duration_seconds": {"$exists": True}}},
+            {"$sort": {"started_at": -1}},
+            {"$limit": sample_size},
+            {"$project": {"_id": 0, "duration_seconds": 1}},
+        ],
+    }}]
+
+
+def _percentile(sorted_values: list, q: float):
+    if not sorted_values:
+        return None
+    # Nearest-rank percentile
+    index = max(0, math.ceil(q * len(sorted_values)) - 1)
+    return round(sorted_values[index], 3)
+
+
+def _summarize_stats(facets: dict) -> dict:
+    by_status = {row["_id"]: row["count"] for row in facets["by_status"]}
+    durations = sorted(row["duration_seconds"] for row in facets["durations"])
+    return {
+        "total": sum(by_status.values()),
+        "by_status": by_status,
+        "by_stage": {str(row["_id"]): row["count"] for row in facets["by_stage"]},
+        "duration_seconds": {
+            "p50": _percentile(durations, 0.50),
+            "p95": _percentile(durations, 0.95),
+            "sample_size": len(durations),
+        },
+    }
+
+
+# Query builders shared by the sync and async stores
+
+def _promote_update() -> dict:
+    return {"$set": {
+        "status": "queued",
+        "current_stage": "queued",
+        "message": "Job is queued for processing.",
+        "queued_at": datetime.now().isoformat(),
+    }}
+
+
+def _new_job_fields(query: str, file_path: str, fields: dict) -> dict:
+    now = datetime.now().isoformat()
+    return {
+        "status": "queued",
+        "message": "Job is queued for processing.",
+        "query": query,
+        "file_path": file_path,
+        "queued_at": now,
+        "started_at": now,
+        "attempts": 0,
+        "current_stage": "queued",
+        **fields
+    }
+
+
+def _create_update(query: str, file_path: str, fields: dict) -> dict:
+    return {
+        "$set": _new_job_fields(query, file_path, fields),
+        "$unset": {"worker_id": "", "lease_expires_at": "", "heartbeat_at": "", "error_blob": ""},
+    }
+
+
+def _retry_filter(now: datetime) -> dict:
+    """Jobs a new upload runs again: failed ones, and running ones whose worker stopped heartbeating."""
+    return {"$or": [
+        {"status": "failed"},
+        {"status": "processing", "lease_expires_at": {"$lt": now.isoformat()}},
+    ]}
+
+
+def is_retriable(job: dict, now: datetime = None) -> bool:
+    """Client-side check of _retry_filter, to skip a write when the job is healthy."""
+    now = now or datetime.now()
+    if job.get("status") == "failed":
+        return True
+    return job.get("status") == "processing" and job.get("lease_expires_at", "") < now.isoformat()
+
+
+# Interactive jobs (priority 0) are claimed before batch jobs (priority 1)
+CLAIM_ORDER = [("priority", ASCENDING), ("queued_at", ASCENDING)]
+
+
+def _claim_filter(now: datetime, max_attempts: int) -> dict:
+    return {
+        "$or": [
+            {"status": "queued"},
+            {"status": "processing", "lease_expires_at": {"$lt": now.isoformat()}},
+        ],
+        "attempts": {"$not": {"$gte": max_attempts}},
+    }
+
+
+def _claim_update(now: datetime, worker_id: str, lease_seconds: int) -> dict:
+    return {
+        "$set": {
+            "status": "processing",
+            "message": "Job claimed by worker.",
+            "worker_id": worker_id,
+            "claimed_at": now.isoformat(),
+            "heartbeat_at": now.isoformat(),
+            "lease_expires_at": (now + timedelta(seconds=lease_seconds)).isoformat(),
+        },
+        "$inc": {"attempts": 1},
+    }
+
+
+def _transition_update(status: Optional[str], stage: Optional[str], message: Optional[str],
+                       fields: dict) -> dict:
+    update = dict(fields)
+    if status is not None:
+        update["status"] = status
+    if stage is not None:
+        update["current_stage"] = stage
+    if message is not None:
+        update["message"] = message
+    return {"$set": update}
+
+
+class JobStore:
+    """Synchronous job store, for worker threads and processes."""
+
+    def __init__(self, database=None):
+        database = database if database is not None else get_database()
+        self.jobs = database["jobs"]
+        self.batches = database["batches"]
+
+    def ensure_indexes(self) -> None:
+        for keys, options in JOB_INDEXES:
+            self.jobs.create_index(keys, **options)
+        for keys, options in BATCH_INDEXES:
+            self.batches.create_index(keys, **options)
+
+    def create(self, job_id: str, query: str, file_path: str, **fields) -> None:
+        """Create or re-queue a job; extra keyword arguments are stored on the document."""
+        self.jobs.update_one({"job_id": job_id}, _create_update(query, file_path, fields), upsert=True)
+
+    def claim(self, worker_id: str, lease_seconds: int, max_attempts: int) -> Optional[dict]:
+        """
+        Atomically claim the oldest queued job of the highest priority (lowest
+        number), or a processing job whose lease has expired because its
+        worker died. Returns None when the queue is empty.
+        """
+        now = datetime.now()
+        return self.jobs.find_one_and_update(
+            _claim_filter(now, max_attempts),
+            _claim_update(now, worker_id, lease_seconds),
+            sort=CLAIM_ORDER,
+            return_document=ReturnDocument.AFTER,
+        )
+
+    def renew_lease(self, job_id: str, worker_id: str, lease_seconds: int) -> bool:
+        """Heartbeat: the job stays this worker's for another lease_seconds. False if it is no longer this worker's."""
+        now = datetime.now()
+        result = self.jobs.update_one(
+            {"job_id": job_id, "worker_id": worker_id},
+            {"$set": {
+                "heartbeat_at": now.isoformat(),
+                "lease_expires_at": (now + timedelta(seconds=lease_seconds)).isoformat(),
+            }}
+        )
+        return result.matched_count > 0
+
+    def transition(self, job_id: str, status: str = None, stage: str = None, message: str = None,
+                   upsert: bool = False, **fields) -> None:
+        """Move a job to a new status and/or stage, setting any extra fields."""
+        self.jobs.update_one(
+            {"job_id": job_id}, _transition_update(status, stage, message, fields), upsert=upsert)
+
+    def record_progress(self, job_id: str, fields: dict, stages: list, upsert: bool = False,
+                        worker_id: str = None) -> None:
+        """
+        Set fields and append stage timeline entries in one write. With
+        worker_id, the write only applies while that worker holds the job,
+        and LeaseLost is raised otherwise.
+        """
+        update = {}
+        if fields:
+            update["$set"] = fields
+        if stages:
+            update["$push"] = {"stages": {"$each": stages}}
+        query = {"job_id": job_id} if worker_id is None else {"job_id": job_id, "worker_id": worker_id}
+        result = self.jobs.update_one(query, update, upsert=upsert and worker_id is None)
+        if worker_id is not None and not result.matched_count:
+            raise LeaseLost(f"Job {job_id} is no longer held by worker {worker_id}")
+
+    def promote_next(self, batch_id: str) -> Optional[dict]:
+        """Move a batch's oldest pending job onto the queue, freeing the slot a finished job held."""
+        return self.jobs.find_one_and_update(
+            {"batch_id": batch_id, "status": "pending"},
+            _promote_update(),
+            sort=[("queued_at", ASCENDING)],
+            return_document=ReturnDocument.AFTER,
+        )
+
+    def fail_exhausted(self, max_attempts: int) -> int:
+        """Fail jobs whose lease expired after the last allowed attempt."""
+        now = datetime.now().isoformat()
+        exhausted = {"status": "processing", "lease_expires_at": {"$lt": now}, "attempts": {"$gte": max_attempts}}
+        abandoned = list(self.jobs.find(exhausted, {"job_id": 1, "batch_id": 1}))
+        if not abandoned:
+            return 0
+        result = self.jobs.update_many(
+            {**exhausted, "job_id": {"$in": [job["job_id"] for job in abandoned]}},
+            {"$set": {
+                "status": "failed",
+                "message": f"Error: job abandoned after {max_attempts} attempts.",
+                "failed_at": now,
+                "current_stage": "failed"
+            }}
+        )
+        # Abandoned batch jobs still give their slot to the next pending job
+        for job in abandoned:
+            if job.get("batch_id"):
+                self.promote_next(job["batch_id"])
+        return result.modified_count
+
+    def get(self, job_id: str, projection: dict = None) -> Optional[dict]:
+        return self.jobs.find_one({"job_id": job_id}, projection)
+
+
+class AsyncJobStore:
+    """Asyncio job store, for FastAPI handlers; never blocks the event loop."""
+
+    def __init__(self, database=None):
+        self.database = database if database is not None else get_async_database()
+        self.jobs = self.database["jobs"]
+        self.batches = self.database["batches"]
+
+    async def ensure_indexes(self) -> None:
+        for keys, options in JOB_INDEXES:
+            await self.jobs.create_index(keys, **options)
+        for keys, options in BATCH_INDEXES:
+            await self.batches.create_index(keys, **options)
+
+    async def create(self, job_id: str, query: str, file_path: str, **fields) -> None:
+        """Create or re-queue a job; extra keyword arguments are stored on the document."""
+        await self.jobs.update_one({"job_id": job_id}, _create_update(query, file_path, fields), upsert=True)
+
+    async def create_or_attach(self, job_id: str, query: str, file_path: str,
+                               **fields) -> Tuple[Optional[dict], bool]:
+        """
+        Single-flight job creation. Atomically creates the job unless it
+        exists, so of many concurrent uploads of one report exactly one
+        creates it and the rest attach to it. A failed job, or one whose
+        worker stopped heartbeating, is re-queued by exactly one caller.
+        Returns (the existing job or None, whether this call queued it).
+        """
+        try:
+            existing = await self.jobs.find_one_and_update(
+                {"job_id": job_id},
+                {"$setOnInsert": {"job_id": job_id, **_new_job_fields(query, file_path, fields)}},
+                projection=ATTACH_PROJECTION,
+                upsert=True,
+                return_document=ReturnDocument.BEFORE,
+            )
+        except DuplicateKeyError:
+            # Two upserts raced to insert; the other one won
+            existing = await self.jobs.find_one({"job_id": job_id}, ATTACH_PROJECTION)
+        if existing is None:
+            return None, True
+
+        now = datetime.now()
+        if is_retriable(existing, now):
+            # Only the caller whose filter still matches re-queues it
+            requeued = await self.jobs.find_one_and_update(
+                {"job_id": job_id, **_retry_filter(now)},
+                _create_update(query, file_path, fields),
+                projection=ATTACH_PROJECTION,
+            )
+            if requeued is not None:
+                return requeued, True
+            existing = await self.jobs.find_one({"job_id": job_id}, ATTACH_PROJECTION)
+        return existing, False
+
+    async def link_patient(self, job_id: str, patient_id: str, report_date: str = None,
+                           projection: dict = None) -> Optional[dict]:
+        """Mark the job's report as one of patient_id's (see patient_trends.py); returns the updated job."""
+        return await self.jobs.find_one_and_update(
+            {"job_id": job_id},
+            {"$set": {f"patients.{patient_id}": report_date}},
+            projection=projection,
+            return_document=ReturnDocument.AFTER,
+        )
+
+    async def claim(self, worker_id: str, lease_seconds: int, max_attempts: int) -> Optional[dict]:
+        now = datetime.now()
+        return await self.jobs.find_one_and_update(
+            _claim_filter(now, max_attempts),
+            _claim_update(now, worker_id, lease_seconds),
+            sort=CLAIM_ORDER,
+            return_document=ReturnDocument.AFTER,
+        )
+
+    async def transition(self, job_id: str, status: str = None, stage: str = None, message: str = None,
+                         upsert: bool = False, **fields) -> None:
+        await self.jobs.update_one(
+            {"job_id": job_id}, _transition_update(status, stage, message, fields), upsert=upsert)
+
+    async def get(self, job_id: str, projection: dict = None) -> Optional[dict]:
+        return await self.jobs.find_one({"job_id": job_id}, projection)
+
+    async def find_fingerprint(self, file_hash: str) -> Optional[str]:
+        """The report fingerprint recorded for an earlier upload of the same PDF bytes."""
+        job = await self.jobs.find_one(
+            {"file_hash": file_hash, "report_fingerprint": {"$exists": True}}, {"_id": 0, "report_fingerprint": 1})
+        return job["report_fingerprint"] if job else None
+
+    async def find_report_result(self, fingerprint: str) -> Optional[dict]:
+        """The latest finished full analysis of a report, whatever question it answered."""
+        return await self.jobs.find_one(
+            {"report_fingerprint": fingerprint, "status": "finished", "base_job_id": None},
+            {"_id": 0, "job_id": 1},
+            sort=[("completed_at", DESCENDING)],
+        )
+
+    async def get_many(self, job_ids: list, projection: dict = None) -> dict:
+        """Fetch several jobs in one query, keyed by job_id."""
+        docs = await self.jobs.find({"job_id": {"$in": job_ids}}, projection).to_list(None)
+        return {doc["job_id"]: doc for doc in docs}
+
+    async def promote_next(self, batch_id: str) -> Optional[dict]:
+        return await self.jobs.find_one_and_update(
+            {"batch_id": batch_id, "status": "pending"},
+            _promote_update(),
+            sort=[("queued_at", ASCENDING)],
+            return_document=ReturnDocument.AFTER,
+        )
+
+    async def create_batch(self, batch_id: str, files: list, **fields) -> None:
+        """Record a batch and the job each of its files maps to."""
+        await self.batches.insert_one({
+            "batch_id": batch_id,
+            "files": files,
+            "job_ids": list(dict.fromkeys(entry["job_id"] for entry in files)),
+            "created_at": datetime.now().isoformat(),
+            **fields
+        })
+
+    async def get_batch(self, batch_id: str) -> Optional[dict]:
+        return await self.batches.find_one({"batch_id": batch_id}, {"_id": 0})
+
+    async def count(self, query: dict = None) -> int:
+        return await self.jobs.count_documents(query or {})
+
+    async def count_by_status(self) -> dict:
+        """Number of jobs in each status, for the queue-depth gauges."""
+        rows = await self.jobs.aggregate([{"$group": {"_id": "$status", "count": {"$sum": 1}}}]).to_list(None)
+        return {row["_id"]: row["count"] for row in rows if row["_id"]}
+
+    async def stats(self, sample_size: int = 1000) -> dict:
+        """Job counts and p50/p95 durations of the most recent finished jobs, in one aggregation."""
+        facets = (await self.jobs.aggregate(_stats_pipeline(sample_size)).to_list(None))[0]
+        return _summarize_stats(facets)
+
+    async def document_stats(self) -> dict:
+        """Count and average size of job documents, from collStats where the server supports it."""
+        try:
+            stats = await self.database.command("collStats", "jobs")
+            return {"count": stats.get("count"), "avg_bytes": stats.get("avgObjSize"), "bytes": stats.get("size")}
+        except Exception:
+            return {"count": await self.jobs.count_documents({}), "avg_bytes": None, "bytes": None}
+
+    async def ping(self) -> bool:
+        await self.database.command("ping")
+        return True
@@ -0,0 +1,257 @@
+import contextvars
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+
+# Configure logging for the LLM cache
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+LLM_CACHE_ENABLED = os.environ.get("LLM_CACHE_ENABLED", "true").lower() == "true"
+LLM_CACHE_BACKEND = os.environ.get("LLM_CACHE_BACKEND", "memory")  # "memory", "sqlite" or "mongo"
+LLM_CACHE_TTL_SECONDS = int(os.environ.get("LLM_CACHE_TTL_SECONDS", str(24 * 3600)))
+LLM_CACHE_MAX_BYTES = int(os.environ.get("LLM_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+LLM_CACHE_SQLITE_PATH = os.environ.get("LLM_CACHE_SQLITE_PATH", os.path.join("data", "llm_cache.sqlite3"))
+
+_bypass = contextvars.ContextVar("llm_cache_bypass", default=False)
+
+
+@contextmanager
+def bypass_llm_cache(bypass: bool = True):
+    """Skip the cache for every LLM call made inside this block (and threads started with its context)."""
+    token = _bypass.set(bypass)
+    try:
+        yield
+    finally:
+        _bypass.reset(token)
+
+
+def _normalize_content(content) -> str:
+    if not isinstance(content, str):
+        content = json.dumps(content, sort_keys=True, default=str)
+    # Whitespace-only differences should not miss the cache
+    return " ".join(content.split())
+
+
+def make_cache_key(model: str, temperature, messages, tools=None) -> str:
+    """Content address for one LLM call: model, temperature, prompt and tool outputs."""
+    if isinstance(messages, str):
+        messages = [{"role": "user", "content": messages}]
+    prompt = [(m.get("role"), _normalize_content(m.get("content"))) for m in messages]
+    tool_outputs = [content for role, content in prompt if role == "tool"]
+    tool_output_hash = hashlib.sha256(json.dumps(tool_outputs).encode("utf-8")).hexdigest()
+    payload = json.dumps({
+        "model": model,
+        "temperature": temperature,
+        "prompt": prompt,
+        "tools": sorted(json.dumps(tool, sort_keys=True, default=str) for tool in tools or []),
+        "tool_output_hash": tool_output_hash,
+    }, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class SQLiteTier:
+    """Persistent second tier in a local SQLite file, shared by workers on one machine."""
+
+    def __init__(self, path: str = LLM_CACHE_SQLITE_PATH, max_bytes: int = LLM_CACHE_MAX_BYTES):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self.max_bytes = max_bytes
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache ("
+                "key TEXT PRIMARY KEY, value TEXT, size INTEGER, expires_at REAL, last_used REAL)"
+            )
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def get(self, key: str):
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT value FROM llm_cache WHERE key = ? AND expires_at > ?", (key, now)).fetchone()
+            if row:
+                conn.execute("UPDATE llm_cache SET last_used = ? WHERE key = ?", (now, key))
+        return row[0] if row else None
+
+    def set(self, key: str, value: str, ttl: int):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO llm_cache VALUES (?, ?, ?, ?, ?)",
+                (key, value, len(value.encode("utf-8")), now + ttl, now))
+            conn.execute("DELETE FROM llm_cache WHERE expires_at <= ?", (now,))
+            total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM llm_cache").fetchone()[0]
+            if total > self.max_bytes:
+                # Drop least recently used entries until we are back under the limit
+                for old_key, size in conn.execute(
+                        "SELECT key, size FROM llm_cache ORDER BY last_used").fetchall():
+                    if total <= self.max_bytes:
+                        break
+                    conn.execute("DELETE FROM llm_cache WHERE key = ?", (old_key,))
+                    total -= size
+
+
+class MongoTier:
+    """Second tier in MongoDB, shared by every worker; expiry uses a TTL index."""
+
+    def __init__(self):
+        from job_store import get_database
+
+        self.collection = get_database()["llm_cache"]
+        self.collection.create_index("key", unique=True)
+        self.collection.create_index("expires_at", expireAfterSeconds=0)
+
+    def get(self, key: str):
+        doc = self.collection.find_one(
+            {"key": key, "expires_at": {"$gt": datetime.now()}}, {"value": 1})
+        return doc["value"] if doc else None
+
+    def set(self, key: str, value: str, ttl: int):
+        self.collection.update_one(
+            {"key": key},
+            {"$set": {"value": value, "expires_at": datetime.now() + timedelta(seconds=ttl)}},
+            upsert=True
+        )
+
+
+class LLMResponseCache:
+    """
+    In-process LRU of LLM responses with TTL and a byte limit, optionally
+    backed by a shared SQLite or Mongo tier. Counters are per process.
+    """
+
+    def __init__(self, ttl: int = LLM_CACHE_TTL_SECONDS, max_bytes: int = LLM_CACHE_MAX_BYTES,
+                 backend: str = LLM_CACHE_BACKEND):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> (value, size, expires_at)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "tier_hits": 0, "misses": 0, "bypassed": 0, "stores": 0, "evictions": 0}
+        self.tier = None
+        if backend == "sqlite":
+            self.tier = SQLiteTier(max_bytes=max_bytes)
+        elif backend == "mongo":
+            self.tier = MongoTier()
+        elif backend != "memory":
+            raise ValueError(f"Unknown LLM cache backend: {backend}")
+
+    def _count(self, name: str):
+        with self._lock:
+            self.stats[name] += 1
+
+    def _put_local(self, key: str, value: str, expires_at: float):
+        size = len(value.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (value, size, expires_at)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (_, evicted_size, _) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self.stats["evictions"] += 1
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, size, expires_at = entry
+                if expires_at > time.time():
+                    self._entries.move_to_end(key)
+                    self.stats["hits"] += 1
+                    return value
+                del self._entries[key]
+                self._bytes -= size
+
+        if self.tier is not None:
+            try:
+                value = self.tier.get(key)
+            except Exception as e:
+                logger.warning(f"⚠️ LLM cache tier lookup failed: {e}")
+                value = None
+            if value is not None:
+                self._put_local(key, value, time.time() + self.ttl)
+                self._count("tier_hits")
+                return value
+
+        self._count("misses")
+        return None
+
+    def set(self, key: str, value: str):
+        self._put_local(key, value, time.time() + self.ttl)
+        self._count("stores")
+        if self.tier is not None:
+            try:
+                self.tier.set(key, value, self.ttl)
+            except Exception as e:
+                logger.warning(f"⚠️ LLM cache tier write failed: {e}")
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            lookups = self.stats["hits"] + self.stats["tier_hits"] + self.stats["misses"]
+            return {
+                **self.stats,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl,
+                "backend": type(self.tier).__name__ if self.tier else "memory",
+                "hit_rate": round((self.stats["hits"] + self.stats["tier_hits"]) / lookups, 4) if lookups else 0.0,
+            }
+
+
+llm_cache = LLMResponseCache()
+
+
+def install_llm_cache(llm, cache: LLMResponseCache = None):
+    """
+    Route llm.call through the response cache. The instance is patched in
+    place (crewai may hand back a provider-specific LLM subclass, so we
+    cannot subclass LLM ourselves) and returned for convenience.
+    """
+    if not LLM_CACHE_ENABLED:
+        return llm
+    cache = cache or llm_cache
+    original_call = llm.call
+
+    def cached_call(messages, *args, **kwargs):
+        if _bypass.get():
+            cache._count("bypassed")
+            return original_call(messages, *args, **kwargs)
+
+        key = make_cache_key(
+            getattr(llm, "model", ""),
+            getattr(llm, "temperature", None),
+            messages,
+            kwargs.get("tools") or (args[0] if args else None),
+        )
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+
+        response = original_call(messages, *args, **kwargs)
+        # Only plain text answers are safe to replay; tool-call objects are not
+        if isinstance(response, str) and response.strip():
+            cache.set(key, response)
+        return response
+
+    object.__setattr__(llm, "call", cached_call)
+    return llm
@@ -1,39 +1,102 @@
-from crewai import Crew, Process
-from agents import doctor, nutritionist, exercise_specialist
-from task import help_patients, nutrition_analysis, exercise_planning
-from tasks import process_blood_report 
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException
-from fastapi.responses import JSONResponse
+import asyncio
+import time
+import uuid
+from collections import Counter
+from contextlib import asynccontextmanager
+from typing import List, Optional
+from worker import WorkerPool
+from job_store import ATTACH_PROJECTION, STATUS_PROJECTION, AsyncJobStore, is_retriable
+from job_events import stream_job_events
+from tasks import EXECUTION_MODES
+from llm_cache import llm_cache
+from rate_limiter import PRIORITIES, get_rate_limiter
+from uploads import MAX_BATCH_FILES, save_archive, save_upload
+from blob_store import load_result, resolve_blobs, storage_stats
+from patient_trends import PATIENT_ID, READINGS_PROJECTION, AsyncTrendStore, record_job
+from job_identity import fingerprint_file, lookup_stats, make_job_id, record_lookup
+from telemetry import HTTP_REQUEST_SECONDS, JOB_QUEUE_DEPTH, inject_context, metrics, setup_tracing, span
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Query, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from bson import ObjectId
-from pymongo import MongoClient
-import hashlib
+from starlette.concurrency import run_in_threadpool
 import os
 import logging
-from datetime import datetime
+from datetime import date, datetime
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Run workers inside the API process unless they are deployed separately
+RUN_EMBEDDED_WORKERS = os.environ.get("RUN_EMBEDDED_WORKERS", "true").lower() == "true"
+
+# Most jobs from one batch that may be queued or running at the same time
+BATCH_MAX_CONCURRENCY = int(os.environ.get("BATCH_MAX_CONCURRENCY", "4"))
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    try:
+        await job_store.ensure_indexes()
+    except Exception as e:
+        logger.error(f"Could not create job indexes: {e}")
+    try:
+        await trend_store.ensure_indexes()
+    except Exception as e:
+        logger.error(f"Could not create patient trend indexes: {e}")
+    pool = None
+    if RUN_EMBEDDED_WORKERS:
+        pool = WorkerPool()
+        pool.start()
+    yield
+    if pool:
+        pool.stop()
+
+
 # Initialize FastAPI app
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],  # Or specify domains: ["http://localhost:3000"]
     allow_methods=["*"],
 )
+# Server spans for every request when OTEL_TRACES_EXPORTER is set
+setup_tracing(app)
 
 
-client = MongoClient("mongodb://localhost:27017/")
-db = client["blood_analysis"]
-jobs = db["jobs"]
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    started = time.perf_counter()
+    response = await call_next(request)
+    # The route template, so /status/{job_id} is one series rather than one per job
+    route = request.scope.get("route")
+    HTTP_REQUEST_SECONDS.observe(
+        time.perf_counter() - started,
+        method=request.method,
+        route=getattr(route, "path", "unmatched"),
+        status=response.status_code
+    )
+    return response
 
-# Utility to compute SHA-256 hash of uploaded file
 
+# MONGODB
+job_store = AsyncJobStore()
+trend_store = AsyncTrendStore()
 
-def compute_file_hash(content: bytes) -> str:
-    return hashlib.sha256(content).hexdigest()
+async def fingerprint_upload(file_name: str, file_hash: str, file_path: str) -> str:
+    """
+    Report fingerprint of a stored upload: an earlier upload's if the bytes
+    were seen before, else from the PDF's text layer (no OCR). Unreadable
+    PDFs are rejected here rather than in a worker.
+    """
+    fingerprint = await job_store.find_fingerprint(file_hash)
+    if fingerprint:
+        return fingerprint
+    try:
+        with span("upload.fingerprint", **{"upload.file_hash": file_hash}):
+            return await run_in_threadpool(fingerprint_file, file_path, file_hash)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"{file_name}: could not read the PDF ({e}).")
 
 # Endpoint to handle PDF upload and analysis
 
@@ -41,73 +104,276 @@ def compute_file_hash(content: bytes) -> str:
 @app.post("/upload")
 async def analyze_blood_report(
     file: UploadFile = File(...),
-    query: str = Form(default="Summarise my Blood Test Report")
+    query: str = Form(default="Summarise my Blood Test Report"),
+    execution_mode: str = Form(default=None),
+    no_cache: bool = Form(default=False),
+    patient_id: str = Form(default=None),
+    report_date: str = Form(default=None)
 ):
     # Only allow PDF files
     if not file.filename.lower().endswith(".pdf"):
         raise HTTPException(
             status_code=400, detail="Only PDF files are supported.")
+    if execution_mode and execution_mode not in EXECUTION_MODES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"execution_mode must be one of: {', '.join(EXECUTION_MODES)}")
+    check_patient(patient_id)
+    report_date = parse_report_date(report_date)
 
-    # Read file contents and compute hash
-    content = await file.read()
-    file_hash = compute_file_hash(content)
-    existing_job = jobs.find_one({"job_id": file_hash})
-
-
-    if existing_job:
-        status = existing_job.get("status")
-        if status == "finished":
-            return JSONResponse(content={
-                "status": "success",
-                "message": "Result found in database.",
-                "result": existing_job.get("result", "hehe"),
-                "job_id": file_hash
-            })
-        elif status == "processing":
-            return JSONResponse(content={
-                "status": "processing",
-                "message": "Job is still processing.",
-                "job_id": file_hash
-            })
-        elif status == "failed":
-            return JSONResponse(content={
-                "status": "failed",
-                "message": existing_job.get("message", "Job failed."),
-                "job_id": file_hash
-            })
-
-    # Save the uploaded file to disk
-    os.makedirs("data", exist_ok=True)
-    file_path = os.path.join("data", f"{file_hash}.pdf")
-    with open(file_path, "wb") as f:
-        f.write(content)
+    # Stream the upload to data/uploads/ab/cd/<hash>.pdf, hashing and size-checking as we go
+    with span("upload.save", **{"upload.file_name": file.filename}):
+        file_hash, file_path, size = await save_upload(file)
+    # The job is this question about this report's content, whatever the PDF bytes
+    fingerprint = await fingerprint_upload(file.filename, file_hash, file_path)
+    job_id = make_job_id(fingerprint, query)
+    with span("upload.lookup", **{"job.id": job_id, "upload.bytes": size}):
+        existing_job = await job_store.get(job_id, ATTACH_PROJECTION)
+    if existing_job and not is_retriable(existing_job):
+        record_lookup("exact")
+        if patient_id:
+            await link_patient(job_id, patient_id, report_date)
+        return await attached_response(job_id, existing_job)
 
-    
-    jobs.update_one(
-        {"job_id": file_hash},
-        {"$set": {
-            "status": "processing",
-            "message": "Job is being processed.",
-            "started_at": datetime.now().isoformat(),
-            "file_name": file.filename
-        }},
-        upsert=True
+    # Same report, new question: answer it from the earlier analysis
+    # instead of running the whole crew again
+    base_job = None if no_cache else await job_store.find_report_result(fingerprint)
+
+    # Hand the analysis to the worker pool and return straight away. Of
+    # concurrent uploads of the same report and question only one creates
+    # the job; the others attach to it
+    existing_job, created = await job_store.create_or_attach(
+        job_id,
+        query.strip(),
+        file_path,
+        file_name=file.filename,
+        file_hash=file_hash,
+        report_fingerprint=fingerprint,
+        base_job_id=base_job["job_id"] if base_job else None,
+        execution_mode=execution_mode,
+        no_cache=no_cache,
+        priority=PRIORITIES["interactive"],
+        # The worker's spans continue this request's trace
+        trace_context=inject_context()
     )
+    if patient_id:
+        await link_patient(job_id, patient_id, report_date)
+    if not created:
+        record_lookup("exact")
+        return await attached_response(job_id, existing_job)
+    record_lookup("report" if base_job else "miss")
+
+    return JSONResponse(content={
+        "status": "queued",
+        "message": "Job queued for a follow-up answer." if base_job else "Job queued for analysis.",
+        "job_id": job_id
+    }, status_code=202)
+
 
+def check_patient(patient_id: Optional[str]):
+    if patient_id is not None and not PATIENT_ID.match(patient_id):
+        raise HTTPException(
+            status_code=400, detail="patient_id must be 1-64 letters, digits, '_' or '-'.")
+
+
+def parse_report_date(report_date: Optional[str]) -> Optional[str]:
+    """An upload's report date as YYYY-MM-DD; None leaves it to the date printed on the report."""
+    if not report_date:
+        return None
     try:
-        result = process_blood_report(query.strip(), file_path, file_hash)
+        return date.fromisoformat(report_date.strip()).isoformat()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="report_date must be a date in YYYY-MM-DD format.")
+
+
+async def link_patient(job_id: str, patient_id: str, report_date: Optional[str]):
+    """
+    Add the job's report to the patient's trends. The worker records the
+    readings when it finishes the job; a job that has already ended is
+    recorded here. Recording twice is harmless, so no upload is missed.
+    """
+    job = await job_store.link_patient(job_id, patient_id, report_date, READINGS_PROJECTION)
+    if job and job.get("status") in ("finished", "failed"):
+        await run_in_threadpool(record_job, {**job, "patients": {patient_id: report_date}})
+
+
+async def attached_response(job_id: str, job: dict) -> JSONResponse:
+    """Response for an upload that maps to an existing job: its result, or where it is."""
+    status = job.get("status")
+    if status == "finished":
         return JSONResponse(content={
             "status": "success",
-            "message": "Analysis completed.",
-            "result": result,
-            "job_id": file_hash
+            "message": "Result found in database.",
+            "result": await run_in_threadpool(load_result, job),
+            "job_id": job_id
         })
-    except Exception as e:
+    if status == "failed":
         return JSONResponse(content={
             "status": "failed",
-            "message": str(e),
-            "job_id": file_hash
-        }, status_code=500)
+            "message": job.get("message", "Job failed."),
+            "job_id": job_id
+        })
+    return JSONResponse(content={
+        "status": status,
+        "message": "Job is still processing.",
+        "job_id": job_id
+    })
+
+# Endpoint to upload many reports at once (PDFs and/or zip archives)
+
+
+@app.post("/upload/batch")
+async def analyze_blood_report_batch(
+    files: List[UploadFile] = File(...),
+    query: str = Form(default="Summarise my Blood Test Report"),
+    queries: Optional[List[str]] = Form(default=None),
+    execution_mode: str = Form(default=None),
+    no_cache: bool = Form(default=False),
+    max_concurrency: int = Form(default=BATCH_MAX_CONCURRENCY),
+    patient_id: str = Form(default=None),
+    report_dates: Optional[List[str]] = Form(default=None)
+):
+    if len(files) > MAX_BATCH_FILES:
+        raise HTTPException(
+            status_code=400, detail=f"A batch can contain at most {MAX_BATCH_FILES} files.")
+    if queries and len(queries) != len(files):
+        raise HTTPException(
+            status_code=400, detail="Provide either one query or one query per uploaded file.")
+    if report_dates and len(report_dates) != len(files):
+        raise HTTPException(
+            status_code=400, detail="Provide one report_date per uploaded file.")
+    if execution_mode and execution_mode not in EXECUTION_MODES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"execution_mode must be one of: {', '.join(EXECUTION_MODES)}")
+    check_patient(patient_id)
+    report_dates = [parse_report_date(report_date) for report_date in report_dates or [None] * len(files)]
+    if not 1 <= max_concurrency <= BATCH_MAX_CONCURRENCY:
+        raise HTTPException(
+            status_code=400, detail=f"max_concurrency must be between 1 and {BATCH_MAX_CONCURRENCY}.")
+
+    # Store every report first; a zip contributes each PDF inside it,
+    # all sharing the query and report date given for the archive
+    stored = []
+    stored_dates = []
+    for file, file_query, report_date in zip(files, queries or [query] * len(files), report_dates):
+        name = file.filename.lower()
+        if name.endswith(".zip"):
+            for file_name, file_hash, file_path, _ in await save_archive(file):
+                stored.append((file_name, file_hash, file_path, file_query))
+                stored_dates.append(report_date)
+        elif name.endswith(".pdf"):
+            file_hash, file_path, _ = await save_upload(file)
+            stored.append((file.filename, file_hash, file_path, file_query))
+            stored_dates.append(report_date)
+        else:
+            raise HTTPException(
+                status_code=400, detail=f"{file.filename}: only PDF and zip files are supported.")
+    if len(stored) > MAX_BATCH_FILES:
+        raise HTTPException(
+            status_code=400, detail=f"A batch can contain at most {MAX_BATCH_FILES} reports.")
+
+    # Jobs are keyed by report content and question (see job_identity.py);
+    # entries that already have a job, or repeat one earlier in this batch,
+    # are analyzed once and share it
+    batch_id = uuid.uuid4().hex
+    fingerprints = await asyncio.gather(*(
+        fingerprint_upload(file_name, file_hash, file_path) for file_name, file_hash, file_path, _ in stored))
+    job_ids = [make_job_id(fingerprint, entry[3]) for fingerprint, entry in zip(fingerprints, stored)]
+    existing_jobs = await job_store.get_many(list(set(job_ids)), ATTACH_PROJECTION)
+    entries = []
+    new_jobs = set()
+    for (file_name, file_hash, file_path, file_query), fingerprint, job_id, report_date in zip(
+            stored, fingerprints, job_ids, stored_dates):
+        reused = job_id in new_jobs or (job_id in existing_jobs and not is_retriable(existing_jobs[job_id]))
+        if not reused:
+            base_job = None if no_cache else await job_store.find_report_result(fingerprint)
+            # New jobs wait as "pending"; workers only see max_concurrency of
+            # them at a time and each finished job promotes the next one
+            _, created = await job_store.create_or_attach(
+                job_id,
+                file_query.strip(),
+                file_path,
+                file_name=file_name,
+                file_hash=file_hash,
+                report_fingerprint=fingerprint,
+                base_job_id=base_job["job_id"] if base_job else None,
+                execution_mode=execution_mode,
+                no_cache=no_cache,
+                batch_id=batch_id,
+                priority=PRIORITIES["batch"],
+                trace_context=inject_context(),
+                status="pending",
+                current_stage="pending",
+                message="Waiting for a free batch slot."
+            )
+            # Another upload created it between the lookup and now
+            reused = not created
+            if created:
+                new_jobs.add(job_id)
+                record_lookup("report" if base_job else "miss")
+        if reused:
+            record_lookup("exact")
+        if patient_id:
+            await link_patient(job_id, patient_id, report_date)
+        entries.append({"file_name": file_name, "job_id": job_id, "deduplicated": reused})
+
+    await job_store.create_batch(
+        batch_id,
+        entries,
+        max_concurrency=max_concurrency,
+        execution_mode=execution_mode
+    )
+    for _ in range(min(max_concurrency, len(new_jobs))):
+        await job_store.promote_next(batch_id)
+
+    logger.info(f"📦 Batch {batch_id}: {len(entries)} report(s), {len(new_jobs)} new job(s)")
+    return JSONResponse(content={
+        "status": "queued",
+        "message": "Batch queued for analysis.",
+        "batch_id": batch_id,
+        "total_reports": len(entries),
+        "new_jobs": len(new_jobs),
+        "deduplicated": len(entries) - len(new_jobs),
+        "files": entries
+    }, status_code=202)
+
+# Endpoint to check the aggregate status of a batch
+
+
+@app.get("/batches/{batch_id}")
+async def get_batch_status(batch_id: str):
+    batch = await job_store.get_batch(batch_id)
+    if not batch:
+        return JSONResponse(content={
+            "status": "not_found",
+            "message": "Batch not found."
+        })
+
+    jobs = await job_store.get_many(
+        batch["job_ids"], {"_id": 0, "job_id": 1, "status": 1, "current_stage": 1, "message": 1})
+    counts = Counter(job.get("status") for job in jobs.values())
+    if counts["pending"] + counts["queued"] + counts["processing"]:
+        status = "processing"
+    elif counts["failed"] == 0:
+        status = "finished"
+    elif counts["failed"] == len(jobs):
+        status = "failed"
+    else:
+        status = "completed_with_errors"
+
+    return JSONResponse(content={
+        "batch_id": batch_id,
+        "status": status,
+        "total_jobs": len(batch["job_ids"]),
+        "counts": dict(counts),
+        "max_concurrency": batch.get("max_concurrency"),
+        "created_at": batch.get("created_at"),
+        "files": [
+            {**entry, **{k: v for k, v in jobs.get(entry["job_id"], {}).items() if k != "job_id"}}
+            for entry in batch["files"]
+        ]
+    })
 
 # Endpoint to check job status
 
@@ -115,32 +381,95 @@ def serialize_mongo_doc(doc):
     doc["_id"] = str(doc["_id"])  # convert ObjectId to string
     return doc
 @app.get("/status/{job_id}")
-async def get_status(job_id: str):
-    job = jobs.find_one({"job_id": job_id})
+async def get_status(job_id: str, view: str = "full"):
+    # view=summary skips result and error_details, for clients that poll
+    if view not in ("full", "summary"):
+        raise HTTPException(status_code=400, detail="view must be one of: full, summary")
+    job = await job_store.get(job_id, STATUS_PROJECTION if view == "summary" else None)
     if not job:
         return JSONResponse(content={
             "status": "not_found",
             "message": "Job not found."
         })
-    
+    if view == "summary":
+        return JSONResponse(content=job)
+
+    # result and error_details are read back from the blob store
+    job = await run_in_threadpool(resolve_blobs, job)
     return JSONResponse(content=serialize_mongo_doc(job))
 
+# Server-sent events: stage transitions and streamed agent output until the job ends
+@app.get("/status/{job_id}/stream")
+async def stream_status(job_id: str, request: Request):
+    if not await job_store.get(job_id, {"_id": 1}):
+        return JSONResponse(content={
+            "status": "not_found",
+            "message": "Job not found."
+        })
+
+    return StreamingResponse(
+        stream_job_events(job_store, job_id, request.is_disconnected, STATUS_PROJECTION),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+# A patient's marker trends, precomputed as each report is processed;
+# no PDF is read and no LLM is called
+
+
+@app.get("/patients/{patient_id}/trends")
+async def get_patient_trends(
+    patient_id: str,
+    marker: Optional[List[str]] = Query(default=None),
+    history: bool = False
+):
+    check_patient(patient_id)
+    trends = await trend_store.get_trends(patient_id, marker)
+    if not trends:
+        return JSONResponse(content={
+            "status": "not_found",
+            "message": "No readings stored for this patient."
+        })
+    content = {
+        "status": "success",
+        "patient_id": patient_id,
+        "markers": len(trends),
+        "trends": trends
+    }
+    if history:
+        content["history"] = await trend_store.get_history(patient_id, marker)
+    return JSONResponse(content=content)
+
+# Dashboards poll /jobs/stats, so serve a short-lived snapshot
+JOB_STATS_CACHE_SECONDS = float(os.environ.get("JOB_STATS_CACHE_SECONDS", "5"))
+_stats_snapshot = {"expires_at": 0.0, "content": None}
+_stats_lock = asyncio.Lock()
+
+
 @app.get("/jobs/stats")
 async def get_mongo_job_stats():
 
     try:
-        total = jobs.count_documents({})
-        processing = jobs.count_documents({"status": "processing"})
-        finished = jobs.count_documents({"status": "finished"})
-        failed = jobs.count_documents({"status": "failed"})
-        logger.info(f"📊 Job stats - Total: {total}, Processing: {processing}, Finished: {finished}, Failed: {failed}")
-        return JSONResponse(content={
-            "total_jobs": total,
-            "processing_jobs": processing,
-            "finished_jobs": finished,
-            "failed_jobs": failed,
-            "status": "healthy"
-        })
+        async with _stats_lock:
+            if _stats_snapshot["expires_at"] <= time.monotonic():
+                stats = await job_store.stats()
+                by_status = stats["by_status"]
+                logger.info(f"📊 Job stats - Total: {stats['total']}, " + ", ".join(
+                    f"{status}: {count}" for status, count in by_status.items()))
+                _stats_snapshot["content"] = {
+                    "total_jobs": stats["total"],
+                    "pending_jobs": by_status.get("pending", 0),
+                    "queued_jobs": by_status.get("queued", 0),
+                    "processing_jobs": by_status.get("processing", 0),
+                    "finished_jobs": by_status.get("finished", 0),
+                    "failed_jobs": by_status.get("failed", 0),
+                    "stages": stats["by_stage"],
+                    "duration_seconds": stats["duration_seconds"],
+                    "generated_at": datetime.now().isoformat(),
+                    "status": "healthy"
+                }
+                _stats_snapshot["expires_at"] = time.monotonic() + JOB_STATS_CACHE_SECONDS
+            return JSONResponse(content=_stats_snapshot["content"])
     except Exception as e:
         logger.error(f"Error getting job stats: {e}")
         return JSONResponse(content={
@@ -148,11 +477,56 @@ async def get_mongo_job_stats():
             "message": str(e)
         }, status_code=500)
 
+# Disk usage of uploads and results, and how large job documents are
+STORAGE_STATS_CACHE_SECONDS = float(os.environ.get("STORAGE_STATS_CACHE_SECONDS", "60"))
+_storage_snapshot = {"expires_at": 0.0, "content": None}
+_storage_lock = asyncio.Lock()
+
+
+@app.get("/storage/stats")
+async def get_storage_stats():
+    async with _storage_lock:
+        # Walking the stores is O(files), so it is done at most once a minute
+        if _storage_snapshot["expires_at"] <= time.monotonic():
+            content = await run_in_threadpool(storage_stats)
+            content["jobs"] = await job_store.document_stats()
+            content["generated_at"] = datetime.now().isoformat()
+            _storage_snapshot["content"] = content
+            _storage_snapshot["expires_at"] = time.monotonic() + STORAGE_STATS_CACHE_SECONDS
+        return JSONResponse(content=_storage_snapshot["content"])
+
+# LLM response cache statistics for this process
+@app.get("/cache/stats")
+async def get_cache_stats():
+    return JSONResponse(content=llm_cache.snapshot())
+
+# How uploads were deduplicated by this process
+@app.get("/dedupe/stats")
+async def get_dedupe_stats():
+    return JSONResponse(content=lookup_stats())
+
+# Shared LLM rate limiter, as seen from this process
+@app.get("/rate_limit/stats")
+async def get_rate_limit_stats():
+    return JSONResponse(content=get_rate_limiter().snapshot())
+
+# Prometheus metrics for this process
+@app.get("/metrics")
+async def get_metrics():
+    try:
+        counts = await job_store.count_by_status()
+        # Statuses that emptied out are reported as 0 rather than their last value
+        for status in {"pending", "queued", "processing", "finished", "failed", *counts}:
+            JOB_QUEUE_DEPTH.set(counts.get(status, 0), status=status)
+    except Exception as e:
+        logger.error(f"Could not read job queue depth: {e}")
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
 # Health check endpoint
 @app.get("/health")
 async def health_check():
     try:
-        client.admin.command('ping')
+        await job_store.ping()
         
         return JSONResponse(content={
             "status": "healthy",
@@ -175,9 +549,18 @@ async def root():
         "version": "1.0.0",
         "endpoints": {
             "upload": "/upload - POST - Upload PDF for analysis",
-            "status": "/status/{job_id} - GET - Check job status",
+            "upload_batch": "/upload/batch - POST - Upload many PDFs or a zip archive",
+            "batch_status": "/batches/{batch_id} - GET - Aggregate status of a batch",
+            "status": "/status/{job_id} - GET - Check job status (?view=summary omits the result)",
+            "status_stream": "/status/{job_id}/stream - GET - Server-sent job progress events",
+            "patient_trends": "/patients/{patient_id}/trends - GET - Precomputed marker trends of a patient",
             "health": "/health - GET - Health check",
             "jobs_stats": "/jobs/stats - GET - Job statistics (MongoDB)",
+            "cache_stats": "/cache/stats - GET - LLM response cache statistics",
+            "dedupe_stats": "/dedupe/stats - GET - Exact, same-report and missed upload lookups",
+            "storage_stats": "/storage/stats - GET - Upload and result storage usage",
+            "rate_limit_stats": "/rate_limit/stats - GET - LLM rate limiter statistics",
+            "metrics": "/metrics - GET - Prometheus metrics",
             "test": "/test - POST - Test with sample data"
         }
     })
@@ -203,29 +586,23 @@ async def test_analysis():
                 f.write(b"%PDF-1.4\n%Dummy PDF for testing\n")
 
 
-        jobs.update_one(
-            {"job_id": test_hash},
-            {"$set": {
-                "status": "processing",
-                "message": "Test job is being processed.",
-                "started_at": datetime.now().isoformat(),
-                "test_mode": True
-            }},
-            upsert=True
+        await job_store.create(
+            test_hash,
+            test_query,
+            test_file_path,
+            test_mode=True
         )
-        result = process_blood_report(test_query, test_file_path, test_hash)
-        
+
         return JSONResponse(content={
-            "status": "success",
-            "message": "Test job completed successfully.",
+            "status": "queued",
+            "message": "Test job queued. Poll /status/{job_id} for the result.",
             "job_id": test_hash,
-             "result": result,
             "test_parameters": {
                 "query": test_query,
                 "file_path": test_file_path,
                 "hash": test_hash
             }
-        })
+        }, status_code=202)
         
     except Exception as e:
         logger.error(f"Test endpoint failed: {e}")
@@ -239,7 +616,11 @@ if __name__ == "__main__":
     logger.info("🚀 Starting Blood Test Analyzer API")
     logger.info("📋 Available endpoints:")
     logger.info("   POST /upload - Upload blood test PDF")
+    logger.info("   POST /upload/batch - Upload many PDFs or a zip archive")
+    logger.info("   GET /batches/{batch_id} - Check batch status")
     logger.info("   GET /status/{job_id} - Check analysis status")
+    logger.info("   GET /status/{job_id}/stream - Stream analysis progress (SSE)")
+    logger.info("   GET /patients/{patient_id}/trends - Patient marker trends")
     logger.info("   GET /health - Health check")
     logger.info("   GET /jobs/stats - Job statistics (MongoDB)")
     logger.info("   GET / - API information")
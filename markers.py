@@ -0,0 +1,349 @@
+import re
+from typing import Dict, List, Optional
+from pydantic import BaseModel, Field
+
+from text_normalizer import normalize_text
+
+
+class MarkerRecord(BaseModel):
+    name: str = Field(description="Canonical marker key, e.g. 'hemoglobin'.")
+    label: str = Field(description="Human readable marker name.")
+    value: float = Field(description="Measured value, converted to the canonical unit when known.")
+    unit: str = Field(description="Unit of value.")
+    ref_low: Optional[float] = Field(default=None, description="Lower bound of the reference range.")
+    ref_high: Optional[float] = Field(default=None, description="Upper bound of the reference range.")
+    range_source: str = Field(default="report", description="'report' if the range came from the report, else 'default'.")
+    flag: str = Field(default="unknown", description="'low', 'high', 'normal' or 'unknown'.")
+    abnormal: bool = Field(default=False, description="True when the value is outside the reference range.")
+    raw: str = Field(default="", description="The report line the record was extracted from.")
+
+
+class LabProfile(BaseModel):
+    name: str = Field(description="Profile name.")
+    detect: List[str] = Field(default_factory=list, description="Lowercase keywords that identify this lab format.")
+    patterns: List[str] = Field(default_factory=list, description="Record regexes tried before the generic one.")
+    aliases: Dict[str, str] = Field(default_factory=dict, description="Extra alias -> marker key mappings.")
+    default_units: Dict[str, str] = Field(default_factory=dict, description="Unit to assume when a line has none.")
+    decimal_comma: bool = Field(default=False, description="Values are written like 13,5 instead of 13.5.")
+
+
+# Canonical markers: label, unit, default adult reference range, aliases and
+# factors that convert other units (keyed by _unit_key) into the canonical one.
+MARKERS = {
+    "hemoglobin": {
+        "label": "Hemoglobin (Hb)", "unit": "g/dL", "range": (12.0, 17.5),
+        "aliases": ["hemoglobin", "haemoglobin", "hgb", "hb"],
+        "conversions": {"g/l": 0.1, "mmol/l": 1.611},
+    },
+    "wbc": {
+        "label": "White Blood Cells (WBC)", "unit": "10^3/uL", "range": (4.0, 11.0),
+        "aliases": ["total leucocyte count", "total leukocyte count", "total wbc count", "wbc count",
+                    "white blood cell count", "white blood cells", "leucocytes", "leukocytes", "tlc", "wbc"],
+        "conversions": {"10^9/l": 1.0, "/ul": 0.001, "cells/ul": 0.001, "k/ul": 1.0, "thou/ul": 1.0},
+    },
+    "platelets": {
+        "label": "Platelet Count", "unit": "10^3/uL", "range": (150.0, 410.0),
+        "aliases": ["platelet count", "platelets", "plt"],
+        "conversions": {"10^9/l": 1.0, "/ul": 0.001, "cells/ul": 0.001, "k/ul": 1.0,
+                        "thou/ul": 1.0, "lakhs/ul": 100.0, "lakh/ul": 100.0},
+    },
+    "rbc": {
+        "label": "Red Blood Cells (RBC)", "unit": "10^6/uL", "range": (4.0, 6.0),
+        "aliases": ["total rbc count", "rbc count", "red blood cell count", "red blood cells",
+                    "erythrocyte count", "rbc"],
+        "conversions": {"10^12/l": 1.0, "mill/ul": 1.0, "million/ul": 1.0, "m/ul": 1.0},
+    },
+    "mcv": {
+        "label": "MCV", "unit": "fL", "range": (80.0, 100.0),
+        "aliases": ["mean corpuscular volume", "mcv"],
+        "conversions": {"fl": 1.0},
+    },
+    "mch": {
+        "label": "MCH", "unit": "pg", "range": (27.0, 33.0),
+        "aliases": ["mean corpuscular hemoglobin", "mch"],
+        "conversions": {"pg": 1.0},
+    },
+    "total_cholesterol": {
+        "label": "Total Cholesterol", "unit": "mg/dL", "range": (0.0, 200.0),
+        "aliases": ["total cholesterol", "cholesterol total", "serum cholesterol", "cholesterol"],
+        "conversions": {"mmol/l": 38.67},
+    },
+    "ldl": {
+        "label": "LDL Cholesterol", "unit": "mg/dL", "range": (0.0, 100.0),
+        "aliases": ["ldl cholesterol", "cholesterol ldl", "ldl-c", "ldl - cholesterol",
+                    "low density lipoprotein", "ldl"],
+        "conversions": {"mmol/l": 38.67},
+    },
+    "hdl": {
+        "label": "HDL Cholesterol", "unit": "mg/dL", "range": (40.0, 60.0),
+        "aliases": ["hdl cholesterol", "cholesterol hdl", "hdl-c", "hdl - cholesterol",
+                    "high density lipoprotein", "hdl"],
+        "conversions": {"mmol/l": 38.67},
+    },
+    "triglycerides": {
+        "label": "Triglycerides", "unit": "mg/dL", "range": (0.0, 150.0),
+        "aliases": ["triglycerides", "triglyceride", "tg"],
+        "conversions": {"mmol/l": 88.57},
+    },
+    "glucose_fasting": {
+        "label": "Blood Sugar (Fasting)", "unit": "mg/dL", "range": (70.0, 100.0),
+        "aliases": ["fasting blood sugar", "blood sugar fasting", "blood sugar (fasting)",
+                    "fasting blood glucose", "fasting plasma glucose", "glucose fasting",
+                    "glucose (fasting)", "fasting glucose", "fbs"],
+        "conversions": {"mmol/l": 18.016},
+    },
+    "glucose_pp": {
+        "label": "Blood Sugar (PP)", "unit": "mg/dL", "range": (70.0, 140.0),
+        "aliases": ["post prandial blood sugar", "postprandial blood sugar", "blood sugar pp",
+                    "blood sugar (pp)", "glucose pp", "glucose (pp)", "postprandial glucose",
+                    "post prandial glucose", "ppbs"],
+        "conversions": {"mmol/l": 18.016},
+    },
+    "hba1c": {
+        "label": "HbA1c", "unit": "%", "range": (4.0, 5.7),
+        "aliases": ["glycated hemoglobin", "glycosylated hemoglobin", "hba1c"],
+        "conversions": {},
+    },
+    "creatinine": {
+        "label": "Creatinine", "unit": "mg/dL", "range": (0.6, 1.3),
+        "aliases": ["serum creatinine", "creatinine"],
+        "conversions": {"umol/l": 1 / 88.42},
+    },
+    "bun": {
+        "label": "Blood Urea Nitrogen", "unit": "mg/dL", "range": (7.0, 20.0),
+        "aliases": ["blood urea nitrogen", "urea nitrogen", "bun"],
+        "conversions": {"mmol/l": 2.801},
+    },
+    "urea": {
+        "label": "Urea", "unit": "mg/dL", "range": (15.0, 45.0),
+        "aliases": ["blood urea", "serum urea", "urea"],
+        "conversions": {"mmol/l": 6.006},
+    },
+    "vitamin_b12": {
+        "label": "Vitamin B12", "unit": "pg/mL", "range": (200.0, 900.0),
+        "aliases": ["vitamin b12", "vitamin b-12", "vit b12", "vit. b12", "cobalamin", "b12"],
+        "conversions": {"pmol/l": 1.355, "ng/l": 1.0},
+    },
+    "vitamin_d": {
+        "label": "Vitamin D3", "unit": "ng/mL", "range": (30.0, 100.0),
+        "aliases": ["25-hydroxy vitamin d", "25 hydroxy vitamin d", "25-oh vitamin d", "25(oh) vitamin d",
+                    "vitamin d, 25 - hydroxy", "vitamin d, 25-hydroxy",
+                    "vitamin d 25 hydroxy", "vitamin d (25-oh)", "vitamin d3", "vitamin d total",
+                    "vitamin d", "vit d3", "vit d"],
+        "conversions": {"nmol/l": 0.4006, "ug/l": 1.0},
+    },
+}
+
+# Record patterns are regexes over the whole report. "{alias}" is replaced with an
+# alternation of every marker alias and "{number}" with a number pattern; each
+# pattern must define the groups alias and value, and may define unit, flag,
+# low/high (a "low - high" range), lt ("<x") and gt (">x").
+_RANGE = r"(?:(?P<low>{number})\s*(?:-|to)\s*(?P<high>{number})|<\s*=?\s*(?P<lt>{number})|>\s*=?\s*(?P<gt>{number}))"
+_METHOD_LINES = r"(?:\n[^\S\n]*\([^)\n]*\)[^\S\n]*)*"
+
+# "Hemoglobin 13.5 L g/dL 13.0 - 17.0", also when the value sits below a heading
+# and an optional "(method)" line
+GENERIC_PATTERN = (
+    r"^[^\S\n]*(?:[\-*•][^\S\n]*)?(?:\d+[.)][^\S\n]+)?(?P<alias>{alias})(?![a-z/])"
+    r"(?:\([^)\n]*\)|[^\d\n]){0,60}?" + _METHOD_LINES + r"\n?[^\S\n]*"
+    r"(?P<value>{number})[^\S\n]*"
+    r"(?P<flag>\b(?:h|l|high|low)\b)?[^\S\n]*"
+    r"(?P<unit>(?:x\s?)?10\s?[\^*]?\s?\d+\s?/\s?\S+|(?!(?:ref|normal|range)\b)[^\s\d(\[\-:][^\s(\[]*)?[^\S\n]*"
+    r"[(\[]?[^\S\n]*(?:(?:ref(?:erence)?|normal|range|bio\.?\s*ref\.?\s*interval)[^\d<>\n]{0,20})?"
+    + _RANGE + "?"
+)
+
+# Lal PathLabs style, value glued to the end of the range line:
+# "Hemoglobin\n(Photometry)\n13.00 - 17.00 g/dL15.00"
+RANGE_LAST_PATTERN = (
+    r"^[^\S\n]*(?P<alias>{alias})(?![a-z/])[^\d\n]*" + _METHOD_LINES + r"\n[^\S\n]*"
+    + _RANGE + r"?[^\S\n]*(?P<unit>[^\d\s]*?(?:mm3)?)(?P<value>{number})[^\S\n]*$"
+)
+
+# Lal PathLabs style, value glued to the front of the name:
+# "0.90Creatinine\n(Modified Jaffe,Kinetic)\n0.70 - 1.30 mg/dL"
+VALUE_FIRST_PATTERN = (
+    r"^(?P<value>{number})(?P<alias>{alias})(?![a-z/])[^\d\n]*" + _METHOD_LINES + r"(?:\n|[^\S\n]+)[^\S\n]*"
+    + _RANGE + r"?[^\S\n]*(?P<unit>[^\d\s]+)?"
+)
+
+LAB_PROFILES: Dict[str, LabProfile] = {}
+
+
+def register_profile(profile: LabProfile):
+    """Add or replace a lab-format profile."""
+    LAB_PROFILES[profile.name] = profile
+    _compiled.pop(profile.name, None)
+
+
+_compiled = {}
+
+register_profile(LabProfile(name="generic"))
+register_profile(LabProfile(
+    name="indian",
+    detect=["lakhs", "cumm", "/cmm"],
+    aliases={"hb%": "hemoglobin", "total count": "wbc", "platelet count (plt)": "platelets"},
+    default_units={"platelets": "lakhs/cumm"},
+))
+register_profile(LabProfile(
+    name="lal_pathlabs",
+    detect=["lpl-", "bio. ref. interval", "national reference lab"],
+    patterns=[RANGE_LAST_PATTERN, VALUE_FIRST_PATTERN],
+))
+register_profile(LabProfile(
+    name="si_units",
+    detect=["mmol/l", "µmol/l", "μmol/l", "nmol/l"],
+    decimal_comma=True,
+))
+
+_NUMBER = r"\d{1,3}(?:,\d{2,3})+(?:\.\d+)?|\d+(?:[.,]\d+)?"
+
+
+def _compile_profile(profile: LabProfile):
+    """Compile a profile's patterns plus the generic one against every alias, longest alias first."""
+    if profile.name not in _compiled:
+        lookup = {}
+        for key, spec in MARKERS.items():
+            for alias in spec["aliases"]:
+                lookup[alias] = key
+        lookup.update(profile.aliases)
+        alternation = "|".join(re.escape(alias) for alias in sorted(lookup, key=len, reverse=True))
+        patterns = [
+            re.compile(
+                pattern.replace("{alias}", alternation).replace("{number}", _NUMBER),
+                re.IGNORECASE | re.MULTILINE,
+            )
+            for pattern in profile.patterns + [GENERIC_PATTERN]
+        ]
+        _compiled[profile.name] = (patterns, lookup)
+    return _compiled[profile.name]
+
+
+def _unit_key(unit: str) -> str:
+    key = unit.lower().replace(" ", "").replace("μ", "u").replace("µ", "u").replace("mcg", "ug")
+    key = key.rstrip(".,;")
+    key = re.sub(r"^x?10[\^*]?(\d+)", r"10^\1", key)
+    for cubic in ("/cumm", "/cmm", "/mm3", "/mm^3", "/ul"):
+        if key.endswith(cubic):
+            key = key[: -len(cubic)] + "/ul"
+            break
+    if key in ("lakhs", "lakh"):
+        key += "/ul"
+    return key
+
+
+def _to_float(text: str, decimal_comma: bool) -> float:
+    if decimal_comma and re.fullmatch(r"\d+,\d+", text) and not re.fullmatch(r"\d{1,3},\d{3}", text):
+        return float(text.replace(",", "."))
+    return float(text.replace(",", ""))
+
+
+def detect_profile(text: str) -> LabProfile:
+    """Pick the profile whose keywords appear most often, falling back to generic."""
+    lowered = text.lower()
+    best, best_hits = LAB_PROFILES["generic"], 0
+    for profile in LAB_PROFILES.values():
+        hits = sum(lowered.count(keyword) for keyword in profile.detect)
+        if hits > best_hits:
+            best, best_hits = profile, hits
+    return best
+
+
+def _build_record(key: str, match, profile: LabProfile) -> MarkerRecord:
+    spec = MARKERS[key]
+    groups = match.groupdict()
+    value = _to_float(groups["value"], profile.decimal_comma)
+    unit = (groups.get("unit") or profile.default_units.get(key) or spec["unit"]).strip()
+
+    low = high = None
+    if groups.get("low"):
+        low = _to_float(groups["low"], profile.decimal_comma)
+        high = _to_float(groups["high"], profile.decimal_comma)
+    elif groups.get("lt"):
+        low, high = 0.0, _to_float(groups["lt"], profile.decimal_comma)
+    elif groups.get("gt"):
+        low = _to_float(groups["gt"], profile.decimal_comma)
+
+    # Convert value and range into the canonical unit when we know how
+    unit_key = _unit_key(unit)
+    factor = 1.0 if unit_key == _unit_key(spec["unit"]) else spec["conversions"].get(unit_key)
+    if factor is not None:
+        value = round(value * factor, 2)
+        low = round(low * factor, 2) if low is not None else None
+        high = round(high * factor, 2) if high is not None else None
+        unit = spec["unit"]
+
+    range_source = "report"
+    if low is None and high is None and factor is not None:
+        low, high = spec["range"]
+        range_source = "default"
+
+    flag_token = (groups.get("flag") or "").lower()
+    if low is not None and value < low:
+        flag = "low"
+    elif high is not None and value > high:
+        flag = "high"
+    elif flag_token in ("h", "high"):
+        flag = "high"
+    elif flag_token in ("l", "low"):
+        flag = "low"
+    elif low is not None or high is not None:
+        flag = "normal"
+    else:
+        flag = "unknown"
+
+    return MarkerRecord(
+        name=key,
+        label=spec["label"],
+        value=value,
+        unit=unit,
+        ref_low=low,
+        ref_high=high,
+        range_source=range_source,
+        flag=flag,
+        abnormal=flag in ("low", "high"),
+        raw=" | ".join(line.strip() for line in match.group().strip().splitlines()),
+    )
+
+
+def extract_markers(text: str, profile: Optional[str] = None) -> List[MarkerRecord]:
+    """
+    Extract typed blood marker records from report text without calling the LLM.
+    The first occurrence of each marker wins. profile names a registered
+    LabProfile; by default it is detected from the text.
+    """
+    text = normalize_text(text)
+    lab_profile = LAB_PROFILES[profile] if profile else detect_profile(text)
+    patterns, lookup = _compile_profile(lab_profile)
+
+    # Earliest match per marker wins; at the same position, earlier patterns win
+    candidates = []
+    for order, pattern in enumerate(patterns):
+        for match in pattern.finditer(text):
+            candidates.append((match.start(), order, match))
+    candidates.sort(key=lambda candidate: candidate[:2])
+
+    records = {}
+    for _, _, match in candidates:
+        key = lookup[re.sub(r"\s+", " ", match.group("alias").lower())]
+        if key not in records:
+            records[key] = _build_record(key, match, lab_profile)
+    return list(records.values())
+
+
+def format_marker_table(records: List[MarkerRecord]) -> str:
+    """Compact one-line-per-marker table for agent prompts."""
+    if not records:
+        return "No markers could be extracted automatically; read the report with the Blood Test Report Reader tool."
+    lines = []
+    for record in records:
+        if record.ref_low is not None and record.ref_high is not None:
+            ref = f"{record.ref_low:g}-{record.ref_high:g}"
+        elif record.ref_high is not None:
+            ref = f"<{record.ref_high:g}"
+        elif record.ref_low is not None:
+            ref = f">{record.ref_low:g}"
+        else:
+            ref = "n/a"
+        lines.append(f"{record.label}: {record.value:g} {record.unit} (ref {ref}) {record.flag.upper()}")
+    return "\n".join(lines)
@@ -0,0 +1,320 @@
+import logging
+import os
+import re
+import threading
+from datetime import date, datetime
+from typing import List, Optional
+from pymongo import ASCENDING, ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from job_store import get_async_database, get_database
+
+
+# Configure logging for patient trends
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Rolling averages over this many of the most recent readings
+TREND_WINDOWS = tuple(int(w) for w in os.environ.get("TREND_WINDOWS", "3,5").split(",") if w.strip())
+# Dates such as 04/05/2023 are read as 4 May unless this is false
+REPORT_DATE_DAY_FIRST = os.environ.get("REPORT_DATE_DAY_FIRST", "true").lower() == "true"
+TREND_UPDATE_RETRIES = 5
+
+_MONTHS = {month: index for index, month in enumerate(
+    ("jan", "feb", "mar", "apr", "may", "jun", "jul", "aug", "sep", "oct", "nov", "dec"), start=1)}
+_DATE_PATTERNS = (
+    (re.compile(r"\b(\d{4})-(\d{1,2})-(\d{1,2})\b"), "ymd"),
+    (re.compile(r"\b(\d{1,2})[/.-](\d{1,2})[/.-](\d{4})\b"), "numeric"),
+    (re.compile(r"\b(\d{1,2})[\s-]([A-Za-z]{3})[A-Za-z]*[\s,-]+(\d{4})\b"), "dmy_name"),
+)
+# Dates near these words are preferred over any other date in the report
+_DATE_LABEL = re.compile(r"collect|sample|specimen|drawn|report(?:ed)? (?:date|on)", re.IGNORECASE)
+
+# Patient ids are used in job field paths (patients.<id>), so no dots or dollars
+PATIENT_ID = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+# Job fields record_job needs
+READINGS_PROJECTION = {
+    "_id": 0, "job_id": 1, "status": 1, "markers": 1, "patients": 1,
+    "report_date": 1, "report_fingerprint": 1, "processing_started": 1,
+}
+# Trend fields only the store needs
+_INTERNAL_FIELDS = {"_id": 0, "version": 0, "sum": 0}
+
+
+def _parse_date(match, kind: str) -> Optional[date]:
+    a, b, c = match.groups()
+    try:
+        if kind == "ymd":
+            return date(int(a), int(b), int(c))
+        if kind == "dmy_name":
+            month = _MONTHS.get(b[:3].lower())
+            return date(int(c), month, int(a)) if month else None
+        day, month = (int(a), int(b)) if REPORT_DATE_DAY_FIRST else (int(b), int(a))
+        if month > 12:
+            day, month = month, day
+        return date(int(c), month, day)
+    except ValueError:
+        return None
+
+
+def find_report_date(text: str) -> Optional[str]:
+    """
+    The sample collection date printed on a report, as YYYY-MM-DD. A date
+    on a line mentioning collection or reporting wins; otherwise the first
+    date in the report. None when the report has no date.
+    """
+    first = None
+    for line in text.splitlines():
+        for pattern, kind in _DATE_PATTERNS:
+            for match in pattern.finditer(line):
+                parsed = _parse_date(match, kind)
+                if parsed is None or parsed > date.today():
+                    continue
+                if _DATE_LABEL.search(line):
+                    return parsed.isoformat()
+                first = first or parsed
+    return first.isoformat() if first else None
+
+
+def _reading(point: dict) -> dict:
+    return {key: point.get(key) for key in ("date", "value", "flag", "job_id")}
+
+
+def apply_reading(trend: dict, point: dict) -> dict:
+    """
+    Fold one reading, newer than every reading already in trend, into the
+    trend summary. Returns the updated summary; an empty dict starts a new one.
+    """
+    value = point["value"]
+    count = trend.get("count", 0) + 1
+    total = trend.get("sum", 0.0) + value
+    previous = trend.get("latest")
+    recent = (trend.get("recent", []) + [{"date": point["date"], "value": value}])[-max(TREND_WINDOWS, default=1):]
+    minimum, maximum = trend.get("min"), trend.get("max")
+    updated = {
+        "patient_id": point["patient_id"],
+        "marker": point["marker"],
+        "label": point.get("label"),
+        "unit": point.get("unit"),
+        "count": count,
+        "sum": total,
+        "mean": round(total / count, 4),
+        "first_date": trend.get("first_date", point["date"]),
+        "latest": _reading(point),
+        "previous": previous,
+        "delta": round(value - previous["value"], 4) if previous else None,
+        "delta_pct": round((value - previous["value"]) / previous["value"] * 100, 2)
+        if previous and previous["value"] else None,
+        "direction": None if not previous else
+        "up" if value > previous["value"] else "down" if value < previous["value"] else "flat",
+        "min": {"value": value, "date": point["date"]} if minimum is None or value < minimum["value"] else minimum,
+        "max": {"value": value, "date": point["date"]} if maximum is None or value > maximum["value"] else maximum,
+        "rolling": {
+            str(window): round(sum(r["value"] for r in recent[-window:]) / len(recent[-window:]), 4)
+            for window in TREND_WINDOWS
+        },
+        "recent": recent,
+        "abnormal": bool(point.get("abnormal")),
+        "updated_at": datetime.now().isoformat(),
+    }
+    return updated
+
+
+TREND_INDEXES = {
+    "marker_points": [
+        ([("patient_id", ASCENDING), ("marker", ASCENDING), ("date", ASCENDING)], {}),
+        # One reading per marker per report, however many questions were asked about it
+        ([("patient_id", ASCENDING), ("marker", ASCENDING), ("report_key", ASCENDING)], {"unique": True}),
+    ],
+    "marker_trends": [
+        ([("patient_id", ASCENDING), ("marker", ASCENDING)], {"unique": True}),
+    ],
+}
+
+
+class TrendStore:
+    """
+    Per-patient marker readings and their trend summaries, for workers.
+    Readings go to marker_points; marker_trends holds one precomputed
+    summary per patient and marker, updated as each report is processed.
+    """
+
+    def __init__(self, database=None):
+        database = database if database is not None else get_database()
+        self.points = database["marker_points"]
+        self.trends = database["marker_trends"]
+
+    def ensure_indexes(self) -> None:
+        for keys, options in TREND_INDEXES["marker_points"]:
+            self.points.create_index(keys, **options)
+        for keys, options in TREND_INDEXES["marker_trends"]:
+            self.trends.create_index(keys, **options)
+
+    def record_report(self, patient_id: str, markers: list, job_id: str, report_key: str,
+                      report_date: str, date_source: str = "report") -> int:
+        """
+        Store a report's marker readings (markers.MarkerRecord dicts) for the
+        patient and update each marker's trend. Storing the same report again
+        changes nothing. Returns the readings stored or changed.
+        """
+        recorded = 0
+        for record in markers:
+            point = {
+                "patient_id": patient_id,
+                "marker": record["name"],
+                "label": record["label"],
+                "value": record["value"],
+                "unit": record["unit"],
+                "flag": record.get("flag"),
+                "abnormal": record.get("abnormal", False),
+                "ref_low": record.get("ref_low"),
+                "ref_high": record.get("ref_high"),
+                "date": report_date,
+                "date_source": date_source,
+                "job_id": job_id,
+                "report_key": report_key,
+            }
+            before = self.points.find_one_and_update(
+                {"patient_id": patient_id, "marker": point["marker"], "report_key": report_key},
+                {"$set": point, "$setOnInsert": {"recorded_at": datetime.now().isoformat()},
+                 "$addToSet": {"job_ids": job_id}},
+                upsert=True,
+                return_document=ReturnDocument.BEFORE,
+            )
+            if before and (before["value"], before["date"]) == (point["value"], point["date"]):
+                # The same report again (another question about it, or a retry)
+                continue
+            self._update_trend(point, replaced=before is not None)
+            recorded += 1
+        return recorded
+
+    def _update_trend(self, point: dict, replaced: bool) -> None:
+        key = {"patient_id": point["patient_id"], "marker": point["marker"]}
+        for _ in range(TREND_UPDATE_RETRIES):
+            trend = self.trends.find_one(key) or {}
+            latest = trend.get("latest")
+            if replaced or (latest and point["date"] < latest["date"]):
+                # A corrected or older reading: refold the marker's history
+                updated = {}
+                for reading in self.points.find(key).sort([("date", ASCENDING), ("recorded_at", ASCENDING)]):
+                    updated = apply_reading(updated, reading)
+            else:
+                updated = apply_reading(trend, point)
+
+            # Optimistic concurrency: two reports for one patient processed at
+            # once both read version n, and only one may write n + 1
+            version = trend.get("version", 0)
+            try:
+                result = self.trends.update_one(
+                    {**key, "version": version} if trend else {**key, "version": {"$exists": False}},
+                    {"$set": {**updated, "version": version + 1}},
+                    upsert=not trend,
+                )
+            except DuplicateKeyError:
+                continue
+            if result.matched_count or result.upserted_id is not None:
+                return
+        logger.warning(f"⚠️ Gave up updating trend {key} after {TREND_UPDATE_RETRIES} conflicting writes")
+
+    def rebuild(self, patient_id: str) -> int:
+        """Recompute every trend of a patient from its readings. Returns markers rebuilt."""
+        markers = self.points.distinct("marker", {"patient_id": patient_id})
+        for marker in markers:
+            updated = {}
+            for reading in self.points.find({"patient_id": patient_id, "marker": marker}).sort(
+                    [("date", ASCENDING), ("recorded_at", ASCENDING)]):
+                updated = apply_reading(updated, reading)
+            # Bumping the version makes any update computed before the rebuild retry
+            self.trends.update_one(
+                {"patient_id": patient_id, "marker": marker},
+                {"$set": updated, "$inc": {"version": 1}},
+                upsert=True,
+            )
+        return len(markers)
+
+
+class AsyncTrendStore:
+    """Read side of the trend store, for FastAPI handlers."""
+
+    def __init__(self, database=None):
+        database = database if database is not None else get_async_database()
+        self.points = database["marker_points"]
+        self.trends = database["marker_trends"]
+
+    async def ensure_indexes(self) -> None:
+        for keys, options in TREND_INDEXES["marker_points"]:
+            await self.points.create_index(keys, **options)
+        for keys, options in TREND_INDEXES["marker_trends"]:
+            await self.trends.create_index(keys, **options)
+
+    async def get_trends(self, patient_id: str, markers: List[str] = None) -> list:
+        """The precomputed trend of each marker of a patient."""
+        query = {"patient_id": patient_id}
+        if markers:
+            query["marker"] = {"$in": markers}
+        return await self.trends.find(query, _INTERNAL_FIELDS, sort=[("marker", ASCENDING)]).to_list(None)
+
+    async def get_history(self, patient_id: str, markers: List[str] = None) -> list:
+        """Every stored reading of a patient, oldest first."""
+        query = {"patient_id": patient_id}
+        if markers:
+            query["marker"] = {"$in": markers}
+        return await self.points.find(
+            query, {"_id": 0, "report_key": 0}, sort=[("marker", ASCENDING), ("date", ASCENDING)]).to_list(None)
+
+
+_trend_store = None
+_trend_store_lock = threading.Lock()
+
+
+def get_trend_store() -> TrendStore:
+    global _trend_store
+    with _trend_store_lock:
+        if _trend_store is None:
+            _trend_store = TrendStore()
+        return _trend_store
+
+
+def record_job(job: dict) -> int:
+    """
+    Store a job's extracted markers for every patient its report was
+    uploaded for (job["patients"], patient id -> report date or None).
+    The reading date is the date given at upload, else the date printed on
+    the report, else the day it was processed. Returns readings stored.
+    """
+    from telemetry import TREND_READINGS
+
+    markers = job.get("markers") or []
+    if not markers or not job.get("patients"):
+        return 0
+    # A report uploaded twice as different PDFs is still one set of readings
+    report_key = job.get("report_fingerprint") or job["job_id"]
+    recorded = 0
+    for patient_id, report_date in job["patients"].items():
+        date_source = "upload"
+        if not report_date:
+            report_date, date_source = job.get("report_date"), "report"
+        if not report_date:
+            report_date, date_source = (job.get("processing_started") or date.today().isoformat())[:10], "processed"
+        stored = get_trend_store().record_report(
+            patient_id, markers, job["job_id"], report_key, report_date, date_source)
+        TREND_READINGS.inc(stored, date_source=date_source)
+        logger.info(f"📈 Recorded {stored} reading(s) dated {report_date} ({date_source}) for patient {patient_id}")
+        recorded += stored
+    return recorded
+
+
+if __name__ == "__main__":
+    import json
+    import sys
+
+    # python patient_trends.py rebuild <patient_id>: recompute a patient's trends from the stored readings
+    # python patient_trends.py date report.pdf: the report date that would be detected
+    if sys.argv[1:2] == ["rebuild"]:
+        store = TrendStore()
+        store.ensure_indexes()
+        print(json.dumps({"rebuilt_markers": store.rebuild(sys.argv[2])}))
+    else:
+        from report_cache import get_report_pages
+        from text_normalizer import normalize_text
+        print(find_report_date("\n".join(normalize_text(page) for page in get_report_pages(sys.argv[2]))))
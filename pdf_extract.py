@@ -0,0 +1,139 @@
+import logging
+import math
+import multiprocessing
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+
+# Configure logging for PDF extraction
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Processes extracting pages; reports with fewer than PDF_PARALLEL_MIN_PAGES
+# pages are extracted in the calling process, where the pool would only add overhead
+PDF_EXTRACT_WORKERS = int(os.environ.get("PDF_EXTRACT_WORKERS", str(os.cpu_count() or 1)))
+PDF_PARALLEL_MIN_PAGES = int(os.environ.get("PDF_PARALLEL_MIN_PAGES", "4"))
+PDF_MAX_PAGES = int(os.environ.get("PDF_MAX_PAGES", "50"))
+# Pages with less text than this are treated as scanned and sent to OCR
+PDF_OCR_ENABLED = os.environ.get("PDF_OCR_ENABLED", "true").lower() == "true"
+PDF_OCR_MIN_CHARS = int(os.environ.get("PDF_OCR_MIN_CHARS", "20"))
+PDF_OCR_DPI = int(os.environ.get("PDF_OCR_DPI", "300"))
+PDF_OCR_LANGUAGE = os.environ.get("PDF_OCR_LANGUAGE", "eng")
+
+# The reader a pool process last opened, so its pages of one report share a parse
+_reader = (None, None, None)  # (path, mtime, PdfReader)
+
+
+def _open_reader(path: str):
+    global _reader
+    mtime = os.path.getmtime(path)
+    if _reader[0] != path or _reader[1] != mtime:
+        from pypdf import PdfReader
+        _reader = (path, mtime, PdfReader(path))
+    return _reader[2]
+
+
+def ocr_available() -> bool:
+    """OCR needs PyMuPDF to render pages and a tesseract binary to read them."""
+    if not PDF_OCR_ENABLED or shutil.which("tesseract") is None:
+        return False
+    try:
+        import pymupdf  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def _ocr_page(path: str, index: int) -> str:
+    import pymupdf
+
+    with pymupdf.open(path) as doc:
+        page = doc[index]
+        textpage = page.get_textpage_ocr(language=PDF_OCR_LANGUAGE, dpi=PDF_OCR_DPI, full=True)
+        return page.get_text(textpage=textpage).strip()
+
+
+def extract_page(path: str, index: int, ocr: bool) -> dict:
+    """
+    Text of one page, with how it was obtained ("text", "ocr" or "empty")
+    and how long it took. Runs in a pool process.
+    """
+    started = time.perf_counter()
+    # Same extraction as langchain's PyPDFLoader, so parsed text is unchanged
+    text = _open_reader(path).pages[index].extract_text(extraction_mode="plain").strip()
+    method = "text"
+    if len(text) < PDF_OCR_MIN_CHARS:
+        method = "empty"
+        if ocr:
+            ocr_text = _ocr_page(path, index)
+            if len(ocr_text) > len(text):
+                text, method = ocr_text, "ocr"
+    return {"page": index, "text": text, "method": method, "seconds": round(time.perf_counter() - started, 4)}
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_extract_pool() -> ProcessPoolExecutor:
+    """The process-wide extraction pool, started on first use."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn, like the worker pool: forking a process with live Mongo clients is unsafe
+            _pool = ProcessPoolExecutor(
+                max_workers=PDF_EXTRACT_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+
+def page_count(path: str) -> int:
+    from pypdf import PdfReader
+
+    return len(PdfReader(path).pages)
+
+
+def extract_pages(path: str, max_pages: int = PDF_MAX_PAGES, workers: int = PDF_EXTRACT_WORKERS,
+                  ocr: bool = None) -> list:
+    """
+    Extract every page of the PDF at path, in parallel across the pool for
+    longer reports, with OCR for pages that have no text layer unless ocr
+    is False. Returns one dict per page, in page order (see extract_page).
+    """
+    count = page_count(path)
+    if count > max_pages:
+        raise ValueError(f"Report has {count} pages; at most {max_pages} are supported")
+
+    skip_ocr = ocr is False
+    ocr = not skip_ocr and ocr_available()
+    if count < PDF_PARALLEL_MIN_PAGES or workers <= 1:
+        pages = [extract_page(path, index, ocr) for index in range(count)]
+    else:
+        pool = get_extract_pool()
+        # Consecutive pages go to the same process so each opens the file once
+        chunksize = max(1, math.ceil(count / (workers * 2)))
+        pages = list(pool.map(extract_page, [path] * count, range(count), [ocr] * count, chunksize=chunksize))
+
+    empty = [page["page"] + 1 for page in pages if page["method"] == "empty"]
+    if empty:
+        if skip_ocr:
+            reason = "OCR was not requested"
+        elif ocr:
+            reason = "OCR found no text"
+        else:
+            reason = "OCR is unavailable (needs tesseract and pymupdf)"
+        logger.warning(f"⚠️ Page(s) {empty} of {os.path.basename(path)} have no text layer and {reason}")
+    return pages
+
+
+if __name__ == "__main__":
+    import sys
+
+    # python pdf_extract.py report.pdf: per-page methods and timings
+    started = time.perf_counter()
+    pages = extract_pages(sys.argv[1])
+    for page in pages:
+        logger.info(f"📄 Page {page['page'] + 1}: {page['method']}, {len(page['text'])} chars, {page['seconds']}s")
+    logger.info(f"⏱️ {len(pages)} page(s) in {time.perf_counter() - started:.3f}s")
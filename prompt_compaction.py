@@ -0,0 +1,219 @@
+import logging
+import math
+import os
+import re
+import threading
+from collections import Counter, defaultdict
+from typing import List, Tuple
+from pydantic import BaseModel, Field
+
+from text_normalizer import normalize_text
+
+
+# Configure logging for prompt compaction
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+PROMPT_COMPACTION_ENABLED = os.environ.get("PROMPT_COMPACTION_ENABLED", "true").lower() == "true"
+# Tokens of report text an agent gets from the Blood Test Report Reader;
+# PROMPT_TOKEN_BUDGET_<AGENT> (e.g. PROMPT_TOKEN_BUDGET_DOCTOR) overrides it per agent
+PROMPT_TOKEN_BUDGET = int(os.environ.get("PROMPT_TOKEN_BUDGET", "1500"))
+DEFAULT_TOKEN_BUDGETS = {"doctor": 3000, "verifier": 3000}
+# A line on at least this share of the pages is page boilerplate (headers, footers, lab address)
+BOILERPLATE_MIN_PAGE_SHARE = float(os.environ.get("PROMPT_BOILERPLATE_MIN_PAGE_SHARE", "0.5"))
+
+# One token per word piece of up to 4 characters and per punctuation mark;
+# close to Gemini's tokenizer on lab reports without loading one
+_TOKEN = re.compile(r"\w+|[^\w\s]")
+# A value with a unit (13.5 g/dL, 45 %) or a reference range (13.0 - 17.0, <2.00)
+_RESULT = re.compile(
+    r"\d\s*(?:%|[a-zµμ]{1,8}/[a-z0-9µμ^]{1,8})|\d(?:[.,]\d+)?\s*(?:-|to)\s*\d|[<>]\s*=?\s*\d", re.IGNORECASE)
+# Section headings: short upper-case lines without digits, and the start of notes and disclaimers
+# (method annotations such as "(CHO-POD)" belong to the test above them)
+_UPPER_HEADING = re.compile(r"^(?!\()(?=.*[A-Z]{3})[^a-z\d]+$")
+_NOTE_HEADING = re.compile(r"^(?:notes?|comments?|interpretation|remarks?|disclaimer)\b", re.IGNORECASE)
+# Boilerplate kept once, since reference ranges depend on it
+_DEMOGRAPHIC = re.compile(r"\b(?:age|sex|gender|male|female|years?)\b", re.IGNORECASE)
+_DIGITS = re.compile(r"\d+")
+
+TRUNCATION_NOTE = "[Some report sections were left out to fit the prompt budget; see the extracted markers table.]"
+
+
+class Compaction(BaseModel):
+    """Report text compacted for one agent, and what it cost before and after."""
+    text: str = Field(description="Compacted report text.")
+    budget: int = Field(description="Token budget the text was fitted to.")
+    tokens_in: int = Field(description="Estimated tokens of the full report text.")
+    tokens_out: int = Field(description="Estimated tokens of the compacted text.")
+    lines_in: int = Field(default=0, description="Lines in the full report text.")
+    lines_out: int = Field(default=0, description="Lines kept.")
+    truncated: bool = Field(default=False, description="Result-bearing sections were dropped to fit the budget.")
+
+
+def estimate_tokens(text: str) -> int:
+    return sum(math.ceil(len(token) / 4) for token in _TOKEN.findall(text))
+
+
+def token_budget(agent: str = None) -> int:
+    """Budget for agent: PROMPT_TOKEN_BUDGET_<AGENT>, then the built-in default, then PROMPT_TOKEN_BUDGET."""
+    if not agent:
+        return PROMPT_TOKEN_BUDGET
+    override = os.environ.get(f"PROMPT_TOKEN_BUDGET_{agent.upper()}")
+    return int(override) if override else DEFAULT_TOKEN_BUDGETS.get(agent, PROMPT_TOKEN_BUDGET)
+
+
+def _is_heading(line: str) -> bool:
+    return bool(_UPPER_HEADING.match(line)) and len(line.split()) <= 8 or bool(_NOTE_HEADING.match(line))
+
+
+def _strip_boilerplate(pages: List[List[str]]) -> Tuple[List[List[str]], List[str]]:
+    """
+    Drop lines repeated on most pages, comparing with digits masked so
+    "Page 2 of 9" repeats too. Returns the pages and, once each, the
+    repeated lines about the patient (age, sex), which the agent still needs.
+    """
+    if len(pages) < 2:
+        return pages, []
+    seen_on = Counter()
+    for lines in pages:
+        seen_on.update({_DIGITS.sub("#", line) for line in lines})
+    min_pages = max(2, math.ceil(len(pages) * BOILERPLATE_MIN_PAGE_SHARE))
+
+    patient = {}
+    stripped = []
+    for lines in pages:
+        page = []
+        for line in lines:
+            key = _DIGITS.sub("#", line)
+            if seen_on[key] < min_pages or _RESULT.search(line):
+                page.append(line)
+            elif _DEMOGRAPHIC.search(line):
+                patient.setdefault(key, line)
+        stripped.append(page)
+    return stripped, list(patient.values())
+
+
+def _sections(pages: List[List[str]]) -> List[List[str]]:
+    """Split pages into sections at page breaks and headings, dropping repeated lines on the way."""
+    sections = []
+    seen = set()
+    for lines in pages:
+        current = []
+        for line in lines:
+            # Short labels such as "(Calculated)" or a marker name only make
+            # sense next to their value, so only longer lines are de-duplicated
+            if line in seen and (_RESULT.search(line) or len(line.split()) >= 4):
+                continue
+            seen.add(line)
+            if _is_heading(line) and current:
+                sections.append(current)
+                current = []
+            current.append(line)
+        if current:
+            sections.append(current)
+    return sections
+
+
+def compact_report(pages: List[str], budget: int = PROMPT_TOKEN_BUDGET) -> Compaction:
+    """
+    Compact report pages for an agent prompt: strip page boilerplate, drop
+    repeated lines, keep only sections with results in them, then fit the
+    budget, preferring sections with abnormal markers.
+    """
+    from markers import extract_markers
+
+    page_lines = [[line.strip() for line in normalize_text(page).split("\n") if line.strip()] for page in pages]
+    full_text = "".join(normalize_text(page) + "\n" for page in pages)
+    tokens_in = estimate_tokens(full_text)
+    lines_in = sum(len(lines) for lines in page_lines)
+
+    page_lines, patient = _strip_boilerplate(page_lines)
+    sections = _sections(page_lines)
+    result_sections = [section for section in sections if any(_RESULT.search(line) for line in section)]
+    # A report whose results are in no format we recognise keeps all its sections
+    sections = result_sections or sections
+    # Patient details come first and are always kept
+    if patient:
+        sections.insert(0, patient)
+
+    # Whole sections until the budget is spent: patient details and sections
+    # with abnormal markers first, then the rest, each in report order
+    texts = ["\n".join(section) for section in sections]
+    costs = [estimate_tokens(text) for text in texts]
+    # Leave room for the note saying something was left out
+    limit = budget - estimate_tokens(TRUNCATION_NOTE) if sum(costs) > budget else budget
+    first = [any(record.abnormal for record in extract_markers(text)) for text in texts]
+    if patient:
+        first[0] = True
+    order = sorted(range(len(sections)), key=lambda index: (not first[index], index))
+    chosen, spent = set(), 0
+    for index in order:
+        if spent + costs[index] <= limit:
+            chosen.add(index)
+            spent += costs[index]
+    truncated = len(chosen) < len(sections)
+    if not chosen and sections:
+        # Not even one section fits: keep as many lines of the most important one as do
+        lines = []
+        for line in sections[order[0]]:
+            if spent + estimate_tokens(line) > limit:
+                break
+            lines.append(line)
+            spent += estimate_tokens(line)
+        sections[order[0]] = lines
+        chosen.add(order[0])
+
+    kept = [sections[index] for index in sorted(chosen)]
+    text = "\n".join("\n".join(section) for section in kept)
+    if truncated:
+        text += "\n" + TRUNCATION_NOTE
+    return Compaction(
+        text=text,
+        budget=budget,
+        tokens_in=tokens_in,
+        tokens_out=estimate_tokens(text),
+        lines_in=lines_in,
+        lines_out=sum(len(section) for section in kept),
+        truncated=truncated,
+    )
+
+
+_usage = defaultdict(dict)  # job_id -> agent -> {"reads", "tokens_in", "tokens_out"}
+_usage_lock = threading.Lock()
+
+
+def record_usage(agent: str, compaction: Compaction):
+    """Add a report read to the current job's per-agent token counts (see job_events.job_context)."""
+    from job_events import current_job_id
+    from telemetry import PROMPT_REPORT_TOKENS
+
+    agent = agent or "unknown"
+    PROMPT_REPORT_TOKENS.inc(compaction.tokens_in, agent=agent, kind="in")
+    PROMPT_REPORT_TOKENS.inc(compaction.tokens_out, agent=agent, kind="out")
+    job_id = current_job_id()
+    if job_id is None:
+        return
+    with _usage_lock:
+        entry = _usage[job_id].setdefault(agent, {"reads": 0, "tokens_in": 0, "tokens_out": 0})
+        entry["reads"] += 1
+        entry["tokens_in"] += compaction.tokens_in
+        entry["tokens_out"] += compaction.tokens_out
+
+
+def pop_usage(job_id: str) -> dict:
+    """The job's per-agent token counts, forgotten once read."""
+    with _usage_lock:
+        return _usage.pop(job_id, {})
+
+
+if __name__ == "__main__":
+    import sys
+    from report_cache import get_report_pages
+
+    # python prompt_compaction.py report.pdf [agent]: compacted text and token counts
+    agent = sys.argv[2] if len(sys.argv) > 2 else None
+    compaction = compact_report(get_report_pages(sys.argv[1]), token_budget(agent))
+    print(compaction.text)
+    logger.info(
+        f"🗜️ {compaction.tokens_in} -> {compaction.tokens_out} tokens (budget {compaction.budget}), "
+        f"{compaction.lines_in} -> {compaction.lines_out} lines{', truncated' if compaction.truncated else ''}")
@@ -0,0 +1,302 @@
+import contextvars
+import hashlib
+import heapq
+import itertools
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+
+# Configure logging for the rate limiter
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+LLM_RATE_LIMIT_ENABLED = os.environ.get("LLM_RATE_LIMIT_ENABLED", "true").lower() == "true"
+LLM_RATE_LIMIT_BACKEND = os.environ.get("LLM_RATE_LIMIT_BACKEND", "sqlite")  # "memory", "sqlite" or "mongo"
+LLM_RATE_LIMIT_RPM = float(os.environ.get("LLM_RATE_LIMIT_RPM", "10"))
+LLM_RATE_LIMIT_BURST = float(os.environ.get("LLM_RATE_LIMIT_BURST", "5"))
+# Tokens batch work must leave in the bucket so interactive calls are never starved
+LLM_RATE_LIMIT_INTERACTIVE_RESERVE = float(os.environ.get("LLM_RATE_LIMIT_INTERACTIVE_RESERVE", "1"))
+LLM_RATE_LIMIT_MAX_RETRIES = int(os.environ.get("LLM_RATE_LIMIT_MAX_RETRIES", "5"))
+LLM_RATE_LIMIT_BACKOFF_SECONDS = float(os.environ.get("LLM_RATE_LIMIT_BACKOFF_SECONDS", "2"))
+LLM_RATE_LIMIT_SQLITE_PATH = os.environ.get(
+    "LLM_RATE_LIMIT_SQLITE_PATH", os.path.join("data", "rate_limit.sqlite3"))
+
+# Lower runs first
+PRIORITIES = {"interactive": 0, "batch": 1}
+
+_priority = contextvars.ContextVar("llm_priority", default="interactive")
+
+
+@contextmanager
+def llm_priority(priority: str):
+    """Schedule every LLM call made inside this block (and threads started with its context) at this priority."""
+    if priority not in PRIORITIES:
+        raise ValueError(f"Unknown LLM priority: {priority}")
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def _refill(tokens: float, updated_at: float, now: float, rate: float, capacity: float) -> float:
+    return min(capacity, tokens + max(0.0, now - updated_at) * rate)
+
+
+def _take(tokens: float, rate: float, need: float):
+    """Returns (tokens left, seconds to wait); the wait is 0 when a token was taken."""
+    if tokens >= need:
+        return tokens - 1, 0.0
+    return tokens, (need - tokens) / rate
+
+
+class MemoryBucketStore:
+    """Buckets in this process only."""
+
+    def __init__(self):
+        self._buckets = {}  # key -> (tokens, updated_at)
+        self._lock = threading.Lock()
+
+    def take(self, key: str, rate: float, capacity: float, reserve: float) -> float:
+        now = time.time()
+        with self._lock:
+            tokens, updated_at = self._buckets.get(key, (capacity, now))
+            tokens, wait = _take(_refill(tokens, updated_at, now, rate, capacity), rate, 1 + reserve)
+            self._buckets[key] = (tokens, now)
+        return wait
+
+    def drain(self, key: str, rate: float, seconds: float):
+        with self._lock:
+            self._buckets[key] = (-rate * seconds, time.time())
+
+
+class SQLiteBucketStore:
+    """Buckets in a local SQLite file, shared by every worker process on one machine."""
+
+    def __init__(self, path: str = LLM_RATE_LIMIT_SQLITE_PATH):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL, updated_at REAL)")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    def take(self, key: str, rate: float, capacity: float, reserve: float) -> float:
+        conn = self._connect()
+        try:
+            # IMMEDIATE takes the write lock up front so read-modify-write is atomic across processes
+            conn.execute("BEGIN IMMEDIATE")
+            now = time.time()
+            row = conn.execute("SELECT tokens, updated_at FROM buckets WHERE key = ?", (key,)).fetchone()
+            tokens, updated_at = row if row else (capacity, now)
+            tokens, wait = _take(_refill(tokens, updated_at, now, rate, capacity), rate, 1 + reserve)
+            conn.execute("INSERT OR REPLACE INTO buckets VALUES (?, ?, ?)", (key, tokens, now))
+            conn.execute("COMMIT")
+            return wait
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def drain(self, key: str, rate: float, seconds: float):
+        conn = self._connect()
+        try:
+            conn.execute("INSERT OR REPLACE INTO buckets VALUES (?, ?, ?)", (key, -rate * seconds, time.time()))
+        finally:
+            conn.close()
+
+
+class MongoBucketStore:
+    """Buckets in MongoDB, shared by workers on every machine; updates use optimistic versioning."""
+
+    def __init__(self):
+        from job_store import get_database
+
+        self.collection = get_database()["rate_limits"]
+        self.collection.create_index("key", unique=True)
+
+    def take(self, key: str, rate: float, capacity: float, reserve: float) -> float:
+        from pymongo.errors import DuplicateKeyError
+
+        while True:
+            now = time.time()
+            doc = self.collection.find_one({"key": key})
+            if doc is None:
+                tokens, wait = _take(capacity, rate, 1 + reserve)
+                try:
+                    self.collection.insert_one({"key": key, "tokens": tokens, "updated_at": now, "version": 0})
+                    return wait
+                except DuplicateKeyError:
+                    continue
+            tokens, wait = _take(
+                _refill(doc["tokens"], doc["updated_at"], now, rate, capacity), rate, 1 + reserve)
+            result = self.collection.update_one(
+                {"key": key, "version": doc["version"]},
+                {"$set": {"tokens": tokens, "updated_at": now}, "$inc": {"version": 1}}
+            )
+            if result.modified_count:
+                return wait
+
+    def drain(self, key: str, rate: float, seconds: float):
+        self.collection.update_one(
+            {"key": key},
+            {"$set": {"tokens": -rate * seconds, "updated_at": time.time()}, "$inc": {"version": 1}},
+            upsert=True
+        )
+
+
+# Provider errors that are not typed still carry one of these in their message;
+# a bare "429" would also match token counts, ids and timestamps
+RATE_LIMIT_MARKERS = ("RESOURCE_EXHAUSTED", "429 Too Many Requests")
+
+
+def _is_rate_limit_error(error: Exception) -> bool:
+    if getattr(error, "status_code", None) == 429:
+        return True
+    if type(error).__name__ == "RateLimitError":
+        return True
+    message = str(error)
+    return any(marker in message for marker in RATE_LIMIT_MARKERS)
+
+
+class RateLimiter:
+    """
+    Token bucket per model/API key with a shared store, so every worker
+    draws from the same quota. Callers in this process wait in a priority
+    queue; only the head of the queue draws from the bucket.
+    """
+
+    def __init__(self, rpm: float = LLM_RATE_LIMIT_RPM, burst: float = LLM_RATE_LIMIT_BURST,
+                 reserve: float = LLM_RATE_LIMIT_INTERACTIVE_RESERVE, backend: str = LLM_RATE_LIMIT_BACKEND):
+        self.rate = rpm / 60.0
+        self.capacity = max(burst, 1.0)
+        # Batch calls need 1 + reserve tokens, which must fit in the bucket
+        self.reserve = min(reserve, self.capacity - 1)
+        if backend == "memory":
+            self.store = MemoryBucketStore()
+        elif backend == "sqlite":
+            self.store = SQLiteBucketStore()
+        elif backend == "mongo":
+            self.store = MongoBucketStore()
+        else:
+            raise ValueError(f"Unknown rate limit backend: {backend}")
+        self._waiters = []  # heap of (priority, seq)
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self.stats = {"acquired": 0, "waited": 0, "wait_seconds": 0.0, "rate_limited": 0}
+
+    def acquire(self, key: str, priority: str = None) -> float:
+        """Block until a call for key may be made; returns the seconds spent waiting."""
+        priority = priority or _priority.get()
+        entry = (PRIORITIES[priority], next(self._seq))
+        reserve = self.reserve if PRIORITIES[priority] > PRIORITIES["interactive"] else 0.0
+        started = time.monotonic()
+        with self._cond:
+            heapq.heappush(self._waiters, entry)
+            try:
+                while True:
+                    if self._waiters[0] != entry:
+                        self._cond.wait()
+                        continue
+                    wait = self.store.take(key, self.rate, self.capacity, reserve)
+                    if wait == 0:
+                        break
+                    # Releases the lock, so a higher-priority caller can take the head meanwhile
+                    self._cond.wait(timeout=wait)
+            finally:
+                self._waiters.remove(entry)
+                heapq.heapify(self._waiters)
+                self._cond.notify_all()
+            waited = time.monotonic() - started
+            self.stats["acquired"] += 1
+            if waited > 0.01:
+                self.stats["waited"] += 1
+                self.stats["wait_seconds"] += waited
+        return waited
+
+    def backoff(self, key: str, attempt: int) -> float:
+        """
+        After a 429: empty the shared bucket for an exponentially growing
+        delay, so the next acquire() here and in every other worker waits it out.
+        """
+        delay = LLM_RATE_LIMIT_BACKOFF_SECONDS * (2 ** attempt)
+        delay += random.uniform(0, LLM_RATE_LIMIT_BACKOFF_SECONDS)
+        try:
+            self.store.drain(key, self.rate, delay)
+        except Exception as e:
+            logger.warning(f"⚠️ Could not drain rate limit bucket {key}: {e}")
+        with self._cond:
+            self.stats["rate_limited"] += 1
+        return delay
+
+    def snapshot(self) -> dict:
+        with self._cond:
+            return {
+                **self.stats,
+                "wait_seconds": round(self.stats["wait_seconds"], 3),
+                "queued": len(self._waiters),
+                "rpm": self.rate * 60,
+                "burst": self.capacity,
+                "interactive_reserve": self.reserve,
+                "backend": type(self.store).__name__,
+            }
+
+
+_rate_limiter = None
+_rate_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter() -> RateLimiter:
+    """The process-wide limiter, created on first use."""
+    global _rate_limiter
+    with _rate_limiter_lock:
+        if _rate_limiter is None:
+            _rate_limiter = RateLimiter()
+        return _rate_limiter
+
+
+def bucket_key(model: str, api_key: str = None) -> str:
+    """Quota is per model and per API key; the key itself is never stored."""
+    if not api_key:
+        return model
+    return f"{model}:{hashlib.sha256(api_key.encode('utf-8')).hexdigest()[:12]}"
+
+
+def install_rate_limiter(llm, limiter: RateLimiter = None):
+    """
+    Route llm.call through the rate limiter and retry 429s with backoff.
+    Install it before the response cache so cache hits do not use quota.
+    """
+    if not LLM_RATE_LIMIT_ENABLED:
+        return llm
+    from telemetry import LLM_RATE_LIMIT_WAIT_SECONDS, set_attributes
+
+    limiter = limiter or get_rate_limiter()
+    original_call = llm.call
+    key = bucket_key(getattr(llm, "model", ""), getattr(llm, "api_key", None))
+
+    def limited_call(messages, *args, **kwargs):
+        attempt = 0
+        while True:
+            waited = limiter.acquire(key)
+            LLM_RATE_LIMIT_WAIT_SECONDS.observe(waited)
+            set_attributes(**{"llm.rate_limit_wait_seconds": round(waited, 3)})
+            try:
+                return original_call(messages, *args, **kwargs)
+            except Exception as e:
+                if not _is_rate_limit_error(e) or attempt >= LLM_RATE_LIMIT_MAX_RETRIES:
+                    raise
+                delay = limiter.backoff(key, attempt)
+                logger.warning(f"⏳ LLM rate limited ({key}), retrying in {delay:.1f}s")
+                attempt += 1
+
+    object.__setattr__(llm, "call", limited_call)
+    return llm
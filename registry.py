@@ -0,0 +1,48 @@
+import threading
+
+
+class LazyRegistry:
+    """
+    Builds named objects (agents, tools, tasks) the first time they are asked
+    for and keeps them for the rest of the process, so importing a module
+    that declares them costs nothing until an analysis actually runs.
+    """
+
+    def __init__(self, kind: str):
+        self.kind = kind
+        self._factories = {}
+        self._instances = {}
+        self._lock = threading.RLock()
+
+    def register(self, name: str):
+        """Decorator registering a zero-argument factory under name."""
+        def decorator(factory):
+            self._factories[name] = factory
+            return factory
+        return decorator
+
+    def get(self, name: str):
+        if name not in self._factories:
+            raise KeyError(f"Unknown {self.kind}: {name}")
+        instance = self._instances.get(name)
+        if instance is None:
+            with self._lock:
+                instance = self._instances.get(name)
+                if instance is None:
+                    instance = self._instances[name] = self._factories[name]()
+        return instance
+
+    def names(self) -> list:
+        return list(self._factories)
+
+    def built(self) -> list:
+        """Names that have been constructed in this process so far."""
+        return list(self._instances)
+
+    def module_getattr(self, module_name: str):
+        """A module-level __getattr__ so `from module import name` builds on first use."""
+        def __getattr__(name):
+            if name in self._factories:
+                return self.get(name)
+            raise AttributeError(f"module {module_name!r} has no attribute {name!r}")
+        return __getattr__
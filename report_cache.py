@@ -0,0 +1,188 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime
+
+
+# Configure logging for the report cache
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Parsed reports live next to the uploaded PDFs
+PARSED_DIR = os.environ.get("PARSED_REPORTS_DIR", os.path.join("data", "parsed"))
+REPORT_CACHE_MAX_BYTES = int(os.environ.get("REPORT_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+REPORT_MEMORY_CACHE_MAX_BYTES = int(os.environ.get("REPORT_MEMORY_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+
+_memory_cache = OrderedDict()  # file_hash -> (pages, size in bytes)
+_memory_bytes = 0
+_cache_lock = threading.Lock()
+_parse_locks = {}
+
+
+def hash_file(path: str, chunk_size: int = 1024 * 1024) -> str:
+    """SHA-256 of a file on disk, read in chunks."""
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def file_hash_for_path(path: str) -> str:
+    """
+    Uploads are stored as data/uploads/ab/cd/<sha256>.pdf, so the hash is
+    usually the file name. Any other file is hashed from its contents.
+    """
+    stem = os.path.splitext(os.path.basename(path))[0]
+    if len(stem) == 64 and all(c in "0123456789abcdef" for c in stem):
+        return stem
+    return hash_file(path)
+
+
+def _artifact_path(file_hash: str) -> str:
+    return os.path.join(PARSED_DIR, f"{file_hash}.json")
+
+
+def _remember(file_hash: str, pages: list):
+    global _memory_bytes
+    size = sum(len(page) for page in pages)
+    with _cache_lock:
+        if file_hash in _memory_cache:
+            _memory_cache.move_to_end(file_hash)
+            return
+        _memory_cache[file_hash] = (pages, size)
+        _memory_bytes += size
+        while _memory_bytes > REPORT_MEMORY_CACHE_MAX_BYTES and len(_memory_cache) > 1:
+            _, (_, evicted_size) = _memory_cache.popitem(last=False)
+            _memory_bytes -= evicted_size
+
+
+def _recall(file_hash: str):
+    with _cache_lock:
+        entry = _memory_cache.get(file_hash)
+        if entry is None:
+            return None
+        _memory_cache.move_to_end(file_hash)
+        return entry[0]
+
+
+def _load_artifact(file_hash: str):
+    path = _artifact_path(file_hash)
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            artifact = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    # Touch the artifact so eviction treats it as recently used
+    os.utime(path, None)
+    return artifact["pages"]
+
+
+def _store_artifact(file_hash: str, source_path: str, pages: list, page_stats: list = None):
+    os.makedirs(PARSED_DIR, exist_ok=True)
+    path = _artifact_path(file_hash)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({
+            "file_hash": file_hash,
+            "source_path": source_path,
+            "page_count": len(pages),
+            "parsed_at": datetime.now().isoformat(),
+            "pages": pages,
+            # How each page was extracted and how long it took
+            "page_stats": page_stats or []
+        }, f)
+    os.replace(tmp_path, path)
+    evict_artifacts()
+
+
+def evict_artifacts(max_bytes: int = None):
+    """Delete least recently used artifacts until the directory fits in max_bytes."""
+    max_bytes = REPORT_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    try:
+        entries = [entry for entry in os.scandir(PARSED_DIR)
+                   if entry.is_file() and entry.name.endswith(".json")]
+    except FileNotFoundError:
+        return
+    stats = [(entry.stat().st_mtime, entry.stat().st_size, entry.path) for entry in entries]
+    total = sum(size for _, size, _ in stats)
+    for _, size, path in sorted(stats):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+            total -= size
+            logger.info(f"🧹 Evicted parsed report {os.path.basename(path)}")
+        except FileNotFoundError:
+            pass
+
+
+def _parse_pdf(path: str):
+    """Returns (page texts, per-page stats without the text)."""
+    from pdf_extract import extract_pages
+    from telemetry import PDF_PAGE_SECONDS, PDF_PARSE_SECONDS, set_attributes, timed
+
+    with timed(PDF_PARSE_SECONDS, "pdf.parse"):
+        results = extract_pages(path)
+        set_attributes(**{
+            "pdf.pages": len(results),
+            "pdf.ocr_pages": sum(page["method"] == "ocr" for page in results),
+        })
+    page_stats = []
+    for page in results:
+        PDF_PAGE_SECONDS.observe(page["seconds"], method=page["method"])
+        page_stats.append({key: value for key, value in page.items() if key != "text"})
+    return [page["text"] for page in results], page_stats
+
+
+def get_text_layer_pages(path: str, file_hash: str = None) -> list:
+    """
+    Page texts from the PDF's text layer only, never OCR, so uploads can be
+    fingerprinted without waiting on scanned pages. When every page has a
+    text layer this is the full parse, and it is cached for the worker.
+    """
+    from pdf_extract import extract_pages
+
+    file_hash = file_hash or file_hash_for_path(path)
+    results = extract_pages(path, ocr=False)
+    pages = [page["text"] for page in results]
+    if all(page["method"] == "text" for page in results) and _recall(file_hash) is None \
+            and _load_artifact(file_hash) is None:
+        _store_artifact(file_hash, path, pages, [
+            {key: value for key, value in page.items() if key != "text"} for page in results])
+        _remember(file_hash, pages)
+    return pages
+
+
+def get_report_pages(path: str, file_hash: str = None) -> list:
+    """
+    Return the extracted text of every page of the PDF at path.
+    The PDF is parsed at most once per file_hash; later calls are served
+    from memory or from the artifact under PARSED_DIR.
+    """
+    file_hash = file_hash or file_hash_for_path(path)
+
+    pages = _recall(file_hash)
+    if pages is not None:
+        return pages
+
+    with _cache_lock:
+        lock = _parse_locks.setdefault(file_hash, threading.Lock())
+
+    # Only one thread parses a given report; the others wait and reuse it
+    with lock:
+        pages = _recall(file_hash)
+        if pages is None:
+            pages = _load_artifact(file_hash)
+        if pages is None:
+            logger.info(f"📄 Parsing report {file_hash}")
+            pages, page_stats = _parse_pdf(path)
+            _store_artifact(file_hash, path, pages, page_stats)
+        _remember(file_hash, pages)
+
+    with _cache_lock:
+        _parse_locks.pop(file_hash, None)
+    return pages
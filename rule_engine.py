@@ -0,0 +1,220 @@
+import json
+import logging
+import os
+import re
+import threading
+from typing import Dict, List, Optional, Tuple
+from pydantic import BaseModel, ConfigDict, Field
+
+
+# Configure logging for the rule engine
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+RECOMMENDATION_RULES_PATH = os.environ.get(
+    "RECOMMENDATION_RULES_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "recommendation_rules.json"))
+# "rules" mode skips the nutrition and exercise agents only when at least this
+# share of the abnormal markers is explained by a rule...
+RULES_ONLY_MIN_CONFIDENCE = float(os.environ.get("RULES_ONLY_MIN_CONFIDENCE", "1.0"))
+# ...and at least this many markers were extracted, so a poorly parsed report is never trusted
+RULES_MIN_MARKERS = int(os.environ.get("RULES_MIN_MARKERS", "5"))
+
+
+class MarkerCondition(BaseModel):
+    """A threshold on an extracted marker (see markers.py); every field given must hold."""
+    model_config = ConfigDict(frozen=True)
+
+    marker: str = Field(description="Marker key from markers.MARKERS.")
+    flag: Optional[str] = Field(default=None, description="'low' or 'high', as flagged against the reference range.")
+    below: Optional[float] = Field(default=None, description="Fires when the value is below this.")
+    above: Optional[float] = Field(default=None, description="Fires when the value is above this.")
+
+    def matches(self, record) -> bool:
+        if record.name != self.marker:
+            return False
+        if self.flag is not None and record.flag != self.flag:
+            return False
+        if self.below is not None and not record.value < self.below:
+            return False
+        if self.above is not None and not record.value > self.above:
+            return False
+        return True
+
+
+class Rule(BaseModel):
+    """A condition, how to recognise it, and what to recommend for it."""
+    model_config = ConfigDict(frozen=True)
+
+    id: str = Field(description="Rule name.")
+    synonyms: Tuple[str, ...] = Field(default=(), description="Phrases that mention the condition anywhere in the report.")
+    markers: Tuple[MarkerCondition, ...] = Field(default=(), description="Marker thresholds that indicate the condition.")
+    recommendations: Dict[str, str] = Field(description="Recommendation per section (nutrition, exercise).")
+
+
+class RuleEvaluation(BaseModel):
+    """Which rules fired for one report, why, and how much of the report they explain."""
+    fired: List[str] = Field(default_factory=list, description="Rule ids, in rules-file order.")
+    mentioned: List[str] = Field(
+        default_factory=list, description="Rules whose synonyms are in the text but which were left unfired.")
+    evidence: Dict[str, List[str]] = Field(
+        default_factory=dict, description="Per rule, the phrases and markers that fired it.")
+    markers_found: int = Field(default=0, description="Markers extracted from the report.")
+    unexplained: List[str] = Field(default_factory=list, description="Abnormal markers no rule accounts for.")
+    confidence: float = Field(default=0.0, description="Share of abnormal markers explained by a fired rule.")
+
+    @property
+    def confident(self) -> bool:
+        return self.markers_found >= RULES_MIN_MARKERS and self.confidence >= RULES_ONLY_MIN_CONFIDENCE
+
+
+class RuleSet:
+    """
+    Rules compiled into one alternation of their distinct phrases, each
+    mapped to every rule it fires, so the report is lowercased and scanned
+    once, however many rules and phrases there are.
+    """
+
+    def __init__(self, rules: List[Rule], defaults: Dict[str, List[str]]):
+        self.rules = rules
+        self.defaults = defaults
+        phrases = {}
+        for index, rule in enumerate(rules):
+            for synonym in rule.synonyms:
+                phrases.setdefault(synonym.lower(), set()).add(index)
+        # Longest first: at each position the alternation reports the longest
+        # phrase starting there, and that phrase implies every phrase it
+        # contains. The lookahead lets matches overlap
+        self._phrases = sorted(phrases, key=len, reverse=True)
+        self._pattern = re.compile(
+            "(?=(" + "|".join(re.escape(phrase) for phrase in self._phrases) + "))") if self._phrases else None
+        self._contained = {
+            phrase: [other for other in self._phrases if other != phrase and other in phrase]
+            for phrase in self._phrases
+        }
+        self._rules_for = {phrase: sorted(rules_) for phrase, rules_ in phrases.items()}
+
+    @classmethod
+    def load(cls, path: str = RECOMMENDATION_RULES_PATH) -> "RuleSet":
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        return cls([Rule(**rule) for rule in data["rules"]], data.get("defaults", {}))
+
+    def match_text(self, text: str) -> Dict[int, List[str]]:
+        """Rule index -> phrases found, for every rule with a synonym in text."""
+        present = set()
+        if self._pattern is not None:
+            for match in self._pattern.finditer(text.lower()):
+                phrase = match.group(1)
+                if phrase not in present:
+                    present.add(phrase)
+                    present.update(self._contained[phrase])
+
+        found = {}
+        for phrase in self._phrases:
+            if phrase in present:
+                for index in self._rules_for[phrase]:
+                    found.setdefault(index, []).append(phrase)
+        return found
+
+    def evaluate(self, text: str, markers: list = None, mentions: bool = True) -> RuleEvaluation:
+        """
+        Fire rules on marker thresholds and, when mentions is true, on their
+        synonyms anywhere in the report text. Markers are extracted from text
+        when not given. A synonym only says a test or condition is named,
+        not that the value is out of range ("Total Cholesterol 150 (normal)"),
+        so rules-only mode passes mentions=False; synonym-only matches are
+        then listed in mentioned.
+        """
+        if markers is None:
+            from markers import extract_markers
+            markers = extract_markers(text)
+
+        matched = self.match_text(text)
+        evidence = {index: list(phrases) for index, phrases in matched.items()} if mentions else {}
+        explained = set()
+        for index, rule in enumerate(self.rules):
+            for record in markers:
+                if any(condition.matches(record) for condition in rule.markers):
+                    evidence.setdefault(index, []).append(f"marker:{record.name}")
+                    explained.add(record.name)
+
+        abnormal = [record.name for record in markers if record.abnormal]
+        unexplained = [name for name in abnormal if name not in explained]
+        fired = sorted(evidence)
+        return RuleEvaluation(
+            fired=[self.rules[index].id for index in fired],
+            mentioned=[self.rules[index].id for index in sorted(matched) if index not in evidence],
+            evidence={self.rules[index].id: evidence[index] for index in fired},
+            markers_found=len(markers),
+            unexplained=unexplained,
+            confidence=round(1 - len(unexplained) / len(abnormal), 4) if abnormal else 1.0,
+        )
+
+    def recommend(self, section: str, evaluation: RuleEvaluation) -> List[str]:
+        """Recommendations of the fired rules for one section, or the section's defaults."""
+        fired = set(evaluation.fired)
+        recommendations = [
+            rule.recommendations[section] for rule in self.rules
+            if rule.id in fired and section in rule.recommendations
+        ]
+        return recommendations or list(self.defaults.get(section, []))
+
+
+_rules = None
+_rules_lock = threading.Lock()
+
+
+def get_rules() -> RuleSet:
+    """The rules file, loaded and compiled on first use."""
+    global _rules
+    with _rules_lock:
+        if _rules is None:
+            _rules = RuleSet.load()
+            logger.info(f"📏 Loaded {len(_rules.rules)} recommendation rule(s) from {RECOMMENDATION_RULES_PATH}")
+        return _rules
+
+
+def format_recommendations(recommendations: List[str]) -> str:
+    return "\n".join(f"- {recommendation}" for recommendation in recommendations)
+
+
+def run_normal_report_check(path: str = os.path.join("data", "sample.pdf")) -> list:
+    """
+    Evaluate a report whose markers are all in range, as rules-only mode
+    does, and return a list of problems: abnormal markers in the report,
+    rules that fired, or advice other than the defaults. An empty list
+    means a healthy patient gets general advice only.
+    """
+    from markers import extract_markers
+    from report_cache import get_report_pages
+    from text_normalizer import normalize_text
+
+    rules = get_rules()
+    text = "\n".join(normalize_text(page) for page in get_report_pages(path))
+    markers = extract_markers(text)
+    evaluation = rules.evaluate(text, markers, mentions=False)
+
+    problems = []
+    abnormal = [record.name for record in markers if record.abnormal]
+    if abnormal:
+        problems.append(f"{path} is not an all-normal report: {abnormal} are abnormal")
+    if not markers:
+        problems.append(f"no markers extracted from {path}")
+    if evaluation.fired:
+        problems.append(f"rules fired on a normal report: {evaluation.evidence}")
+    for section in ("nutrition", "exercise"):
+        if rules.recommend(section, evaluation) != rules.defaults.get(section, []):
+            problems.append(f"{section} advice is not the defaults: {rules.recommend(section, evaluation)}")
+    return problems
+
+
+if __name__ == "__main__":
+    import sys
+
+    # python rule_engine.py [report.pdf]: check an all-normal report gets only general advice
+    problems = run_normal_report_check(*sys.argv[1:2])
+    for problem in problems:
+        logger.error(f"❌ {problem}")
+    if not problems:
+        logger.info("✅ No rule fired on the normal report; general advice only")
+    sys.exit(1 if problems else 0)
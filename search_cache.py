@@ -0,0 +1,215 @@
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from crewai_tools.tools import SerperDevTool
+
+
+# Configure logging for the search cache
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# "live" searches Serper on a cache miss; "offline" never touches the
+# network and answers misses from SEARCH_FIXTURES_PATH (or an empty result)
+SEARCH_MODE = os.environ.get("SEARCH_MODE", "live")
+SEARCH_CACHE_ENABLED = os.environ.get("SEARCH_CACHE_ENABLED", "true").lower() == "true"
+SEARCH_CACHE_TTL_SECONDS = int(os.environ.get("SEARCH_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+SEARCH_CACHE_SQLITE_PATH = os.environ.get(
+    "SEARCH_CACHE_SQLITE_PATH", os.path.join("data", "search_cache.sqlite3"))
+# The most-hit queries are kept in memory and answered without touching SQLite
+SEARCH_CACHE_WARM_SIZE = int(os.environ.get("SEARCH_CACHE_WARM_SIZE", "256"))
+SEARCH_FIXTURES_PATH = os.environ.get("SEARCH_FIXTURES_PATH", os.path.join("data", "search_fixtures.json"))
+
+_PUNCTUATION = re.compile(r"[^\w\s.%+]+")
+
+
+def normalize_query(query: str, search_type: str = "search") -> str:
+    """Queries differing only in case, punctuation or spacing share one cache entry."""
+    query = unicodedata.normalize("NFKC", query).casefold()
+    query = " ".join(_PUNCTUATION.sub(" ", query).split())
+    return f"{search_type}:{query}"
+
+
+class SearchCache:
+    """
+    Search results in a local SQLite file with a TTL, fronted by an
+    in-memory warm set of the most frequently hit queries.
+    """
+
+    def __init__(self, path: str = SEARCH_CACHE_SQLITE_PATH, ttl: int = SEARCH_CACHE_TTL_SECONDS,
+                 warm_size: int = SEARCH_CACHE_WARM_SIZE, fixtures_path: str = SEARCH_FIXTURES_PATH):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self.ttl = ttl
+        self.warm_size = warm_size
+        self._warm = OrderedDict()  # key -> [result, expires_at, hits]
+        self._pending_hits = {}  # warm hits not yet written to SQLite
+        self._lock = threading.Lock()
+        self.stats = {"warm_hits": 0, "hits": 0, "misses": 0, "fixture_hits": 0, "stores": 0}
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS search_cache ("
+                "key TEXT PRIMARY KEY, result TEXT, expires_at REAL, hits INTEGER, last_used REAL)"
+            )
+            # Start warm: preload the most popular unexpired queries
+            rows = conn.execute(
+                "SELECT key, result, expires_at, hits FROM search_cache WHERE expires_at > ? "
+                "ORDER BY hits DESC LIMIT ?", (time.time(), warm_size)).fetchall()
+        for key, result, expires_at, hits in rows:
+            self._warm[key] = [json.loads(result), expires_at, hits]
+        self.fixtures = self._load_fixtures(fixtures_path)
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    @staticmethod
+    def _load_fixtures(path: str) -> dict:
+        if not os.path.exists(path):
+            return {}
+        with open(path, encoding="utf-8") as f:
+            fixtures = json.load(f)
+        return {
+            normalize_query(query) if ":" not in query else query: result
+            for query, result in fixtures.items()
+        }
+
+    def _warm_put(self, key: str, result, expires_at: float, hits: int):
+        # Caller holds the lock. The least popular entry makes room.
+        self._warm[key] = [result, expires_at, hits]
+        if len(self._warm) > self.warm_size:
+            coldest = min(self._warm, key=lambda k: self._warm[k][2])
+            del self._warm[coldest]
+
+    def _flush_hits(self, conn):
+        with self._lock:
+            pending, self._pending_hits = self._pending_hits, {}
+        if pending:
+            conn.executemany(
+                "UPDATE search_cache SET hits = hits + ?, last_used = ? WHERE key = ?",
+                [(count, time.time(), key) for key, count in pending.items()])
+
+    def get(self, key: str):
+        now = time.time()
+        with self._lock:
+            entry = self._warm.get(key)
+            if entry is not None:
+                if entry[1] > now:
+                    entry[2] += 1
+                    self._pending_hits[key] = self._pending_hits.get(key, 0) + 1
+                    self.stats["warm_hits"] += 1
+                    return entry[0]
+                del self._warm[key]
+
+        with self._connect() as conn:
+            self._flush_hits(conn)
+            row = conn.execute(
+                "SELECT result, expires_at, hits FROM search_cache WHERE key = ? AND expires_at > ?",
+                (key, now)).fetchone()
+            if row:
+                conn.execute(
+                    "UPDATE search_cache SET hits = hits + 1, last_used = ? WHERE key = ?", (now, key))
+        with self._lock:
+            if row is None:
+                self.stats["misses"] += 1
+                return None
+            result = json.loads(row[0])
+            self._warm_put(key, result, row[1], row[2] + 1)
+            self.stats["hits"] += 1
+            return result
+
+    def set(self, key: str, result):
+        now = time.time()
+        with self._connect() as conn:
+            self._flush_hits(conn)
+            conn.execute(
+                "INSERT OR REPLACE INTO search_cache VALUES (?, ?, ?, COALESCE("
+                "(SELECT hits FROM search_cache WHERE key = ?), 0), ?)",
+                (key, json.dumps(result, default=str), now + self.ttl, key, now))
+            conn.execute("DELETE FROM search_cache WHERE expires_at <= ?", (now,))
+        with self._lock:
+            self._warm_put(key, result, now + self.ttl, 0)
+            self.stats["stores"] += 1
+
+    def fixture(self, key: str):
+        result = self.fixtures.get(key)
+        if result is not None:
+            with self._lock:
+                self.stats["fixture_hits"] += 1
+        return result
+
+    def export_fixtures(self, path: str = SEARCH_FIXTURES_PATH, limit: int = 500) -> int:
+        """Write the most popular cached results to a fixtures file for offline runs."""
+        with self._connect() as conn:
+            self._flush_hits(conn)
+            rows = conn.execute(
+                "SELECT key, result FROM search_cache ORDER BY hits DESC LIMIT ?", (limit,)).fetchall()
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({key: json.loads(result) for key, result in rows}, f, indent=2)
+        return len(rows)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {**self.stats, "warm_entries": len(self._warm), "mode": SEARCH_MODE}
+
+
+_search_cache = None
+_search_cache_lock = threading.Lock()
+
+
+def get_search_cache() -> SearchCache:
+    """The process-wide search cache, opened on first use."""
+    global _search_cache
+    with _search_cache_lock:
+        if _search_cache is None:
+            _search_cache = SearchCache()
+        return _search_cache
+
+
+def _offline_result(query: str, search_type: str) -> dict:
+    return {
+        "searchParameters": {"q": query, "type": search_type},
+        "organic": [],
+        "offline": True,
+    }
+
+
+class CachedSearchTool(SerperDevTool):
+    """SerperDevTool that answers repeated queries from the search cache and can run fully offline."""
+
+    def _run(self, **kwargs):
+        query = kwargs.get("search_query") or kwargs.get("query")
+        if not query:
+            raise ValueError("search_query is required")
+        search_type = kwargs.get("search_type", self.search_type)
+        if not SEARCH_CACHE_ENABLED and SEARCH_MODE != "offline":
+            return super()._run(**kwargs)
+
+        cache = get_search_cache()
+        key = normalize_query(query, search_type)
+        result = cache.get(key)
+        if result is not None:
+            return result
+
+        if SEARCH_MODE == "offline":
+            return cache.fixture(key) or _offline_result(query, search_type)
+
+        result = super()._run(**kwargs)
+        cache.set(key, result)
+        return result
+
+
+if __name__ == "__main__":
+    import sys
+
+    # python search_cache.py export [path]: snapshot popular results as offline fixtures
+    if len(sys.argv) > 1 and sys.argv[1] == "export":
+        path = sys.argv[2] if len(sys.argv) > 2 else SEARCH_FIXTURES_PATH
+        count = get_search_cache().export_fixtures(path)
+        logger.info(f"📦 Exported {count} cached search result(s) to {path}")
+    else:
+        logger.info(f"🔎 Search cache: {get_search_cache().snapshot()}")
@@ -1,7 +1,15 @@
+import contextvars
 import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import traceback
-from pymongo import MongoClient
+from blob_store import load_result, put_text
+from job_store import JobStore, LeaseLost
+from job_progress import JobProgressRecorder
+from patient_trends import READINGS_PROJECTION, find_report_date, record_job
+from prompt_compaction import pop_usage
+from telemetry import JOB_SECONDS
 
 
 # Configure logging for tasks
@@ -9,112 +17,270 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 #monogoDB
-client = MongoClient("mongodb://localhost:27017/")
-db = client["blood_analysis"]
-jobs = db["jobs"]
+job_store = JobStore()
 
+# "sequential" runs doctor -> nutrition -> exercise one after another,
+# "parallel" runs nutrition and exercise concurrently once the doctor is done,
+# "rules" runs only the doctor when the recommendation rules explain the
+# report (see rule_engine.py) and falls back to "parallel" otherwise
+EXECUTION_MODES = ("sequential", "parallel", "rules")
+DEFAULT_EXECUTION_MODE = os.environ.get("DEFAULT_EXECUTION_MODE", "parallel")
 
-def process_blood_report(query: str, file_path: str, file_hash: str):
+
+def merge_results(doctor_output: str, nutrition_output: str, exercise_output: str) -> str:
+    """Combine the three agents' outputs into the final report."""
+    return (
+        f"{doctor_output}\n\n"
+        f"## Nutrition Recommendations\n{nutrition_output}\n\n"
+        f"## Exercise Plan\n{exercise_output}"
+    )
+
+
+def run_sequential(inputs: dict) -> str:
+    from crew_templates import build_crew
+
+    # Every job gets its own agents and tasks (see crew_templates.py)
+    crew = build_crew("full")
+    # The doctor's output reaches the later tasks as crew context
+    result = crew.kickoff(inputs={
+        **inputs,
+        "doctor_findings": "See the doctor's analysis provided as context."
+    })
+    outputs = [str(output) for output in result.tasks_output]
+    return merge_results(*outputs)
+
+
+def run_parallel(inputs: dict, recorder: JobProgressRecorder = None) -> str:
+    from crew_templates import build_crew
+
+    doctor_crew = build_crew("doctor")
+    doctor_output = str(doctor_crew.kickoff(inputs=inputs))
+    if recorder:
+        recorder.stage("specialists_running", message="Running nutrition and exercise analysis...")
+
+    # Nutrition and exercise only depend on the report and the doctor's findings
+    follow_up_inputs = {**inputs, "doctor_findings": doctor_output}
+    nutrition_crew = build_crew("nutrition")
+    exercise_crew = build_crew("exercise")
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        nutrition_future = pool.submit(
+            contextvars.copy_context().run, nutrition_crew.kickoff, inputs=follow_up_inputs)
+        exercise_future = pool.submit(
+            contextvars.copy_context().run, exercise_crew.kickoff, inputs=follow_up_inputs)
+        nutrition_output = str(nutrition_future.result())
+        exercise_output = str(exercise_future.result())
+
+    return merge_results(doctor_output, nutrition_output, exercise_output)
+
+
+def run_rules(inputs: dict, evaluation, recorder: JobProgressRecorder = None) -> str:
+    from crew_templates import build_crew
+    from rule_engine import format_recommendations, get_rules
+
+    doctor_output = str(build_crew("doctor").kickoff(inputs=inputs))
+    if recorder:
+        recorder.stage("rules_applied", message="Adding rule-based nutrition and exercise advice...")
+    rules = get_rules()
+    return merge_results(
+        doctor_output,
+        format_recommendations(rules.recommend("nutrition", evaluation)),
+        format_recommendations(rules.recommend("exercise", evaluation)),
+    )
+
+
+def reanswer_query(query: str, previous_result: str, marker_table: str) -> str:
+    """
+    Answer a new question about a report that was already analyzed, with
+    one LLM call over the earlier analysis instead of a full crew run.
+    """
+    from agents import AGENT_SPECS, registry
+
+    doctor = AGENT_SPECS["doctor"]
+    answer = registry.get("llm").call([
+        {"role": "system", "content": f"You are a {doctor.role}. {doctor.backstory}"},
+        {"role": "user", "content": (
+            "A full analysis of the patient's blood test report is below. Answer the patient's "
+            "new question using it and the extracted markers; do not repeat the whole analysis.\n\n"
+            f"Extracted markers:\n{marker_table}\n\n"
+            f"Earlier analysis:\n{previous_result}\n\n"
+            f"Patient's question: {query}"
+        )},
+    ])
+    return f"{str(answer).strip()}\n\n## Full Report Analysis\n{previous_result}"
+
+
+def process_blood_report(query: str, file_path: str, job_id: str, execution_mode: str = None,
+                         use_cache: bool = True, priority: str = "interactive", base_job_id: str = None,
+                         worker_id: str = None, lease_lost=None):
+
+    # Stage changes are buffered and written in two updates: before the
+    # crew starts and when the job ends. Given a worker_id, they are only
+    # written while that worker holds the job (see worker.LeaseKeeper)
+    recorder = JobProgressRecorder(job_store, job_id, worker_id=worker_id, lease_lost=lease_lost)
 
     try:
-        # Import here to avoid circular imports and ensure all modules are available
-        from crewai import Crew, Process
-        from agents import doctor, nutritionist, exercise_specialist
-        from task import help_patients, nutrition_analysis, exercise_planning
+        execution_mode = execution_mode or DEFAULT_EXECUTION_MODE
+        if execution_mode not in EXECUTION_MODES:
+            raise ValueError(f"Unknown execution mode: {execution_mode}")
 
-        logger.info(f"🔄 Starting analysis for job {file_hash}")
+        processing_started = datetime.now()
+        logger.info(f"🔄 Starting analysis for job {job_id}")
         logger.info(f"📋 Query: {query}")
         logger.info(f"📁 File path: {file_path}")
+        logger.info(f"🔀 Execution mode: {execution_mode}")
 
         
         # MONGODB
-        jobs.update_one(
-            {"job_id": file_hash},
-            {"$set": {
-                "status": "processing",
-                "message": "Analysis in progress...",
-                "processing_started": datetime.now().isoformat(),
-                "current_stage": "initializing"
-            }},
-            upsert=True
+        recorder.stage(
+            "initializing",
+            status="processing",
+            message="Analysis in progress...",
+            processing_started=processing_started.isoformat(),
+            execution_mode=execution_mode
         )
 
-        # Create the crew and run analysis
-        logger.info(f"🤖 Creating crew for job {file_hash}")
+        # Parse the PDF once up front; every agent's report tool reads this copy
+        recorder.stage("report_parsing", message="Reading blood test report...")
+        from report_cache import get_report_pages
+        from text_normalizer import normalize_text
+        from markers import extract_markers, format_marker_table
+        pages = get_report_pages(file_path)
+        logger.info(f"📄 Report has {len(pages)} page(s)")
+
+        # Pull structured marker values out of the text without an LLM call
+        report_text = "\n".join(normalize_text(page) for page in pages)
+        markers = extract_markers(report_text)
+        marker_table = format_marker_table(markers)
+        logger.info(f"🧪 Extracted {len(markers)} marker(s), {sum(m.abnormal for m in markers)} abnormal")
+        # Dates the readings in patient trends when the upload gave no date
+        recorder.set(report_date=find_report_date(report_text))
+
+        from llm_cache import bypass_llm_cache
+        from job_events import install_token_stream, job_context
+        from rate_limiter import llm_priority
+
+        # A new question about an analyzed report only needs a re-answer
+        base_job = job_store.get(base_job_id, {"status": 1, "result": 1, "result_blob": 1}) if base_job_id else None
+        previous_result = load_result(base_job) if base_job and base_job.get("status") == "finished" else None
+        if previous_result:
+            recorder.stage(
+                "reanswering",
+                status="processing",
+                message="Answering from the earlier analysis...",
+                markers=[marker.model_dump() for marker in markers],
+                flush=True
+            )
+            logger.info(f"♻️ Re-answering job {job_id} from job {base_job_id}")
+            with job_context(job_id), bypass_llm_cache(not use_cache), llm_priority(priority):
+                result_str = reanswer_query(query, previous_result, marker_table)
+        else:
+            # Create the crew and run analysis
+            logger.info(f"🤖 Creating crew for job {job_id}")
         
     
-        # mongoDB
-        jobs.update_one(
-            {"job_id": file_hash},
-            {"$set": {
-                "message": "Creating analysis crew...",
-                "current_stage": "crew_creation"
-            }}
-        )
+            # mongoDB
+            recorder.stage(
+                "crew_creation",
+                message="Creating analysis crew...",
+                markers=[marker.model_dump() for marker in markers]
+            )
         
-        crew = Crew(
-            agents=[doctor, nutritionist, exercise_specialist],
-            tasks=[help_patients, nutrition_analysis, exercise_planning],
-            process=Process.sequential,
-        )
-
-        jobs.update_one(
-            {"job_id": file_hash},
-            {"$set": {
-                "status": "processing",
-                "message": "Running analysis...",
-                "current_stage": "analysis_running"
-            }}
-        )
-        logger.info(f"🚀 Starting crew analysis for job {file_hash}")
-        result = crew.kickoff(inputs={"query": query, "file_path": file_path})
-        result_str = str(result)
+            recorder.stage(
+                "analysis_running",
+                status="processing",
+                message="Running analysis...",
+                flush=True
+            )
+            logger.info(f"🚀 Starting crew analysis for job {job_id}")
+            inputs = {
+                "query": query,
+                "file_path": file_path,
+                "markers": marker_table
+            }
+            install_token_stream()
+            with job_context(job_id), bypass_llm_cache(not use_cache), llm_priority(priority):
+                if execution_mode == "rules":
+                    from rule_engine import get_rules
+                    # Only out-of-range markers fire rules here; a test merely named in the report does not
+                    evaluation = get_rules().evaluate(report_text, markers, mentions=False)
+                    recorder.set(rules=evaluation.model_dump(), rules_only=evaluation.confident)
+                    if evaluation.confident:
+                        logger.info(f"📏 Rules explain job {job_id} ({evaluation.fired}); skipping specialist agents")
+                        result_str = run_rules(inputs, evaluation, recorder)
+                    else:
+                        logger.info(f"📏 Rules left {evaluation.unexplained} unexplained; running specialist agents")
+                        result_str = run_parallel(inputs, recorder)
+                elif execution_mode == "parallel":
+                    result_str = run_parallel(inputs, recorder)
+                else:
+                    result_str = run_sequential(inputs)
 
-        logger.info(f"✅ Analysis completed for job {file_hash}")
+        logger.info(f"✅ Analysis completed for job {job_id}")
         logger.info(f"📊 Result length: {len(result_str)} characters")
 
         
 
         # MONGODB
-        jobs.update_one(
-            {"job_id": file_hash},
-            {"$set": {
-                "status": "finished",
-                "result": result_str,
-                "message": "Analysis complete.",
-                "completed_at": datetime.now().isoformat(),
-                "current_stage": "completed"
-            }}
+        completed_at = datetime.now()
+        JOB_SECONDS.observe(
+            (completed_at - processing_started).total_seconds(), status="finished", execution_mode=execution_mode)
+        recorder.finish(
+            status="finished",
+            stage="completed",
+            message="Analysis complete.",
+            # Results are stored compressed outside the job document (see blob_store.py)
+            result_blob=put_text(result_str),
+            # Estimated report tokens per agent, before and after compaction
+            prompt_tokens=pop_usage(job_id),
+            completed_at=completed_at.isoformat(),
+            duration_seconds=(completed_at - processing_started).total_seconds()
         )
 
-        logger.info(f"💾 Results saved to MongoDB for job {file_hash}")
+        logger.info(f"💾 Results saved to MongoDB for job {job_id} ({recorder.writes} writes)")
+        record_trends(job_id)
+        logger.info(f"⏱️ Stage timings: {recorder.durations()}")
         return result_str
 
+    except LeaseLost as e:
+        # Another worker has claimed the job and will record its outcome
+        pop_usage(job_id)
+        logger.warning(f"⚠️ Abandoning job {job_id}: {e}")
+        raise
+
     except Exception as e:
         error_msg = str(e)
         error_trace = traceback.format_exc()
         
-        logger.error(f"❌ Error processing job {file_hash}: {error_msg}")
+        logger.error(f"❌ Error processing job {job_id}: {error_msg}")
         logger.error(f"📋 Full traceback:\n{error_trace}")
 
         
         # MONGODB
-        jobs.update_one(
-            {"job_id": file_hash},
-            {"$set": {
-                "status": "failed",
-                "result": "",
-                "message": f"Error: {error_msg}",
-                "error_details": error_trace,
-                "failed_at": datetime.now().isoformat(),
-                "current_stage": "failed"
-            }},
-            upsert=True
+        recorder.finish(
+            status="failed",
+            stage="failed",
+            message=f"Error: {error_msg}",
+            error_blob=put_text(error_trace),
+            prompt_tokens=pop_usage(job_id),
+            failed_at=datetime.now().isoformat()
         )
+        # The markers were extracted without the LLM, so they count even if the analysis failed
+        record_trends(job_id)
 
         raise e
 
 
+def record_trends(job_id: str):
+    """Add a job's markers to the trends of the patients its report was uploaded for."""
+    try:
+        job = job_store.get(job_id, READINGS_PROJECTION)
+        if job:
+            record_job(job)
+    except Exception as e:
+        # Trends are a by-product; the job's own outcome stands regardless
+        logger.error(f"❌ Failed to record patient trends for job {job_id}: {e}")
+
+
 def simulate_test_job():
     """
     Simulate a test job similar to test_complete_queue.py
@@ -0,0 +1,422 @@
+import bisect
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+from pymongo import monitoring
+
+
+# Configure logging for telemetry
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# "none" (default), "otlp" (a collector at OTEL_EXPORTER_OTLP_ENDPOINT),
+# "file" (JSON lines at TRACE_FILE_PATH) or "console"
+OTEL_TRACES_EXPORTER = os.environ.get("OTEL_TRACES_EXPORTER", "none")
+OTEL_SERVICE_NAME = os.environ.get("OTEL_SERVICE_NAME", "blood-report-analyzer")
+TRACE_FILE_PATH = os.environ.get("TRACE_FILE_PATH", os.path.join("data", "traces.jsonl"))
+
+# Seconds; covers sub-millisecond Mongo commands up to multi-minute analyses
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+# Metrics
+
+def _label_key(labelnames: tuple, labels: dict) -> tuple:
+    return tuple(str(labels.get(name, "")) for name in labelnames)
+
+
+def _format_labels(labelnames: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _header(self) -> list:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> list:
+        with self._lock:
+            values = dict(self._values)
+        return self._header() + [
+            f"{self.name}{_format_labels(self.labelnames, key)} {value}" for key, value in values.items()]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[_label_key(self.labelnames, labels)] = value
+
+    render = Counter.render
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._values[key] = (counts, total + value)
+
+    def render(self) -> list:
+        with self._lock:
+            values = {key: (list(counts), total) for key, (counts, total) in self._values.items()}
+        lines = self._header()
+        for key, (counts, total) in values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    """Per-process metrics rendered in the Prometheus text format."""
+
+    def __init__(self):
+        self._metrics = {}
+
+    def _register(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: tuple = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: tuple = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: tuple = (),
+                  buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+
+HTTP_REQUEST_SECONDS = metrics.histogram(
+    "http_request_duration_seconds", "HTTP request latency until the response starts.", ("method", "route", "status"))
+JOB_SECONDS = metrics.histogram(
+    "job_duration_seconds", "Wall time of a whole analysis job.", ("status", "execution_mode"))
+JOB_STAGE_SECONDS = metrics.histogram(
+    "job_stage_duration_seconds", "Time spent in each job stage.", ("stage",))
+JOB_QUEUE_DEPTH = metrics.gauge(
+    "job_queue_depth", "Jobs per status, read from the job store when /metrics is scraped.", ("status",))
+UPLOAD_HASH_SECONDS = metrics.histogram(
+    "upload_hash_seconds", "Time spent hashing an upload while it streams to disk.")
+PDF_PARSE_SECONDS = metrics.histogram(
+    "pdf_parse_seconds", "Time to extract the text of a PDF (cache misses only).")
+PDF_PAGE_SECONDS = metrics.histogram(
+    "pdf_page_seconds", "Time to extract one page, by text layer or OCR.", ("method",))
+TASK_SECONDS = metrics.histogram(
+    "crew_task_duration_seconds", "Time an agent spends on one task.", ("task", "agent"))
+LLM_CALL_SECONDS = metrics.histogram(
+    "llm_call_duration_seconds", "LLM call latency, including cache hits and rate limit waits.", ("model",))
+LLM_RATE_LIMIT_WAIT_SECONDS = metrics.histogram(
+    "llm_rate_limit_wait_seconds", "Time an LLM call waited for the shared rate limiter.")
+LLM_TOKENS = metrics.counter(
+    "llm_tokens_total", "Tokens reported by the LLM provider.", ("model", "kind"))
+PROMPT_REPORT_TOKENS = metrics.counter(
+    "prompt_report_tokens_total", "Estimated report tokens given to agents, before (in) and after (out) compaction.",
+    ("agent", "kind"))
+JOB_LOOKUPS = metrics.counter(
+    "job_lookups_total", "Uploads by how they were answered: exact, report (re-answered) or miss.", ("outcome",))
+BLOB_STORE_BYTES = metrics.gauge(
+    "blob_store_bytes", "Bytes on disk in the upload and result stores, as of the last stats request.", ("kind",))
+BLOB_GC_DELETED = metrics.counter(
+    "blob_gc_deleted_total", "Jobs, results and uploads deleted by retention.", ("kind",))
+TREND_READINGS = metrics.counter(
+    "trend_readings_total", "Marker readings stored for patient trends, by where their date came from.",
+    ("date_source",))
+MONGO_COMMAND_SECONDS = metrics.histogram(
+    "mongo_command_duration_seconds", "MongoDB command latency.", ("command",))
+
+
+# Tracing
+
+_tracer = None
+_setup_lock = threading.Lock()
+_setup_done = False
+
+
+class _JsonLinesSpanExporter:
+    """Appends finished spans to a local file, one JSON object per line."""
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+
+    def export(self, spans):
+        from opentelemetry.sdk.trace.export import SpanExportResult
+
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            for span in spans:
+                f.write(span.to_json(indent=None) + "\n")
+        return SpanExportResult.SUCCESS
+
+    def shutdown(self):
+        pass
+
+    def force_flush(self, timeout_millis: int = 30000) -> bool:
+        return True
+
+
+def _build_exporter(name: str):
+    if name == "otlp":
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        return OTLPSpanExporter()
+    if name == "file":
+        return _JsonLinesSpanExporter(TRACE_FILE_PATH)
+    if name == "console":
+        from opentelemetry.sdk.trace.export import ConsoleSpanExporter
+        return ConsoleSpanExporter()
+    raise ValueError(f"Unknown trace exporter: {name}")
+
+
+def setup_tracing(app=None):
+    """
+    Install the span exporter chosen by OTEL_TRACES_EXPORTER, once per
+    process, and instrument the FastAPI app if one is given. A no-op with
+    the default "none", so importing the API never loads the OTel SDK.
+    """
+    global _tracer, _setup_done
+    with _setup_lock:
+        if not _setup_done:
+            _setup_done = True
+            if OTEL_TRACES_EXPORTER != "none":
+                try:
+                    from opentelemetry import trace
+                    from opentelemetry.sdk.resources import Resource
+                    from opentelemetry.sdk.trace import TracerProvider
+                    from opentelemetry.sdk.trace.export import BatchSpanProcessor
+
+                    provider = TracerProvider(resource=Resource.create({"service.name": OTEL_SERVICE_NAME}))
+                    provider.add_span_processor(BatchSpanProcessor(_build_exporter(OTEL_TRACES_EXPORTER)))
+                    trace.set_tracer_provider(provider)
+                    _tracer = trace.get_tracer(__name__)
+                    logger.info(f"🔭 Exporting traces to {OTEL_TRACES_EXPORTER}")
+                except ImportError as e:
+                    logger.warning(f"⚠️ OpenTelemetry SDK not installed, tracing disabled: {e}")
+
+    if app is not None and _tracer is not None:
+        try:
+            from opentelemetry.instrumentation.fastapi import FastAPIInstrumentor
+        except ImportError:
+            logger.warning("⚠️ opentelemetry-instrumentation-fastapi not installed; HTTP requests get no server spans")
+            return
+        FastAPIInstrumentor.instrument_app(app, excluded_urls="metrics,health")
+
+
+def tracing_enabled() -> bool:
+    return _tracer is not None
+
+
+def span(name: str, parent: dict = None, **attributes):
+    """
+    A span around a block, child of the current span (or of the context
+    in `parent`, see inject_context). Costs nothing when tracing is off.
+    """
+    if _tracer is None:
+        return nullcontext()
+    context = None
+    if parent:
+        from opentelemetry.propagate import extract
+        context = extract(parent)
+    return _tracer.start_as_current_span(
+        name, context=context, attributes={k: v for k, v in attributes.items() if v is not None})
+
+
+def set_attributes(**attributes):
+    """Set attributes on the current span, if any."""
+    if _tracer is None:
+        return
+    from opentelemetry import trace
+    current = trace.get_current_span()
+    for key, value in attributes.items():
+        if value is not None:
+            current.set_attribute(key, value)
+
+
+def inject_context() -> dict:
+    """The current trace context as a small dict to store on a job, so the worker's spans join the upload's trace."""
+    if _tracer is None:
+        return {}
+    from opentelemetry.propagate import inject
+    carrier = {}
+    inject(carrier)
+    return carrier
+
+
+def record_stage(name: str, started_at: float, duration: float):
+    """A finished job stage: a histogram sample plus a span covering it (started_at is time.time())."""
+    JOB_STAGE_SECONDS.observe(duration, stage=name)
+    if _tracer is None:
+        return
+    start_ns = int(started_at * 1e9)
+    stage_span = _tracer.start_span(f"stage.{name}", start_time=start_ns)
+    stage_span.end(end_time=start_ns + int(duration * 1e9))
+
+
+@contextmanager
+def timed(histogram: Histogram, span_name: str = None, **labels):
+    """Observe the block's duration on histogram, inside a span when span_name is given."""
+    started = time.perf_counter()
+    with span(span_name, **labels) if span_name else nullcontext():
+        try:
+            yield
+        finally:
+            histogram.observe(time.perf_counter() - started, **labels)
+
+
+# Instrumentation hooks
+
+def install_llm_telemetry(llm):
+    """
+    Wrap llm.call in an llm.call span and record its latency and token
+    counts. Install it outermost, so cache hits and rate limit waits are
+    inside the span.
+    """
+    model = getattr(llm, "model", "") or ""
+    original_call = llm.call
+    track_usage = getattr(llm, "_track_token_usage_internal", None)
+
+    def traced_call(messages, *args, **kwargs):
+        with timed(LLM_CALL_SECONDS, "llm.call", model=model):
+            return original_call(messages, *args, **kwargs)
+
+    object.__setattr__(llm, "call", traced_call)
+
+    if track_usage is not None:
+        # Called from inside the provider call, so the current span is this call's
+        def traced_usage(usage_data, *args, **kwargs):
+            result = track_usage(usage_data, *args, **kwargs)
+            try:
+                prompt = int(usage_data.get("prompt_tokens") or usage_data.get("input_tokens") or 0)
+                completion = int(usage_data.get("completion_tokens") or usage_data.get("output_tokens") or 0)
+            except (AttributeError, TypeError, ValueError):
+                return result
+            LLM_TOKENS.inc(prompt, model=model, kind="prompt")
+            LLM_TOKENS.inc(completion, model=model, kind="completion")
+            set_attributes(**{"llm.prompt_tokens": prompt, "llm.completion_tokens": completion})
+            return result
+
+        object.__setattr__(llm, "_track_token_usage_internal", traced_usage)
+    return llm
+
+
+def instrument_task(task, task_name: str, agent_role: str):
+    """Give one crewai Task instance a span (and a histogram sample) per execution."""
+    original_execute = task.execute_sync
+
+    def traced_execute(*args, **kwargs):
+        with timed(TASK_SECONDS, f"task.{task_name}", task=task_name, agent=agent_role):
+            return original_execute(*args, **kwargs)
+
+    object.__setattr__(task, "execute_sync", traced_execute)
+    return task
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    """
+    pymongo command listener: every command is timed, and commands issued
+    inside a traced block get a child span. Untraced ones (worker polling)
+    only feed the histogram, so idle workers do not flood the collector.
+    """
+
+    def __init__(self):
+        self._spans = {}
+        self._lock = threading.Lock()
+
+    def started(self, event):
+        if _tracer is None:
+            return
+        from opentelemetry import trace
+        if not trace.get_current_span().get_span_context().is_valid:
+            return
+        command_span = _tracer.start_span(
+            f"mongo.{event.command_name}",
+            attributes={"db.system": "mongodb", "db.name": event.database_name,
+                        "db.operation": event.command_name})
+        with self._lock:
+            self._spans[(event.request_id, event.operation_id)] = command_span
+
+    def _finish(self, event, error: str = None):
+        MONGO_COMMAND_SECONDS.observe(event.duration_micros / 1e6, command=event.command_name)
+        with self._lock:
+            command_span = self._spans.pop((event.request_id, event.operation_id), None)
+        if command_span is not None:
+            if error:
+                command_span.set_attribute("error", error)
+            command_span.end()
+
+    def succeeded(self, event):
+        self._finish(event)
+
+    def failed(self, event):
+        self._finish(event, str(event.failure))
+
+
+def mongo_event_listeners() -> list:
+    """Listeners to pass to MongoClient(event_listeners=...)."""
+    return [MongoCommandListener()]
+
+
+def read_spans(path: str = TRACE_FILE_PATH) -> list:
+    """Spans written by the "file" exporter, for ad-hoc analysis."""
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+if __name__ == "__main__":
+    import sys
+    from collections import defaultdict
+
+    # python telemetry.py [path]: where time went, per span name, in a traces file
+    spans = read_spans(sys.argv[1] if len(sys.argv) > 1 else TRACE_FILE_PATH)
+    totals = defaultdict(list)
+    for item in spans:
+        duration = (datetime.fromisoformat(item["end_time"].replace("Z", "+00:00"))
+                    - datetime.fromisoformat(item["start_time"].replace("Z", "+00:00"))).total_seconds()
+        totals[item["name"]].append(duration)
+    for name, durations in sorted(totals.items(), key=lambda entry: -sum(entry[1])):
+        logger.info(f"⏱️ {name}: {len(durations)} span(s), {sum(durations):.3f}s total, {max(durations):.3f}s max")
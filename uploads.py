@@ -0,0 +1,160 @@
+import hashlib
+import logging
+import os
+import tempfile
+import time
+import zipfile
+from fastapi import HTTPException, UploadFile
+from starlette.concurrency import run_in_threadpool
+from blob_store import UPLOAD_DIR, store_pdf
+from telemetry import UPLOAD_HASH_SECONDS, set_attributes
+
+
+# Configure logging for uploads
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+UPLOAD_CHUNK_SIZE = int(os.environ.get("UPLOAD_CHUNK_SIZE", str(1024 * 1024)))
+MAX_UPLOAD_BYTES = int(os.environ.get("MAX_UPLOAD_BYTES", str(25 * 1024 * 1024)))
+MAX_ARCHIVE_BYTES = int(os.environ.get("MAX_ARCHIVE_BYTES", str(200 * 1024 * 1024)))
+MAX_BATCH_FILES = int(os.environ.get("MAX_BATCH_FILES", "100"))
+PDF_MAGIC = b"%PDF-"
+ZIP_MAGIC = b"PK\x03\x04"
+
+
+def _too_large(max_bytes: int) -> HTTPException:
+    return HTTPException(
+        status_code=413, detail=f"File is larger than the {max_bytes // (1024 * 1024)} MB limit.")
+
+
+def _not_a_pdf() -> HTTPException:
+    return HTTPException(status_code=400, detail="File is not a valid PDF.")
+
+
+def _not_a_zip() -> HTTPException:
+    return HTTPException(status_code=400, detail="File is not a valid zip archive.")
+
+
+async def _stream_to_temp(file: UploadFile, dest_dir: str, max_bytes: int, magic: bytes, invalid):
+    """
+    Stream an upload into a temporary file in dest_dir, hashing and
+    size-checking it and validating its magic bytes as the chunks arrive.
+    Returns (sha256 hex digest, temp path, size); the caller owns the temp file.
+    """
+    # Reject early when the client told us the size up front
+    if getattr(file, "size", None) and file.size > max_bytes:
+        raise _too_large(max_bytes)
+
+    os.makedirs(dest_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=dest_dir, suffix=".part")
+    sha = hashlib.sha256()
+    hash_seconds = 0.0
+    size = 0
+    head = b""
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while True:
+                chunk = await file.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                if len(head) < len(magic):
+                    head += chunk[:len(magic) - len(head)]
+                    if len(head) == len(magic) and head != magic:
+                        raise invalid()
+                size += len(chunk)
+                if size > max_bytes:
+                    raise _too_large(max_bytes)
+                hash_started = time.perf_counter()
+                sha.update(chunk)
+                hash_seconds += time.perf_counter() - hash_started
+                await run_in_threadpool(out.write, chunk)
+
+        if head != magic:
+            raise invalid()
+        UPLOAD_HASH_SECONDS.observe(hash_seconds)
+        set_attributes(**{"upload.bytes": size, "upload.hash_seconds": round(hash_seconds, 6)})
+        return sha.hexdigest(), tmp_path, size
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+async def save_upload(file: UploadFile, dest_dir: str = UPLOAD_DIR, max_bytes: int = MAX_UPLOAD_BYTES):
+    """
+    Stream an upload to its shard under dest_dir (see blob_store.py) in fixed-size chunks.
+    The hash, the size limit and the PDF magic bytes are all checked while
+    streaming, so memory use does not depend on the file size.
+    Returns (file_hash, file_path, size).
+    """
+    file_hash, tmp_path, size = await _stream_to_temp(file, dest_dir, max_bytes, PDF_MAGIC, _not_a_pdf)
+    file_path = store_pdf(tmp_path, file_hash, dest_dir)
+    logger.info(f"📥 Stored upload {file_hash} ({size} bytes)")
+    return file_hash, file_path, size
+
+
+def _store_archive_member(archive: zipfile.ZipFile, info: zipfile.ZipInfo, dest_dir: str, max_bytes: int):
+    # The declared size can lie, so the limit is enforced on the bytes we actually read
+    if info.file_size > max_bytes:
+        raise _too_large(max_bytes)
+    fd, tmp_path = tempfile.mkstemp(dir=dest_dir, suffix=".part")
+    sha = hashlib.sha256()
+    size = 0
+    try:
+        with os.fdopen(fd, "wb") as out, archive.open(info) as member:
+            while True:
+                chunk = member.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                if size == 0 and not chunk.startswith(PDF_MAGIC):
+                    raise HTTPException(
+                        status_code=400, detail=f"{info.filename} in the archive is not a valid PDF.")
+                size += len(chunk)
+                if size > max_bytes:
+                    raise _too_large(max_bytes)
+                sha.update(chunk)
+                out.write(chunk)
+        file_hash = sha.hexdigest()
+        return file_hash, store_pdf(tmp_path, file_hash, dest_dir), size
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _extract_archive(archive_path: str, dest_dir: str, max_bytes: int, max_members: int) -> list:
+    try:
+        archive = zipfile.ZipFile(archive_path)
+    except zipfile.BadZipFile:
+        raise _not_a_zip()
+    with archive:
+        members = [
+            info for info in archive.infolist()
+            if not info.is_dir() and info.filename.lower().endswith(".pdf")
+            and not os.path.basename(info.filename).startswith(".")
+        ]
+        if not members:
+            raise HTTPException(status_code=400, detail="Archive does not contain any PDF files.")
+        if len(members) > max_members:
+            raise HTTPException(
+                status_code=400, detail=f"Archive contains more than {max_members} PDF files.")
+        return [
+            (os.path.basename(info.filename), *_store_archive_member(archive, info, dest_dir, max_bytes))
+            for info in members
+        ]
+
+
+async def save_archive(file: UploadFile, dest_dir: str = UPLOAD_DIR, max_bytes: int = MAX_UPLOAD_BYTES,
+                       max_archive_bytes: int = MAX_ARCHIVE_BYTES, max_members: int = MAX_BATCH_FILES):
+    """
+    Stream a zip upload to disk and store every PDF inside it in its shard
+    under dest_dir, applying the per-file size limit to each one.
+    Returns a list of (file_name, file_hash, file_path, size).
+    """
+    _, tmp_path, size = await _stream_to_temp(file, dest_dir, max_archive_bytes, ZIP_MAGIC, _not_a_zip)
+    try:
+        stored = await run_in_threadpool(_extract_archive, tmp_path, dest_dir, max_bytes, max_members)
+    finally:
+        os.remove(tmp_path)
+    logger.info(f"📦 Stored {len(stored)} PDF(s) from archive {file.filename} ({size} bytes)")
+    return stored
@@ -0,0 +1,230 @@
+import logging
+import multiprocessing
+import os
+import socket
+import threading
+import uuid
+from blob_store import BlobCollector
+from job_store import JobStore, LeaseLost
+from tasks import process_blood_report
+from telemetry import set_attributes, setup_tracing, span
+
+
+# Configure logging for workers
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# MONGODB
+job_store = JobStore()
+
+# Worker pool configuration
+WORKER_MODE = os.environ.get("WORKER_MODE", "thread")  # "thread" or "process"
+WORKER_COUNT = int(os.environ.get("WORKER_COUNT", "2"))
+# A running job heartbeats every JOB_HEARTBEAT_SECONDS; one without a heartbeat
+# for JOB_LEASE_SECONDS is treated as abandoned and run again
+JOB_LEASE_SECONDS = int(os.environ.get("JOB_LEASE_SECONDS", "60"))
+JOB_HEARTBEAT_SECONDS = float(os.environ.get("JOB_HEARTBEAT_SECONDS", "10"))
+JOB_MAX_ATTEMPTS = int(os.environ.get("JOB_MAX_ATTEMPTS", "3"))
+POLL_INTERVAL_SECONDS = float(os.environ.get("WORKER_POLL_INTERVAL", "1.0"))
+# How often each pool fails jobs whose last allowed attempt lost its lease,
+# whether or not the queue is busy
+EXHAUSTED_SWEEP_SECONDS = float(os.environ.get("EXHAUSTED_SWEEP_SECONDS", "30"))
+
+
+def claim_next_job(worker_id: str):
+    """Claim the next queued (or abandoned) job, or return None when the queue is empty."""
+    return job_store.claim(worker_id, JOB_LEASE_SECONDS, JOB_MAX_ATTEMPTS)
+
+
+def fail_exhausted_jobs():
+    """Mark jobs whose lease expired after the last allowed attempt as failed."""
+    failed = job_store.fail_exhausted(JOB_MAX_ATTEMPTS)
+    if failed:
+        logger.warning(f"⚠️ Marked {failed} abandoned job(s) as failed")
+
+
+class ExhaustedJobSweeper:
+    """
+    Runs fail_exhausted_jobs every EXHAUSTED_SWEEP_SECONDS in a background
+    thread. Claims skip exhausted jobs, so on a busy queue nothing else
+    would fail them, and a batch job among them would hold its slot forever.
+    """
+
+    def __init__(self, interval: float = EXHAUSTED_SWEEP_SECONDS):
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                fail_exhausted_jobs()
+            except Exception as e:
+                logger.error(f"❌ Could not fail exhausted jobs: {e}")
+
+    def start(self):
+        if self.interval > 0:
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+
+
+def release_batch_slot(batch_id: str):
+    """Queue the batch's next pending job now that one of its jobs has finished."""
+    try:
+        promoted = job_store.promote_next(batch_id)
+    except Exception as e:
+        logger.error(f"❌ Could not promote next job of batch {batch_id}: {e}")
+        return
+    if promoted:
+        logger.info(f"📦 Queued job {promoted['job_id']} from batch {batch_id}")
+
+
+class LeaseKeeper:
+    """
+    Heartbeats a job in the background while a worker is running it,
+    renewing its lease. Sets `lost` if another worker has claimed the job.
+    """
+
+    def __init__(self, job_id: str, worker_id: str):
+        self.job_id = job_id
+        self.worker_id = worker_id
+        self.lost = threading.Event()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._renew, daemon=True)
+
+    def _renew(self):
+        # At least three heartbeats per lease, so one slow write does not lose the job
+        interval = max(min(JOB_HEARTBEAT_SECONDS, JOB_LEASE_SECONDS / 3), 0.1)
+        while not self._stop.wait(interval):
+            try:
+                held = job_store.renew_lease(self.job_id, self.worker_id, JOB_LEASE_SECONDS)
+            except Exception as e:
+                # A timeout or failover; the next heartbeat retries before the lease runs out
+                logger.error(f"❌ Could not renew the lease of job {self.job_id}: {e}")
+                continue
+            if not held:
+                logger.warning(f"⚠️ Worker {self.worker_id} lost the lease of job {self.job_id}")
+                self.lost.set()
+                return
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        return False
+
+
+def run_worker(worker_id: str, stop_event):
+    """Claim and process jobs until stop_event is set."""
+    # Process workers are fresh interpreters and need their own exporter
+    setup_tracing()
+    logger.info(f"👷 Worker {worker_id} started")
+    while not stop_event.is_set():
+        try:
+            job = claim_next_job(worker_id)
+        except Exception as e:
+            logger.error(f"❌ Worker {worker_id} could not claim a job: {e}")
+            stop_event.wait(POLL_INTERVAL_SECONDS)
+            continue
+
+        if job is None:
+            stop_event.wait(POLL_INTERVAL_SECONDS)
+            continue
+
+        job_id = job["job_id"]
+        logger.info(f"🔧 Worker {worker_id} claimed job {job_id} (attempt {job.get('attempts')})")
+        # Continues the trace of the upload that queued the job
+        with LeaseKeeper(job_id, worker_id) as lease, span(
+                "job.process", parent=job.get("trace_context"),
+                **{"job.id": job_id, "job.attempt": job.get("attempts"), "job.batch_id": job.get("batch_id"),
+                   "worker.id": worker_id}):
+            try:
+                process_blood_report(
+                    job.get("query", ""),
+                    job["file_path"],
+                    job_id,
+                    execution_mode=job.get("execution_mode"),
+                    use_cache=not job.get("no_cache", False),
+                    # Batch jobs yield LLM quota to interactive uploads
+                    priority="batch" if job.get("batch_id") else "interactive",
+                    base_job_id=job.get("base_job_id"),
+                    worker_id=worker_id,
+                    lease_lost=lease.lost
+                )
+            except LeaseLost as e:
+                # The worker that claimed the job after us finishes it and frees the batch slot
+                set_attributes(error=str(e))
+                logger.warning(f"⚠️ Worker {worker_id} abandoned job {job_id}: {e}")
+                continue
+            except Exception as e:
+                # process_blood_report already stored the failure on the job
+                set_attributes(error=str(e))
+                logger.error(f"❌ Worker {worker_id} failed job {job_id}: {e}")
+        if job.get("batch_id"):
+            release_batch_slot(job["batch_id"])
+    logger.info(f"👋 Worker {worker_id} stopped")
+
+
+class WorkerPool:
+    """A pool of worker threads or processes draining the jobs queue."""
+
+    def __init__(self, size: int = WORKER_COUNT, mode: str = WORKER_MODE):
+        if mode not in ("thread", "process"):
+            raise ValueError(f"Unknown worker mode: {mode}")
+        self.size = size
+        self.mode = mode
+        self._workers = []
+        # Retention for uploads, results and old jobs runs alongside the workers
+        self._collector = BlobCollector(job_store)
+        self._sweeper = ExhaustedJobSweeper()
+        if mode == "process":
+            # spawn, not fork: the pooled MongoClient is not fork-safe
+            self._ctx = multiprocessing.get_context("spawn")
+            self._stop = self._ctx.Event()
+        else:
+            self._stop = threading.Event()
+
+    def start(self):
+        prefix = f"{socket.gethostname()}-{os.getpid()}"
+        for i in range(self.size):
+            worker_id = f"{prefix}-{i}-{uuid.uuid4().hex[:6]}"
+            if self.mode == "process":
+                worker = self._ctx.Process(
+                    target=run_worker, args=(worker_id, self._stop), daemon=True)
+            else:
+                worker = threading.Thread(
+                    target=run_worker, args=(worker_id, self._stop), daemon=True)
+            worker.start()
+            self._workers.append(worker)
+        self._collector.start()
+        self._sweeper.start()
+        logger.info(f"🏭 Started {self.size} {self.mode} worker(s)")
+
+    def stop(self, timeout: float = 10.0):
+        self._stop.set()
+        self._collector.stop()
+        self._sweeper.stop()
+        for worker in self._workers:
+            worker.join(timeout)
+        self._workers = []
+
+
+if __name__ == "__main__":
+    # Run a standalone pool, e.g. on another machine pointed at the same MongoDB
+    job_store.ensure_indexes()
+    from patient_trends import get_trend_store
+    get_trend_store().ensure_indexes()
+    pool = WorkerPool()
+    pool.start()
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        logger.info("🛑 Stopping workers...")
+        pool.stop()